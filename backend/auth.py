@@ -15,9 +15,13 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 JWT_SECRET = os.environ.get("JWT_SECRET", "your-super-secret-key-change-in-production")
 JWT_ALGORITHM = os.environ.get("JWT_ALGORITHM", "HS256")
 JWT_EXPIRATION_HOURS = int(os.environ.get("JWT_EXPIRATION_HOURS", "24"))
+# ?token= for /api/events ends up in access logs, so it gets its own short-lived token
+STREAM_TOKEN_SECONDS = int(os.environ.get("STREAM_TOKEN_SECONDS", "60"))
+STREAM_SCOPE = "events"
 
 # Security
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -39,9 +43,20 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
-def decode_token(token: str) -> Optional[TokenData]:
+def create_stream_token(user: TokenData) -> str:
+    """Token that only opens the event stream"""
+    return create_access_token(
+        {"user_id": user.user_id, "username": user.username, "role": user.role, "scope": STREAM_SCOPE},
+        timedelta(seconds=STREAM_TOKEN_SECONDS)
+    )
+
+
+def decode_token(token: str, scope: Optional[str] = None) -> Optional[TokenData]:
+    """Session tokens have no scope; a scoped token is only accepted where that scope is asked for"""
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        if payload.get("scope") != scope:
+            return None
         user_id: str = payload.get("user_id")
         username: str = payload.get("username")
         role: str = payload.get("role")
@@ -64,6 +79,29 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     return token_data
 
 
+async def get_stream_user(
+    token: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+) -> TokenData:
+    """Like get_current_user, but also accepts ?token= (a stream token) since EventSource cannot send headers"""
+    if credentials:
+        token_data = decode_token(credentials.credentials)
+    else:
+        token_data = decode_token(token or "", scope=STREAM_SCOPE)
+    if token_data is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if token_data.role not in [UserRole.SUPER_ADMIN.value, UserRole.ADMIN.value, UserRole.SUPPORT.value]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Support access required"
+        )
+    return token_data
+
+
 async def require_super_admin(current_user: TokenData = Depends(get_current_user)) -> TokenData:
     if current_user.role != UserRole.SUPER_ADMIN.value:
         raise HTTPException(
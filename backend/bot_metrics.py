@@ -0,0 +1,82 @@
+"""
+Bot-side metrics: per-handler latency and Telegram Bot API call timings,
+exposed on a separate HTTP port for Prometheus to scrape
+"""
+
+import functools
+import os
+import time
+
+from prometheus_client import Counter, Histogram, start_http_server
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+from metrics import LATENCY_BUCKETS
+from query_recorder import operation
+
+BOT_METRICS_PORT = int(os.environ.get("BOT_METRICS_PORT", "9101"))
+
+handler_calls = Counter("bot_handler_calls_total", "Bot handler invocations", ["handler", "outcome"])
+handler_latency = Histogram("bot_handler_duration_seconds", "Bot handler latency", ["handler"], buckets=LATENCY_BUCKETS)
+
+telegram_calls = Counter("telegram_api_calls_total", "Bot API calls", ["method", "status"])
+telegram_latency = Histogram("telegram_api_duration_seconds", "Bot API call latency", ["method"], buckets=LATENCY_BUCKETS)
+
+# Extra callbacks (handler name, seconds, outcome) run after every handler, e.g. by the bot benchmark
+handler_observers = []
+
+
+def timed(callback):
+    """Wrap a handler callback to record its latency"""
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        outcome = "success"
+        try:
+            with operation(f"bot:{name}"):
+                return await callback(update, context)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            handler_calls.labels(name, outcome).inc()
+            handler_latency.labels(name).observe(seconds)
+            for observe in handler_observers:
+                observe(name, seconds, outcome)
+
+    return wrapper
+
+
+def instrument_handlers(handlers):
+    """Wrap the callbacks of handlers (recursing into conversations) in place"""
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            instrument_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                instrument_handlers(state_handlers)
+            instrument_handlers(handler.fallbacks)
+        elif not getattr(handler.callback, "__wrapped__", None):
+            handler.callback = timed(handler.callback)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that times every Bot API call by method name"""
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        status = "error"
+        try:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+            status = str(code)
+            return code, payload
+        finally:
+            telegram_calls.labels(api_method, status).inc()
+            telegram_latency.labels(api_method).observe(time.perf_counter() - started)
+
+
+def start_metrics_server():
+    start_http_server(BOT_METRICS_PORT)
@@ -0,0 +1,241 @@
+"""
+Shared MongoDB access for the API and the bot
+
+The client is created on first use in each process (so workers forked from a
+preloaded parent never share its sockets or monitor threads) with the pool,
+timeout and compression settings below. Collections get read/write concerns
+by use case, and both processes import the same handles:
+
+    from database import configure, orders_col
+    configure(app_name="v2ray-telegram-bot")    # before the first query
+
+Reports read through analytics_db, which prefers secondaries of a replica
+set (bounded by ANALYTICS_MAX_STALENESS_SECONDS) so heavy admin queries do
+not compete with checkout traffic on the primary. On a standalone server
+the read preference has no effect.
+"""
+
+import os
+import threading
+
+from pymongo import MongoClient, ReadPreference
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import SecondaryPreferred
+from pymongo.write_concern import WriteConcern
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.environ.get("DB_NAME", "v2ray_bot")
+
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "100"))
+# Connections opened in the background right after startup, so the first requests do not pay for the handshake
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "5"))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+# Wire compression, e.g. "zstd,snappy,zlib" for a remote server; empty disables it
+MONGO_COMPRESSORS = os.environ.get("MONGO_COMPRESSORS", "")
+MONGO_WRITE_TIMEOUT_MS = int(os.environ.get("MONGO_WRITE_TIMEOUT_MS", "5000"))
+# The server rejects values below 90 seconds
+ANALYTICS_MAX_STALENESS_SECONDS = max(90, int(os.environ.get("ANALYTICS_MAX_STALENESS_SECONDS", "120")))
+
+# Concerns per use case
+CONCERNS = {
+    # Money and entitlements: acknowledged by a majority so a failover cannot roll them back
+    "critical": {"write_concern": WriteConcern("majority", wtimeout=MONGO_WRITE_TIMEOUT_MS), "read_concern": ReadConcern("majority")},
+    # High-volume history that may lose the last writes on failover
+    "telemetry": {"write_concern": WriteConcern(w=1)},
+    "default": {},
+}
+
+# Read routing per use case, applied on top of the collection's concerns
+READ_USES = {
+    "analytics": {
+        "read_preference": SecondaryPreferred(max_staleness=ANALYTICS_MAX_STALENESS_SECONDS),
+        "read_concern": ReadConcern("local"),
+    },
+}
+
+COLLECTION_CONCERNS = {
+    "orders": "critical",
+    "payments": "critical",
+    "subscriptions": "critical",
+    "telegram_users": "critical",
+    "resellers": "critical",
+    "discount_codes": "critical",
+    "server_health": "telemetry",
+    "slow_queries": "telemetry",
+}
+
+_lock = threading.Lock()
+_options = {"appname": "v2ray"}
+_pid = None
+_client = None
+_collections = {}
+_topology = {}
+
+
+def available_compressors(names: str) -> list:
+    """Requested compressors whose Python packages are installed"""
+    modules = {"zstd": "zstandard", "snappy": "snappy", "zlib": None}
+    result = []
+    for name in (n.strip() for n in names.split(",")):
+        if name not in modules:
+            continue
+        if modules[name]:
+            try:
+                __import__(modules[name])
+            except ImportError:
+                print(f"Mongo compressor {name} skipped: {modules[name]} is not installed")
+                continue
+        result.append(name)
+    return result
+
+
+def configure(app_name: str = None, **client_options):
+    """Set the application name and client option overrides for this process"""
+    with _lock:
+        if _client is not None and _pid == os.getpid():
+            raise RuntimeError("configure() must be called before the first query")
+        if app_name:
+            _options["appname"] = app_name
+        _options.update(client_options)
+
+
+def client_options() -> dict:
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "retryWrites": True,
+    }
+    compressors = available_compressors(MONGO_COMPRESSORS)
+    if compressors:
+        options["compressors"] = compressors
+    options.update(_options)
+    return options
+
+
+def get_client() -> MongoClient:
+    """MongoClient of the current process (a new one after fork)"""
+    global _pid, _client, _collections
+    if _client is None or _pid != os.getpid():
+        with _lock:
+            if _client is None or _pid != os.getpid():
+                _client = MongoClient(MONGO_URL, **client_options())
+                _collections = {}
+                _pid = os.getpid()
+    return _client
+
+
+def get_database():
+    return get_client()[DB_NAME]
+
+
+def get_collection(name: str, use: str = None):
+    get_client()
+    collection = _collections.get((name, use))
+    if collection is None:
+        options = dict(CONCERNS[COLLECTION_CONCERNS.get(name, "default")])
+        if use:
+            options.update(READ_USES[use])
+        collection = _collections[(name, use)] = get_database().get_collection(name, **options)
+    return collection
+
+
+def is_replica_set() -> bool:
+    """Whether the server supports transactions and change streams (replica set or mongos)"""
+    if _topology.get("pid") != os.getpid():
+        hello = get_client().admin.command("hello")
+        _topology.update(pid=os.getpid(), replica_set=bool(hello.get("setName")) or hello.get("msg") == "isdbgrid")
+    return _topology["replica_set"]
+
+
+def run_transaction(callback):
+    """callback(session) in a majority-committed transaction, retried on transient errors
+
+    On a standalone server, which has no transactions, callback(None) runs the
+    writes one by one; pass the session on to every operation either way.
+    """
+    if not is_replica_set():
+        return callback(None)
+    with get_client().start_session() as session:
+        return session.with_transaction(
+            callback,
+            read_concern=CONCERNS["critical"]["read_concern"],
+            write_concern=CONCERNS["critical"]["write_concern"],
+            read_preference=ReadPreference.PRIMARY,
+        )
+
+
+def warmup():
+    """Connect now instead of on the first request"""
+    get_client().admin.command("ping")
+
+
+def close_client():
+    global _client
+    with _lock:
+        if _client is not None and _pid == os.getpid():
+            _client.close()
+        _client = None
+
+
+class LazyCollection:
+    """Module-level stand-in for a Collection, resolved per process on use"""
+
+    def __init__(self, name: str, use: str = None):
+        self._name = name
+        self._use = use
+
+    def __getattr__(self, attr):
+        return getattr(get_collection(self._name, self._use), attr)
+
+    def __getitem__(self, name):
+        return get_collection(self._name, self._use)[name]
+
+    def __repr__(self):
+        return f"LazyCollection({self._name!r}, use={self._use!r})"
+
+
+class LazyDatabase:
+    """Module-level stand-in for the Database: db["orders"] returns a LazyCollection"""
+
+    def __init__(self, use: str = None):
+        self._use = use
+        self._handles = {}
+
+    def __getitem__(self, name: str) -> LazyCollection:
+        handle = self._handles.get(name)
+        if handle is None:
+            handle = self._handles[name] = LazyCollection(name, self._use)
+        return handle
+
+    def __getattr__(self, attr):
+        return getattr(get_database(), attr)
+
+
+db = LazyDatabase()
+# Dashboards, reports and exports; may lag the primary by up to ANALYTICS_MAX_STALENESS_SECONDS
+analytics_db = LazyDatabase("analytics")
+
+# Collections
+admins_col = db["admins"]
+users_col = db["telegram_users"]
+servers_col = db["servers"]
+categories_col = db["categories"]
+plans_col = db["plans"]
+orders_col = db["orders"]
+payments_col = db["payments"]
+discounts_col = db["discount_codes"]
+departments_col = db["departments"]
+tickets_col = db["tickets"]
+resellers_col = db["resellers"]
+settings_col = db["bot_settings"]
+subscriptions_col = db["subscriptions"]
+versions_col = db["collection_versions"]
@@ -0,0 +1,100 @@
+"""
+Conditional GET for rarely-changing catalog endpoints: every write to a
+collection bumps its version counter and the ETag is derived from the counters.
+The same counters invalidate process-local caches (VersionedCache).
+"""
+
+import hashlib
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Iterable, Optional
+
+# How often a VersionedCache looks at its counter, i.e. how stale another process's write may be seen
+VERSION_CHECK_SECONDS = float(os.environ.get("VERSION_CHECK_SECONDS", "5"))
+
+from fastapi import Depends, HTTPException, Request, Response
+
+from auth import get_current_user
+from models import TokenData
+
+
+def bump_version(versions_col, *names: str):
+    """Invalidate cached responses built from the given collections"""
+    for name in names:
+        versions_col.update_one(
+            {"_id": name},
+            {"$inc": {"version": 1}, "$setOnInsert": {"epoch": str(uuid.uuid4())}},
+            upsert=True
+        )
+
+
+def collection_etag(versions_col, names: Iterable[str]) -> str:
+    """Strong ETag for the current versions of the given collections"""
+    names = sorted(names)
+    versions = {doc["_id"]: doc for doc in versions_col.find({"_id": {"$in": names}})}
+    key = "|".join(
+        f"{name}:{versions.get(name, {}).get('epoch', '')}:{versions.get(name, {}).get('version', 0)}"
+        for name in names
+    )
+    return '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+
+
+def conditional_get(versions_col, *names: str, auth: Callable = get_current_user):
+    """Dependency answering If-None-Match with 304 before the route touches its data
+
+    auth is the route's own role dependency, so a user without access learns nothing from the ETag.
+    """
+    async def dependency(request: Request, response: Response, current_user: TokenData = Depends(auth)):
+        etag = collection_etag(versions_col, names)
+        if_none_match = request.headers.get("if-none-match")
+        # Weak comparison: compression middleware turns the ETag into W/"..."
+        if if_none_match and etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+            raise HTTPException(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "private, no-cache"
+    return dependency
+
+
+class VersionedCache:
+    """Process-local copy of a small collection as {key: doc}, reloaded when its version counter moves
+
+    The counter is read at most every check_seconds, so a cache hit costs no round trip.
+    """
+
+    def __init__(self, versions_col, name: str, loader: Callable[[], dict], check_seconds: float = VERSION_CHECK_SECONDS):
+        self.versions_col = versions_col
+        self.name = name
+        self.loader = loader
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._data = None
+        self._version = None
+        self._checked = 0.0
+
+    def _current_version(self):
+        doc = self.versions_col.find_one({"_id": self.name}) or {}
+        return doc.get("epoch"), doc.get("version", 0)
+
+    def get(self) -> dict:
+        with self._lock:
+            if self._data is None or time.monotonic() - self._checked > self.check_seconds:
+                version = self._current_version()
+                if self._data is None or version != self._version:
+                    self._data = self.loader()
+                    self._version = version
+                self._checked = time.monotonic()
+            return self._data
+
+    def lookup(self, key) -> Optional[dict]:
+        """One entry; a miss reloads once, in case it was added since the last check"""
+        item = self.get().get(key)
+        if item is None:
+            self.invalidate()
+            item = self.get().get(key)
+        return item
+
+    def invalidate(self):
+        with self._lock:
+            self._data = None
@@ -0,0 +1,222 @@
+"""
+Live admin events pushed over /api/events (Server-Sent Events)
+
+Each API worker runs one event source however many admins are connected,
+started with the first subscriber:
+
+- on a replica set (or mongos), a single change stream on the database
+  sees every write, including the bot's and the other workers';
+- on a standalone server, a poller picks up new payments and tickets (most
+  of them come from the bot), and the API's own changes are published
+  in-process with event_hub.publish(). Changes made by another worker are
+  not seen there, so run a replica set with several workers.
+
+Events are dicts {"type", "data", "at"} with the types in EVENT_TYPES.
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+from datetime import datetime
+from typing import List, Optional
+
+import orjson
+from pymongo.errors import PyMongoError
+
+from database import get_database, is_replica_set
+from metrics import events_subscribers
+from query_recorder import operation
+
+EVENTS_POLL_SECONDS = float(os.environ.get("EVENTS_POLL_SECONDS", "3"))
+EVENTS_HEARTBEAT_SECONDS = float(os.environ.get("EVENTS_HEARTBEAT_SECONDS", "15"))
+EVENTS_RETRY_SECONDS = float(os.environ.get("EVENTS_RETRY_SECONDS", "5"))
+# Per connection; a client that falls this far behind loses the oldest events
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", "100"))
+
+PAYMENT_CREATED = "payment.created"
+TICKET_CREATED = "ticket.created"
+TICKET_REPLY = "ticket.reply"
+ORDER_STATUS = "order.status"
+EVENT_TYPES = (PAYMENT_CREATED, TICKET_CREATED, TICKET_REPLY, ORDER_STATUS)
+# Roles limited to some events; the others get all of them
+ROLE_EVENTS = {"support": (TICKET_CREATED, TICKET_REPLY)}
+
+# The resume token fell off the oplog, so the stream restarts from now
+CHANGE_STREAM_HISTORY_LOST = 286
+
+# Event payloads, small enough for a toast; the pages refetch what they show
+EVENT_FIELDS = {
+    "payments": ["id", "order_id", "amount", "status", "created_at"],
+    "tickets": ["id", "subject", "department_id", "priority", "status", "telegram_user_id", "created_at"],
+    "orders": ["id", "status", "telegram_user_id", "plan_id", "final_price"],
+    "ticket_messages": ["ticket_id", "id", "is_admin", "admin_username", "created_at"],
+}
+INSERT_EVENTS = {"payments": PAYMENT_CREATED, "tickets": TICKET_CREATED, "ticket_messages": TICKET_REPLY}
+
+CHANGE_PIPELINE = [
+    {"$match": {"$or": [
+        {"operationType": "insert", "ns.coll": {"$in": ["payments", "tickets"]}},
+        # Users only write the opening message, which ticket.created already covers
+        {"operationType": "insert", "ns.coll": "ticket_messages", "fullDocument.is_admin": True},
+        {"operationType": "update", "ns.coll": "orders", "updateDescription.updatedFields.status": {"$exists": True}},
+    ]}},
+    {"$project": {
+        "operationType": 1,
+        "ns": 1,
+        # Only the fields the events use (orders come back whole with updateLookup)
+        **{f"fullDocument.{field}": 1 for fields in EVENT_FIELDS.values() for field in fields},
+    }},
+]
+
+
+def make_event(event_type: str, data: dict) -> dict:
+    return {"type": event_type, "data": data, "at": datetime.utcnow()}
+
+
+def pick(doc: dict, fields: List[str]) -> dict:
+    return {field: doc.get(field) for field in fields}
+
+
+def event_from_change(change: dict) -> Optional[dict]:
+    collection = change["ns"]["coll"]
+    doc = change.get("fullDocument") or {}
+    if change["operationType"] == "insert" and collection in INSERT_EVENTS:
+        return make_event(INSERT_EVENTS[collection], pick(doc, EVENT_FIELDS[collection]))
+    if collection == "orders":
+        return make_event(ORDER_STATUS, pick(doc, EVENT_FIELDS["orders"]))
+    return None
+
+
+def poll_new(db, collection: str, since: datetime, seen: set):
+    """Documents created since the last poll, and the cursor for the next one"""
+    docs = list(db[collection].find(
+        {"created_at": {"$gte": since}}, {"_id": 0, **{f: 1 for f in EVENT_FIELDS[collection]}}
+    ).sort("created_at", 1).limit(500))
+    new = [doc for doc in docs if doc["id"] not in seen]
+    if docs:
+        since = docs[-1]["created_at"]
+        # Rows sharing the boundary timestamp come back next time; skip the ones already sent
+        seen = {doc["id"] for doc in docs if doc["created_at"] == since}
+    return new, since, seen
+
+
+def format_sse(event: dict) -> bytes:
+    return b"event: " + event["type"].encode() + b"\ndata: " + orjson.dumps(event, default=str) + b"\n\n"
+
+
+class EventHub:
+    def __init__(self):
+        self._subscribers = set()
+        self._loop = None
+        self._task = None
+        self._source = None
+        self._start_lock = asyncio.Lock()
+        self._stop = threading.Event()
+
+    @property
+    def source(self) -> Optional[str]:
+        return self._source
+
+    async def subscribe(self) -> asyncio.Queue:
+        await self.start()
+        queue = asyncio.Queue(EVENTS_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        events_subscribers.inc()
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self._subscribers:
+            self._subscribers.discard(queue)
+            events_subscribers.dec()
+
+    def _deliver(self, event: dict):
+        for queue in list(self._subscribers):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def publish(self, event_type: str, data: dict):
+        """Event for a change made by this process (only needed without a change stream)"""
+        if self._source == "poll" and self._subscribers:
+            self._deliver(make_event(event_type, data))
+
+    async def start(self):
+        async with self._start_lock:
+            if self._task is not None:
+                return
+            self._loop = asyncio.get_running_loop()
+            self._stop.clear()
+            if await asyncio.to_thread(is_replica_set):
+                self._source = "change_stream"
+                source = asyncio.to_thread(self._watch)
+            else:
+                self._source = "poll"
+                source = self._poll()
+            # A fresh context, so the source does not inherit the first subscriber's request recorder
+            self._task = contextvars.Context().run(asyncio.create_task, source)
+            print(f"Admin events from {self._source}")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stop.set()
+        if self._source == "poll":
+            self._task.cancel()
+        try:
+            await asyncio.wait_for(self._task, EVENTS_RETRY_SECONDS)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            pass
+        self._task = self._source = None
+
+    def _watch(self):
+        """Change stream loop, in a thread; resumes after errors without losing events"""
+        resume_token = None
+        with operation("admin events"):
+            while not self._stop.is_set():
+                try:
+                    with get_database().watch(
+                        CHANGE_PIPELINE, full_document="updateLookup", resume_after=resume_token, max_await_time_ms=1000
+                    ) as stream:
+                        while not self._stop.is_set():
+                            change = stream.try_next()
+                            resume_token = stream.resume_token
+                            if change is None:
+                                continue
+                            event = event_from_change(change)
+                            if event:
+                                self._loop.call_soon_threadsafe(self._deliver, event)
+                except PyMongoError as e:
+                    print(f"Admin events change stream failed, retrying: {e}")
+                    if getattr(e, "code", None) == CHANGE_STREAM_HISTORY_LOST:
+                        resume_token = None
+                    self._stop.wait(EVENTS_RETRY_SECONDS)
+
+    async def _poll(self):
+        with operation("admin events"):
+            await self._poll_loop()
+
+    async def _poll_loop(self):
+        db = get_database()
+        since = {c: datetime.utcnow() for c in ("payments", "tickets")}
+        seen = {c: set() for c in since}
+        while True:
+            await asyncio.sleep(EVENTS_POLL_SECONDS)
+            if not self._subscribers:
+                # Nobody listening: start from now when someone connects
+                since = {c: datetime.utcnow() for c in since}
+                seen = {c: set() for c in since}
+                continue
+            for collection in since:
+                try:
+                    new, since[collection], seen[collection] = await asyncio.to_thread(
+                        poll_new, db, collection, since[collection], seen[collection]
+                    )
+                except PyMongoError as e:
+                    print(f"Admin events poll of {collection} failed: {e}")
+                    continue
+                for doc in new:
+                    self._deliver(make_event(INSERT_EVENTS[collection], doc))
+
+
+event_hub = EventHub()
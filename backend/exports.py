@@ -0,0 +1,156 @@
+"""
+Streaming exports: rows are read from a batched cursor and encoded as CSV or
+NDJSON chunk by chunk (optionally gzip-compressed), so memory use does not
+depend on the size of the export
+"""
+
+import csv
+import io
+import os
+import zlib
+from datetime import datetime
+from typing import Iterable, Iterator, List
+
+import orjson
+
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "1000"))
+# Rows encoded per yielded chunk
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", "500"))
+
+# Written by Telegram users or admins; a leading formula character is neutralised in CSV cells
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+# collection -> default columns, date field for ranges, list-endpoint filters (name -> type), ?search= kind
+EXPORTS = {
+    "orders": {
+        "collection": "orders",
+        "columns": ["id", "telegram_user_id", "plan_id", "server_id", "discount_code", "original_price",
+                    "discount_amount", "final_price", "status", "created_at", "confirmed_at"],
+        "date_field": "created_at",
+        "filters": {"status": str, "telegram_user_id": int, "plan_id": str},
+    },
+    "payments": {
+        "collection": "payments",
+        "columns": ["id", "order_id", "amount", "status", "admin_note", "reviewed_by", "reviewed_at", "created_at"],
+        "date_field": "created_at",
+        "filters": {"status": str, "order_id": str},
+    },
+    "users": {
+        "collection": "telegram_users",
+        "columns": ["telegram_id", "username", "first_name", "last_name", "phone", "wallet_balance",
+                    "is_banned", "is_reseller", "referred_by", "referral_earnings", "created_at"],
+        "date_field": "created_at",
+        "filters": {"is_banned": bool, "is_reseller": bool},
+        "search": "user",
+    },
+    "subscriptions": {
+        "collection": "subscriptions",
+        "columns": ["id", "telegram_user_id", "order_id", "plan_id", "server_id", "expires_at",
+                    "traffic_limit", "traffic_used", "is_active", "created_at"],
+        "date_field": "created_at",
+        "filters": {"is_active": bool, "telegram_user_id": int, "plan_id": str, "server_id": str},
+    },
+    "discount_codes": {
+        "collection": "discount_codes",
+        "columns": ["code", "discount_percent", "discount_amount", "max_uses", "used_count", "valid_until",
+                    "is_active", "batch_id", "created_at"],
+        "date_field": "created_at",
+        # batch_id: codes from one /api/discount-codes/generate call
+        "filters": {"batch_id": str, "is_active": bool},
+    },
+}
+
+
+def parse_filter(value: str, kind):
+    if kind is bool:
+        return value.lower() in ("1", "true", "yes")
+    return kind(value)
+
+
+def user_search(search: str) -> dict:
+    """The ?search= filter of /api/users: username or first name, or the exact Telegram id"""
+    conditions = [
+        {"username": {"$regex": search, "$options": "i"}},
+        {"first_name": {"$regex": search, "$options": "i"}},
+    ]
+    if search.isdigit():
+        conditions.append({"telegram_id": int(search)})
+    return {"$or": conditions}
+
+
+SEARCHES = {"user": user_search}
+
+
+def build_query(export: dict, params: dict, date_from: datetime = None, date_to: datetime = None) -> dict:
+    """Mongo filter from the allowed query parameters and a [date_from, date_to) range"""
+    query = {}
+    for name, kind in export["filters"].items():
+        if params.get(name) not in (None, ""):
+            query[name] = parse_filter(params[name], kind)
+    if export.get("search") and params.get("search"):
+        query.update(SEARCHES[export["search"]](params["search"]))
+    if date_from or date_to:
+        query[export["date_field"]] = {}
+        if date_from:
+            query[export["date_field"]]["$gte"] = date_from
+        if date_to:
+            query[export["date_field"]]["$lt"] = date_to
+    return query
+
+
+def iter_documents(col, query: dict, columns: List[str], sort_field: str) -> Iterator[dict]:
+    cursor = col.find(query, {"_id": 0, **{c: 1 for c in columns}}).sort(sort_field, 1).batch_size(EXPORT_BATCH_SIZE)
+    try:
+        yield from cursor
+    finally:
+        cursor.close()
+
+
+def csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, dict)):
+        return orjson.dumps(value, default=str).decode()
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        # Spreadsheets would run it as a formula
+        return "'" + value
+    return value
+
+
+def csv_chunks(docs: Iterable[dict], columns: List[str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    # BOM so Excel opens the Persian text as UTF-8
+    buffer.write("\ufeff")
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    rows = 0
+    for doc in docs:
+        writer.writerow([csv_value(doc.get(column)) for column in columns])
+        rows += 1
+        if rows % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def ndjson_chunks(docs: Iterable[dict]) -> Iterator[bytes]:
+    lines = []
+    for doc in docs:
+        lines.append(orjson.dumps(doc, default=str))
+        if len(lines) >= EXPORT_CHUNK_ROWS:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
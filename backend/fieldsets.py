@@ -0,0 +1,58 @@
+"""
+Sparse fieldsets for list endpoints: ?fields=id,status,user.username is turned
+into Mongo projections for the listed documents and their enriched sub-objects
+"""
+
+from typing import Dict, List, Optional, Set
+
+Fieldset = Dict[str, Set[str]]
+
+
+def parse_fields(fields: Optional[str]) -> Optional[Fieldset]:
+    """'id,status,user.username,plan' -> {"": {"id", "status"}, "user": {"username"}, "plan": set()}
+
+    None means "everything". An empty set for a relation means the whole sub-object.
+    """
+    if not fields:
+        return None
+    fieldset = {"": set()}
+    for field in fields.split(","):
+        field = field.strip()
+        if not field:
+            continue
+        relation, _, name = field.rpartition(".")
+        if relation:
+            fieldset.setdefault(relation, set())
+            if name:
+                fieldset[relation].add(name)
+        else:
+            fieldset[""].add(name)
+    return fieldset
+
+
+def projection(fieldset: Optional[Fieldset], relation: str = "", required: List[str] = ()) -> dict:
+    """Mongo projection for the root documents ("") or a relation; required keys are always kept"""
+    names = fieldset.get(relation) if fieldset else None
+    if not names:
+        return {"_id": 0}
+    result = {name: 1 for name in names}
+    result.update({name: 1 for name in required})
+    result["_id"] = 0
+    return result
+
+
+def wants(fieldset: Optional[Fieldset], relation: str) -> bool:
+    """Whether a relation should be enriched at all ("plan" or "plan.name" both ask for it)"""
+    return fieldset is None or relation in fieldset or relation in fieldset[""]
+
+
+def attach(docs: List[dict], local_key: str, col, foreign_key: str, as_field: str, fields: dict):
+    """Enrich docs with the related document from col in a single $in query"""
+    keys = list({doc.get(local_key) for doc in docs if doc.get(local_key) is not None})
+    related = {}
+    if keys:
+        if any(v == 1 for v in fields.values()):
+            fields = {**fields, foreign_key: 1}
+        related = {item[foreign_key]: item for item in col.find({foreign_key: {"$in": keys}}, fields)}
+    for doc in docs:
+        doc[as_field] = related.get(doc.get(local_key))
@@ -0,0 +1,248 @@
+"""
+Bulk imports: the upload is spooled to a temporary file (on disk past
+IMPORT_SPOOL_BYTES), parsed row by row as CSV or NDJSON, validated with the
+API models and written in unordered batches, so memory use does not depend
+on the size of the file
+"""
+
+import codecs
+import csv
+import io
+import os
+import secrets
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from typing import IO, Iterator, List, Tuple
+
+import orjson
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from models import DiscountCodeCreate, PlanCreate, TelegramUser
+
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_SPOOL_BYTES = int(os.environ.get("IMPORT_SPOOL_BYTES", str(8 * 1024 * 1024)))
+# Errors listed in the report; the rest are only counted
+IMPORT_MAX_ERRORS = int(os.environ.get("IMPORT_MAX_ERRORS", "1000"))
+# Separator for list columns (server_ids, plan_ids) in CSV files
+LIST_SEPARATOR = ";"
+
+# No 0/O or 1/I, so printed codes can be typed back
+CODE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+
+DUPLICATE_KEY = 11000
+
+# model, list columns, natural key (None: always insert), how rows are written
+IMPORTS = {
+    "users": {"model": TelegramUser, "collection": "telegram_users", "list_fields": [], "key": "telegram_id"},
+    "plans": {"model": PlanCreate, "collection": "plans", "list_fields": ["server_ids"], "key": None},
+    "discount_codes": {"model": DiscountCodeCreate, "collection": "discount_codes", "list_fields": ["plan_ids"], "key": "code"},
+}
+
+
+async def spool_upload(request) -> IO[bytes]:
+    """Copy the request body to a temporary file without holding it in memory"""
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES)
+    async for chunk in request.stream():
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def csv_records(stream: IO[bytes], list_fields: List[str]) -> Iterator[dict]:
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    for row in csv.DictReader(text):
+        # Empty cells fall back to the model defaults
+        record = {k.strip(): v for k, v in row.items() if k and v not in (None, "")}
+        for field in list_fields:
+            if field in record:
+                record[field] = [v.strip() for v in record[field].split(LIST_SEPARATOR) if v.strip()]
+        yield record
+
+
+def parse_records(stream: IO[bytes], format: str, list_fields: List[str]) -> Iterator[Tuple[int, object]]:
+    """(row number, record or exception) pairs; a bad NDJSON line does not stop the import"""
+    if format == "csv":
+        # Row 1 is the header
+        yield from enumerate(csv_records(stream, list_fields), start=2)
+        return
+    for row, line in enumerate(stream, start=1):
+        if row == 1:
+            line = line.removeprefix(codecs.BOM_UTF8)
+        if not line.strip():
+            continue
+        try:
+            yield row, orjson.loads(line)
+        except orjson.JSONDecodeError as e:
+            yield row, e
+
+
+def error_text(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" for e in error.errors())
+
+
+class ImportReport:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.received = 0
+        # Rows that passed validation, the only count besides failed that a dry run fills in
+        self.valid = 0
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, row: int, message: str):
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"row": row, "error": message})
+
+    def as_dict(self) -> dict:
+        seconds = time.perf_counter() - self.started
+        return {
+            "received": self.received,
+            "valid": self.valid,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(self.received / seconds) if seconds else 0,
+        }
+
+
+def prepare_document(name: str, record) -> Tuple[dict, set]:
+    """Validated document in the shape the create endpoints store, and the fields the row set"""
+    instance = IMPORTS[name]["model"].model_validate(record)
+    doc = instance.model_dump()
+    now = datetime.utcnow()
+    if name == "plans":
+        doc = {"id": str(uuid.uuid4()), **doc, "sales_count": 0, "created_at": now}
+    elif name == "discount_codes":
+        doc = {"id": str(uuid.uuid4()), **doc, "code": doc["code"].upper(), "used_count": 0, "created_at": now}
+    elif name == "users":
+        # Reseller status goes through /api/resellers, which also keeps the resellers collection in sync
+        for field in ("is_reseller", "reseller_discount"):
+            doc.pop(field)
+    return doc, instance.model_fields_set
+
+
+def insert_batch(col, batch: List[tuple], report: ImportReport):
+    """Unordered insert_many; duplicates of the unique key are reported per row"""
+    try:
+        result = col.insert_many([doc for _, doc, _ in batch], ordered=False)
+        report.inserted += len(result.inserted_ids)
+    except BulkWriteError as e:
+        report.inserted += e.details.get("nInserted", 0)
+        for error in e.details.get("writeErrors", []):
+            row = batch[error["index"]][0]
+            report.error(row, "کد تکراری است" if error.get("code") == DUPLICATE_KEY else error.get("errmsg", "write failed"))
+
+
+def upsert_batch(col, key: str, batch: List[tuple], update: bool, report: ImportReport):
+    """Unordered bulk upsert on the natural key; existing rows are updated or left alone"""
+    operations = []
+    for _, doc, fields_set in batch:
+        if update:
+            # Only the columns present in the file overwrite an existing row; defaults apply to new rows
+            changes = {k: v for k, v in doc.items() if k in fields_set}
+            defaults = {k: v for k, v in doc.items() if k not in fields_set}
+            operations.append(UpdateOne({key: doc[key]}, {"$set": changes, "$setOnInsert": defaults}, upsert=True))
+        else:
+            operations.append(UpdateOne({key: doc[key]}, {"$setOnInsert": doc}, upsert=True))
+    try:
+        details = col.bulk_write(operations, ordered=False).bulk_api_result
+    except BulkWriteError as e:
+        details = e.details
+        for error in details.get("writeErrors", []):
+            report.error(batch[error["index"]][0], error.get("errmsg", "write failed"))
+    report.inserted += len(details.get("upserted", []))
+    if update:
+        report.updated += details.get("nMatched", 0)
+    else:
+        report.skipped += details.get("nMatched", 0)
+
+
+def run_import(db, name: str, stream: IO[bytes], format: str = "csv", on_conflict: str = "skip", dry_run: bool = False) -> dict:
+    """Parse, validate and write an upload; blocking, call it from the threadpool
+
+    on_conflict applies to users, matched on telegram_id: "skip" leaves existing
+    users untouched, "update" overwrites the columns present in the file.
+    Discount codes that already exist are reported as errors.
+    """
+    config = IMPORTS[name]
+    col = db[config["collection"]]
+    key = config["key"]
+    report = ImportReport()
+    batch = []
+    batch_keys = set()
+
+    def flush():
+        if batch and not dry_run:
+            if name == "users":
+                upsert_batch(col, key, batch, on_conflict == "update", report)
+            else:
+                insert_batch(col, batch, report)
+        batch.clear()
+        batch_keys.clear()
+
+    for row, record in parse_records(stream, format, config["list_fields"]):
+        report.received += 1
+        if isinstance(record, Exception):
+            report.error(row, f"Invalid JSON: {record}")
+            continue
+        try:
+            doc, fields_set = prepare_document(name, record)
+        except ValidationError as e:
+            report.error(row, error_text(e))
+            continue
+        report.valid += 1
+        if key:
+            # Unordered writes in one batch could both insert the same key, so write it in the next one
+            if doc[key] in batch_keys:
+                flush()
+            batch_keys.add(doc[key])
+        batch.append((row, doc, fields_set))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            flush()
+    flush()
+    return report.as_dict()
+
+
+def random_code(prefix: str, length: int) -> str:
+    return prefix + "".join(secrets.choice(CODE_ALPHABET) for _ in range(length))
+
+
+def generate_codes(col, template: dict, count: int, prefix: str, length: int, batch_id: str, attempts: int = 5) -> List[str]:
+    """Insert count random codes; collisions with existing codes are drawn again"""
+    codes = []
+    missing = count
+    for _ in range(attempts):
+        if not missing:
+            break
+        now = datetime.utcnow()
+        candidates = list({random_code(prefix, length) for _ in range(missing)})
+        docs = [
+            {"id": str(uuid.uuid4()), **template, "code": code, "used_count": 0, "batch_id": batch_id, "created_at": now}
+            for code in candidates
+        ]
+        failed = set()
+        for start in range(0, len(docs), IMPORT_BATCH_SIZE):
+            chunk = docs[start:start + IMPORT_BATCH_SIZE]
+            try:
+                col.insert_many(chunk, ordered=False)
+            except BulkWriteError as e:
+                for error in e.details.get("writeErrors", []):
+                    if error.get("code") != DUPLICATE_KEY:
+                        raise
+                    failed.add(chunk[error["index"]]["code"])
+        inserted = [code for code in candidates if code not in failed]
+        codes.extend(inserted)
+        missing -= len(inserted)
+    return codes
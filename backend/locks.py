@@ -0,0 +1,109 @@
+"""
+Mongo-backed locks for running several API workers: a startup lock around
+the seeders and a renewed leader lease so only one worker runs the jobs
+"""
+
+import asyncio
+import functools
+import os
+import socket
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+LOCKS_COLLECTION = "locks"
+STARTUP_LOCK_SECONDS = int(os.environ.get("STARTUP_LOCK_SECONDS", "60"))
+LEADER_LEASE_SECONDS = int(os.environ.get("LEADER_LEASE_SECONDS", "30"))
+
+
+def process_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _acquire(col, name: str, owner: str, seconds: int) -> bool:
+    """Take (or extend) the lock if it is free, expired or already ours"""
+    now = datetime.utcnow()
+    try:
+        col.update_one(
+            {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=seconds), "renewed_at": now}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Held by someone else: the filter missed and the upsert hit the existing _id
+        return False
+    return True
+
+
+@contextmanager
+def startup_lock(db, name: str = "startup", timeout: int = STARTUP_LOCK_SECONDS):
+    """Run the block in one process at a time; a crashed holder's lock expires after timeout"""
+    col = db[LOCKS_COLLECTION]
+    owner = process_id()
+    deadline = time.monotonic() + timeout
+    while not _acquire(col, name, owner, timeout):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Could not acquire the {name} lock in {timeout}s")
+        time.sleep(0.2)
+    try:
+        yield
+    finally:
+        col.delete_one({"_id": name, "owner": owner})
+
+
+class LeaderLease:
+    """Lease renewed by the current leader; the others take over once it expires
+
+    Usage:
+        scheduler.add_job(lease.renew, "interval", seconds=lease.renew_interval, args=[db])
+        scheduler.add_job(lease.only(check_servers), ...)
+    """
+
+    def __init__(self, name: str, lease_seconds: int = LEADER_LEASE_SECONDS):
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self._valid_until = 0.0
+
+    @property
+    def renew_interval(self) -> float:
+        return self.lease_seconds / 3
+
+    @property
+    def is_leader(self) -> bool:
+        return time.monotonic() < self._valid_until
+
+    def renew(self, db) -> bool:
+        started = time.monotonic()
+        was_leader = self.is_leader
+        if _acquire(db[LOCKS_COLLECTION], self.name, process_id(), self.lease_seconds):
+            # Stop acting as leader a little before the stored expiry
+            self._valid_until = started + self.lease_seconds - self.renew_interval
+            if not was_leader:
+                print(f"{process_id()} is now the {self.name} leader")
+            return True
+        if was_leader:
+            print(f"{process_id()} lost the {self.name} lease")
+        self._valid_until = 0.0
+        return False
+
+    def release(self, db):
+        if self.is_leader:
+            db[LOCKS_COLLECTION].delete_one({"_id": self.name, "owner": process_id()})
+        self._valid_until = 0.0
+
+    def only(self, func):
+        """Wrap a job so it is skipped in processes that are not the leader"""
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if self.is_leader:
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if self.is_leader:
+                return func(*args, **kwargs)
+        return wrapper
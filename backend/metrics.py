@@ -0,0 +1,147 @@
+"""
+Prometheus metrics shared by the API and the bot: HTTP request timings,
+Mongo command counts/latency per collection, and connection pool usage
+
+With several API workers, run.py sets PROMETHEUS_MULTIPROC_DIR so each worker
+writes its samples to shared files and /api/metrics aggregates all of them.
+"""
+
+import os
+import threading
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from pymongo import monitoring
+
+# /api/metrics answers only with "Authorization: Bearer <METRICS_TOKEN>" and is off without it
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+http_requests = Counter("http_requests_total", "HTTP requests", ["method", "route", "status"])
+http_latency = Histogram("http_request_duration_seconds", "HTTP request latency", ["method", "route"], buckets=LATENCY_BUCKETS)
+
+mongo_commands = Counter("mongo_commands_total", "Mongo commands", ["collection", "command", "outcome"])
+mongo_latency = Histogram("mongo_command_duration_seconds", "Mongo command latency", ["collection", "command"], buckets=LATENCY_BUCKETS)
+
+mongo_pool_checked_out = Gauge("mongo_pool_checked_out", "Connections checked out of the pool", ["address"], multiprocess_mode="livesum")
+mongo_pool_size = Gauge("mongo_pool_connections", "Open connections in the pool", ["address"], multiprocess_mode="livesum")
+events_subscribers = Gauge("events_subscribers", "Open /api/events connections", multiprocess_mode="livesum")
+
+mongo_pool_checkout_failures = Counter("mongo_pool_checkout_failures_total", "Failed pool checkouts", ["address", "reason"])
+
+
+def command_collection(command_name: str, command: dict) -> str:
+    """Collection a command operates on ("-" for admin commands)"""
+    if command_name == "getMore":
+        return command.get("collection", "-")
+    target = command.get(command_name)
+    return target if isinstance(target, str) else "-"
+
+
+class MongoMetricsListener(monitoring.CommandListener):
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = command_collection(event.command_name, event.command)
+
+    def _finish(self, event, outcome: str):
+        with self._lock:
+            collection = self._pending.pop((event.connection_id, event.request_id), "-")
+        mongo_commands.labels(collection, event.command_name, outcome).inc()
+        mongo_latency.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finish(event, "success")
+
+    def failed(self, event):
+        self._finish(event, "failure")
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        mongo_pool_size.labels(str(event.address)).inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        mongo_pool_size.labels(str(event.address)).dec()
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        mongo_pool_checkout_failures.labels(str(event.address), str(event.reason)).inc()
+
+    def connection_checked_out(self, event):
+        mongo_pool_checked_out.labels(str(event.address)).inc()
+
+    def connection_checked_in(self, event):
+        mongo_pool_checked_out.labels(str(event.address)).dec()
+
+
+def register_mongo_listeners():
+    """Must run before any MongoClient is created"""
+    monitoring.register(MongoMetricsListener())
+    monitoring.register(PoolMetricsListener())
+
+
+class MetricsMiddleware:
+    """Per-route request counts and latency, labelled by route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            http_requests.labels(scope["method"], path, str(status_code)).inc()
+            http_latency.labels(scope["method"], path).observe(time.perf_counter() - started)
+
+
+def render_metrics():
+    """(body, content type) in Prometheus text format"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead():
+    """Drop this worker's live gauges from the multiprocess files on shutdown"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
@@ -187,6 +187,20 @@ class DiscountCodeCreate(BaseModel):
     is_active: bool = True
 
 
+class DiscountCodeBatch(BaseModel):
+    """Random single-use (by default) codes sharing the same terms"""
+    count: int = Field(..., ge=1, le=100000)
+    prefix: str = Field("", max_length=10)
+    length: int = Field(8, ge=6, le=16)  # random characters after the prefix
+    discount_percent: Optional[float] = None
+    discount_amount: Optional[float] = None
+    max_uses: Optional[int] = 1
+    valid_until: Optional[datetime] = None
+    min_order_amount: Optional[float] = None
+    plan_ids: List[str] = []
+    is_active: bool = True
+
+
 class DiscountCodeUpdate(BaseModel):
     code: Optional[str] = None
     discount_percent: Optional[float] = None
@@ -263,6 +277,7 @@ class BotSettingsUpdate(BaseModel):
     referral_enabled: Optional[bool] = None
     referral_percent: Optional[float] = None
     min_withdrawal: Optional[float] = None
+    expiry_reminder_days: Optional[int] = None
 
 
 # Broadcast Models
@@ -272,6 +287,34 @@ class BroadcastCreate(BaseModel):
     include_media: Optional[str] = None
 
 
+# Bulk Operation Models
+class BulkBanRequest(BaseModel):
+    telegram_ids: List[int] = Field(..., min_length=1, max_length=1000)
+    is_banned: bool = True
+
+
+class WalletAdjustment(BaseModel):
+    telegram_id: int
+    amount: float  # added to the balance, negative to deduct
+
+
+class BulkWalletRequest(BaseModel):
+    adjustments: List[WalletAdjustment] = Field(..., min_length=1, max_length=1000)
+    allow_negative: bool = False
+
+
+class BulkPlanPriceRequest(BaseModel):
+    category_id: str
+    percent: float = Field(..., gt=-100)  # 10 raises prices by 10%, -10 lowers them
+    round_to: float = Field(1000, gt=0)
+
+
+class BulkPaymentReview(BaseModel):
+    payment_ids: List[str] = Field(..., min_length=1, max_length=1000)
+    status: PaymentStatus
+    admin_note: Optional[str] = None
+
+
 # Dashboard Stats
 class DashboardStats(BaseModel):
     total_users: int = 0
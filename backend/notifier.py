@@ -0,0 +1,53 @@
+"""
+Telegram Bot API sender for messages that originate outside the bot process;
+they are queued in the notification outbox and sent by outbox.dispatch_outbox
+"""
+
+import asyncio
+import os
+from typing import List, Tuple
+
+import httpx
+
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org")
+NOTIFY_RATE_PER_SECOND = int(os.environ.get("NOTIFY_RATE_PER_SECOND", "25"))
+
+
+SENT = "sent"
+# Network errors, 5xx, or still rate limited: worth another attempt later
+RETRY = "retry"
+# 400/403 (unknown chat, bot blocked by the user): retrying will not help
+REJECTED = "rejected"
+
+
+async def deliver(client: httpx.AsyncClient, token: str, chat_id: int, text: str) -> str:
+    """Send one message, waiting out a single 429 if Telegram asks us to; returns SENT, RETRY or REJECTED"""
+    for _ in range(2):
+        try:
+            response = await client.post(
+                f"{TELEGRAM_API_URL}/bot{token}/sendMessage",
+                json={"chat_id": chat_id, "text": text}
+            )
+        except httpx.HTTPError:
+            return RETRY
+        if response.status_code == 429:
+            retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+            await asyncio.sleep(retry_after)
+            continue
+        if response.status_code == 200:
+            return SENT
+        return REJECTED if response.status_code in (400, 403) else RETRY
+    return RETRY
+
+
+async def deliver_messages(token: str, messages: List[Tuple[int, str]]) -> List[str]:
+    """Send (chat_id, text) pairs in chunks of NOTIFY_RATE_PER_SECOND per second; one outcome per message"""
+    results = []
+    async with httpx.AsyncClient(timeout=15) as client:
+        for i in range(0, len(messages), NOTIFY_RATE_PER_SECOND):
+            chunk = messages[i:i + NOTIFY_RATE_PER_SECOND]
+            started = asyncio.get_running_loop().time()
+            results += await asyncio.gather(*(deliver(client, token, chat_id, text) for chat_id, text in chunk))
+            if i + NOTIFY_RATE_PER_SECOND < len(messages):
+                await asyncio.sleep(max(0, 1 - (asyncio.get_running_loop().time() - started)))
+    return results
@@ -0,0 +1,63 @@
+"""
+Pending order reaper: expires checkouts that outlived payment_timeout_minutes
+and releases the discount code usage they reserved
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import List
+
+from pymongo import UpdateOne
+
+ORDER_REAPER_INTERVAL_SECONDS = int(os.environ.get("ORDER_REAPER_INTERVAL_SECONDS", "60"))
+ORDER_REAPER_BATCH_SIZE = int(os.environ.get("ORDER_REAPER_BATCH_SIZE", "1000"))
+DEFAULT_PAYMENT_TIMEOUT_MINUTES = 30
+
+
+def expire_batch(db, ids: List, now: datetime) -> int:
+    orders_col = db["orders"]
+    result = orders_col.update_many(
+        {"_id": {"$in": ids}, "status": "pending"},
+        {"$set": {"status": "expired", "expired_at": now}}
+    )
+    if not result.modified_count:
+        return 0
+
+    # Only the orders this batch actually expired (a receipt may have raced us)
+    released = {}
+    for order in orders_col.find(
+        {"_id": {"$in": ids}, "status": "expired", "expired_at": now, "discount_code": {"$ne": None}},
+        {"discount_code": 1}
+    ):
+        released[order["discount_code"]] = released.get(order["discount_code"], 0) + 1
+
+    if released:
+        db["discount_codes"].bulk_write([
+            UpdateOne({"code": code, "used_count": {"$gte": count}}, {"$inc": {"used_count": -count}})
+            for code, count in released.items()
+        ], ordered=False)
+    return result.modified_count
+
+
+def reap_pending_orders(db) -> int:
+    """Scheduled entry point"""
+    settings = db["bot_settings"].find_one({"id": "bot_settings"}, {"payment_timeout_minutes": 1}) or {}
+    timeout = settings.get("payment_timeout_minutes") or DEFAULT_PAYMENT_TIMEOUT_MINUTES
+    now = datetime.utcnow()
+
+    cursor = db["orders"].find(
+        {"status": "pending", "created_at": {"$lt": now - timedelta(minutes=timeout)}},
+        {"_id": 1},
+        batch_size=ORDER_REAPER_BATCH_SIZE
+    )
+
+    expired = 0
+    ids = []
+    for order in cursor:
+        ids.append(order["_id"])
+        if len(ids) >= ORDER_REAPER_BATCH_SIZE:
+            expired += expire_batch(db, ids, now)
+            ids = []
+    if ids:
+        expired += expire_batch(db, ids, now)
+    return expired
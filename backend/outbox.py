@@ -0,0 +1,122 @@
+"""
+Notification outbox: Telegram messages to users are inserted into
+notification_outbox together with the change they report (in the same
+transaction where there is one) and sent later by dispatch_outbox, so admin
+requests never wait on the Bot API and a crash cannot lose a notification
+
+A message is claimed by pushing its next_attempt_at past OUTBOX_LOCK_SECONDS,
+so one that was being sent when the process died is picked up again.
+"""
+
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from notifier import REJECTED, SENT, deliver_messages
+
+OUTBOX_COLLECTION = "notification_outbox"
+OUTBOX_INTERVAL_SECONDS = int(os.environ.get("OUTBOX_INTERVAL_SECONDS", "5"))
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "200"))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "6"))
+# Retry n waits OUTBOX_RETRY_SECONDS * 2**(n-1)
+OUTBOX_RETRY_SECONDS = int(os.environ.get("OUTBOX_RETRY_SECONDS", "30"))
+OUTBOX_LOCK_SECONDS = int(os.environ.get("OUTBOX_LOCK_SECONDS", "120"))
+# Delivered and failed messages are kept this long for inspection
+OUTBOX_KEEP_DAYS = int(os.environ.get("OUTBOX_KEEP_DAYS", "7"))
+
+PENDING = "pending"
+FAILED = "failed"
+DUPLICATE_KEY = 11000
+
+
+def notification(chat_id: int, text: str, kind: str, key: Optional[str] = None, now: Optional[datetime] = None) -> dict:
+    """Outbox document; a key (e.g. "reminder:<subscription id>") makes enqueueing it twice a no-op"""
+    now = now or datetime.utcnow()
+    return {
+        "_id": key or str(uuid.uuid4()),
+        "chat_id": chat_id,
+        "text": text,
+        "kind": kind,
+        "status": PENDING,
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now,
+    }
+
+
+def enqueue(db, notifications: List[dict], session=None) -> int:
+    """Insert notifications, skipping keys already queued; returns how many were new"""
+    if not notifications:
+        return 0
+    try:
+        return len(db[OUTBOX_COLLECTION].insert_many(notifications, ordered=False, session=session).inserted_ids)
+    except BulkWriteError as e:
+        if any(error.get("code") != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+            raise
+        return e.details.get("nInserted", 0)
+
+
+def init_outbox_indexes(db):
+    col = db[OUTBOX_COLLECTION]
+    col.create_index([("status", 1), ("next_attempt_at", 1)])
+    col.create_index("finished_at", expireAfterSeconds=OUTBOX_KEEP_DAYS * 86400)
+
+
+def claim_batch(db, now: datetime) -> List[dict]:
+    col = db[OUTBOX_COLLECTION]
+    ids = [doc["_id"] for doc in col.find(
+        {"status": PENDING, "next_attempt_at": {"$lte": now}}, {"_id": 1}
+    ).sort("next_attempt_at", 1).limit(OUTBOX_BATCH_SIZE)]
+    if not ids:
+        return []
+    # Re-checked by the update, and the claim id tells which ones this run won
+    claim = str(uuid.uuid4())
+    col.update_many(
+        {"_id": {"$in": ids}, "status": PENDING, "next_attempt_at": {"$lte": now}},
+        {"$set": {"next_attempt_at": now + timedelta(seconds=OUTBOX_LOCK_SECONDS), "claim": claim}}
+    )
+    return list(col.find({"_id": {"$in": ids}, "claim": claim}, {"_id": 1, "chat_id": 1, "text": 1, "attempts": 1}))
+
+
+def outcome_update(doc: dict, outcome: str, now: datetime) -> UpdateOne:
+    if outcome == SENT:
+        return UpdateOne({"_id": doc["_id"]}, {"$set": {"status": SENT, "finished_at": now}, "$inc": {"attempts": 1}})
+    attempts = doc["attempts"] + 1
+    if outcome == REJECTED or attempts >= OUTBOX_MAX_ATTEMPTS:
+        return UpdateOne({"_id": doc["_id"]}, {"$set": {"status": FAILED, "error": outcome, "finished_at": now}, "$inc": {"attempts": 1}})
+    delay = OUTBOX_RETRY_SECONDS * 2 ** (attempts - 1)
+    return UpdateOne({"_id": doc["_id"]}, {
+        "$set": {"next_attempt_at": now + timedelta(seconds=delay), "error": outcome},
+        "$inc": {"attempts": 1}
+    })
+
+
+async def dispatch_outbox(db) -> dict:
+    """Scheduled entry point: send due messages batch by batch until none are left"""
+    settings = db["bot_settings"].find_one({"id": "bot_settings"}, {"bot_token": 1}) or {}
+    token = settings.get("bot_token")
+    if not token:
+        return {"sent": 0, "failed": 0, "retrying": 0}
+
+    counts = {"sent": 0, "failed": 0, "retrying": 0}
+    while True:
+        now = datetime.utcnow()
+        batch = claim_batch(db, now)
+        if not batch:
+            break
+        # notifier paces the batch at NOTIFY_RATE_PER_SECOND
+        outcomes = await deliver_messages(token, [(doc["chat_id"], doc["text"]) for doc in batch])
+        updates = [outcome_update(doc, outcome, datetime.utcnow()) for doc, outcome in zip(batch, outcomes)]
+        db[OUTBOX_COLLECTION].bulk_write(updates, ordered=False)
+        for doc, outcome in zip(batch, outcomes):
+            if outcome == SENT:
+                counts["sent"] += 1
+            elif outcome == REJECTED or doc["attempts"] + 1 >= OUTBOX_MAX_ATTEMPTS:
+                counts["failed"] += 1
+            else:
+                counts["retrying"] += 1
+    return counts
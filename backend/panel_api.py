@@ -0,0 +1,110 @@
+"""
+Client for the Sanaei (3x-ui) panel API used by the background jobs
+"""
+
+import json
+import os
+from typing import Dict, List, Optional
+
+import httpx
+
+PANEL_TIMEOUT_SECONDS = float(os.environ.get("PANEL_TIMEOUT_SECONDS", "10"))
+
+
+class PanelError(Exception):
+    """Raised when a panel request fails or returns success=false"""
+
+
+class PanelClient:
+    """Logged-in HTTP session against a single panel
+
+    Usage:
+        async with PanelClient(server) as panel:
+            inbounds = await panel.list_inbounds()
+    """
+
+    def __init__(self, server: dict, timeout: float = PANEL_TIMEOUT_SECONDS):
+        self.server = server
+        self._http = httpx.AsyncClient(base_url=server["panel_url"].rstrip("/"), timeout=timeout)
+
+    async def __aenter__(self):
+        await self.login()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._http.aclose()
+
+    async def _request(self, method: str, path: str, **kwargs):
+        response = await self._http.request(method, path, **kwargs)
+        if response.status_code != 200:
+            raise PanelError(f"{method} {path}: HTTP {response.status_code}")
+        try:
+            data = response.json()
+        except ValueError:
+            raise PanelError(f"{method} {path}: invalid response")
+        if not data.get("success"):
+            raise PanelError(f"{method} {path}: {data.get('msg') or 'failed'}")
+        return data.get("obj")
+
+    async def login(self):
+        await self._request(
+            "POST", "/login",
+            data={"username": self.server["panel_username"], "password": self.server["panel_password"]}
+        )
+
+    async def list_inbounds(self) -> List[dict]:
+        return await self._request("GET", "/panel/api/inbounds/list") or []
+
+    async def online_clients(self) -> List[str]:
+        return await self._request("POST", "/panel/api/inbounds/onlines") or []
+
+    async def set_client_enabled(self, inbound: dict, email: str, enabled: bool) -> bool:
+        """Enable/disable a client of an inbound by email. Returns False if not found."""
+        client = find_client(inbound, email)
+        if client is None:
+            return False
+        client = {**client, "enable": enabled}
+        client_key = client.get("id") or client.get("password") or email
+        await self._request(
+            "POST", f"/panel/api/inbounds/updateClient/{client_key}",
+            data={"id": inbound["id"], "settings": json.dumps({"clients": [client]})}
+        )
+        return True
+
+
+def client_email(subscription: dict) -> str:
+    """Email that identifies a subscription's client on its panel"""
+    return subscription.get("panel_email") or subscription["id"]
+
+
+def client_traffic(inbounds: List[dict]) -> Dict[str, int]:
+    """Total (up + down) bytes per client email across all inbounds"""
+    usage = {}
+    for inbound in inbounds:
+        for stat in inbound.get("clientStats") or []:
+            email = stat.get("email")
+            if email:
+                usage[email] = usage.get(email, 0) + (stat.get("up") or 0) + (stat.get("down") or 0)
+    return usage
+
+
+def inbound_clients(inbound: dict) -> List[dict]:
+    """Client definitions of an inbound (settings is a JSON string)"""
+    settings = inbound.get("settings") or "{}"
+    if isinstance(settings, str):
+        try:
+            settings = json.loads(settings)
+        except ValueError:
+            return []
+    return settings.get("clients") or []
+
+
+def find_client(inbound: dict, email: str) -> Optional[dict]:
+    for client in inbound_clients(inbound):
+        if client.get("email") == email:
+            return client
+    return None
+
+
+def count_clients(inbounds: List[dict]) -> int:
+    return sum(len(inbound_clients(inbound)) for inbound in inbounds)
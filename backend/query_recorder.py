@@ -0,0 +1,213 @@
+"""
+Request-scoped Mongo query recorder: counts and times the queries a request
+issues, enforces a query budget, and flags repeated query shapes (likely N+1)
+
+In tests:
+    with capture_requests() as requests:
+        client.get("/api/orders")
+    assert requests[0].recorder.count <= 4
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+DEBUG = os.environ.get("DEBUG", "").lower() in ("1", "true", "yes")
+QUERY_BUDGET = int(os.environ.get("QUERY_BUDGET", "20"))
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("N_PLUS_ONE_THRESHOLD", "5"))
+
+IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "ping", "endSessions", "saslStart", "saslContinue", "getMore", "killCursors"}
+
+
+def _shape(value):
+    """Replace literal values by "?" while keeping keys and operators"""
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in value.items()}
+    if isinstance(value, list) and value and isinstance(value[0], dict):
+        return [_shape(item) for item in value]
+    return "?"
+
+
+def query_shape(command_name: str, command: dict) -> str:
+    """Normalized, value-free description of a command, e.g. 'find telegram_users {telegram_id: ?}'"""
+    collection = command.get(command_name)
+    collection = collection if isinstance(collection, str) else "-"
+    if command_name == "find":
+        parts = [_shape(command.get("filter", {}))]
+        if command.get("sort"):
+            parts.append({"sort": dict(command["sort"])})
+    elif command_name in ("count", "distinct"):
+        parts = [_shape(command.get("query", {}))]
+    elif command_name == "aggregate":
+        parts = [[
+            {name: _shape(body) if name == "$match" else "..."}
+            for stage in command.get("pipeline", []) for name, body in stage.items()
+        ]]
+    elif command_name == "update":
+        parts = [_shape(command["updates"][0].get("q", {}))] if command.get("updates") else []
+    elif command_name == "delete":
+        parts = [_shape(command["deletes"][0].get("q", {}))] if command.get("deletes") else []
+    elif command_name == "findAndModify":
+        parts = [_shape(command.get("query", {}))]
+    else:
+        parts = []
+    return " ".join([command_name, collection] + [str(part) for part in parts])
+
+
+@dataclass
+class QueryRecorder:
+    queries: List[Tuple[str, float]] = field(default_factory=list)
+    _pending: Dict[tuple, str] = field(default_factory=dict)
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def total_ms(self) -> float:
+        return sum(duration for _, duration in self.queries)
+
+    def repeated_shapes(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> List[Tuple[str, int]]:
+        """Shapes issued at least threshold times, most repeated first"""
+        counts = {}
+        for shape, _ in self.queries:
+            counts[shape] = counts.get(shape, 0) + 1
+        return sorted(((s, n) for s, n in counts.items() if n >= threshold), key=lambda item: -item[1])
+
+
+_current: ContextVar[Optional[QueryRecorder]] = ContextVar("query_recorder", default=None)
+_operation: ContextVar[Optional[object]] = ContextVar("operation", default=None)
+
+
+def current_operation() -> str:
+    """Route ("GET /api/orders") or bot handler issuing the current query"""
+    operation = _operation.get()
+    if operation is None:
+        return "-"
+    if isinstance(operation, dict):
+        # ASGI scope: the router fills in "route" after the middleware ran
+        route = operation.get("route")
+        return f"{operation['method']} {route.path if route is not None else operation['path']}"
+    return operation
+
+
+@contextmanager
+def operation(name: str):
+    """Label queries issued in this block (used for non-HTTP work such as bot handlers)"""
+    token = _operation.set(name)
+    try:
+        yield
+    finally:
+        _operation.reset(token)
+
+
+class QueryRecorderListener(monitoring.CommandListener):
+    """Feeds the recorder of the current context (listener callbacks run in the calling thread)"""
+
+    def started(self, event):
+        recorder = _current.get()
+        if recorder is not None and event.command_name not in IGNORED_COMMANDS:
+            recorder._pending[(event.connection_id, event.request_id)] = query_shape(event.command_name, event.command)
+
+    def _finish(self, event):
+        recorder = _current.get()
+        if recorder is None:
+            return
+        shape = recorder._pending.pop((event.connection_id, event.request_id), None)
+        if shape is not None:
+            recorder.queries.append((shape, event.duration_micros / 1000))
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+
+@contextmanager
+def record_queries():
+    """Record the queries issued in the current context"""
+    recorder = QueryRecorder()
+    token = _current.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current.reset(token)
+
+
+@dataclass
+class RecordedRequest:
+    method: str
+    path: str
+    recorder: QueryRecorder
+
+
+_observers: List[List[RecordedRequest]] = []
+_observers_lock = threading.Lock()
+
+
+@contextmanager
+def capture_requests():
+    """Collect the recorders of every request finished while the block runs"""
+    requests = []
+    with _observers_lock:
+        _observers.append(requests)
+    try:
+        yield requests
+    finally:
+        with _observers_lock:
+            _observers.remove(requests)
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, app, budget: int = QUERY_BUDGET, debug: bool = DEBUG):
+        self.app = app
+        self.budget = budget
+        self.debug = debug
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        recorder = QueryRecorder()
+        token = _current.set(recorder)
+        operation_token = _operation.set(scope)
+        started = time.perf_counter()
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start" and self.debug:
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"x-db-queries", str(recorder.count).encode()),
+                    (b"x-db-time", f"{recorder.total_ms:.2f}".encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            _current.reset(token)
+            _operation.reset(operation_token)
+            self.report(scope, recorder, time.perf_counter() - started)
+
+    def report(self, scope, recorder: QueryRecorder, elapsed: float):
+        route = scope.get("route")
+        path = route.path if route is not None else scope["path"]
+        if recorder.count > self.budget:
+            print(f"Query budget exceeded: {scope['method']} {path} issued {recorder.count} queries "
+                  f"({recorder.total_ms:.1f} ms of {elapsed * 1000:.1f} ms)")
+        for shape, count in recorder.repeated_shapes():
+            print(f"Possible N+1: {scope['method']} {path} ran {count}x {shape}")
+
+        if _observers:
+            request = RecordedRequest(scope["method"], path, recorder)
+            with _observers_lock:
+                for requests in _observers:
+                    requests.append(request)
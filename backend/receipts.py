@@ -0,0 +1,51 @@
+"""
+Receipt media cache: payment receipts are downloaded from Telegram once,
+stored on local disk with a thumbnail, and served from there
+"""
+
+import io
+import os
+from datetime import datetime
+from typing import Tuple
+
+import httpx
+from PIL import Image
+
+from notifier import TELEGRAM_API_URL
+
+RECEIPTS_DIR = os.environ.get("RECEIPTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "media", "receipts"))
+RECEIPT_THUMB_SIZE = int(os.environ.get("RECEIPT_THUMB_SIZE", "320"))
+
+
+def receipt_paths(payment_id: str) -> Tuple[str, str]:
+    """(full image, thumbnail) paths of a payment's receipt"""
+    return (
+        os.path.join(RECEIPTS_DIR, f"{payment_id}.jpg"),
+        os.path.join(RECEIPTS_DIR, f"{payment_id}_thumb.jpg"),
+    )
+
+
+def store_receipt(payments_col, payment_id: str, data: bytes):
+    """Write the receipt and its thumbnail, then mark the payment as cached"""
+    os.makedirs(RECEIPTS_DIR, exist_ok=True)
+    full_path, thumb_path = receipt_paths(payment_id)
+
+    image = Image.open(io.BytesIO(data)).convert("RGB")
+    image.save(full_path + ".tmp", "JPEG", quality=90)
+    image.thumbnail((RECEIPT_THUMB_SIZE, RECEIPT_THUMB_SIZE))
+    image.save(thumb_path + ".tmp", "JPEG", quality=80)
+    os.replace(full_path + ".tmp", full_path)
+    os.replace(thumb_path + ".tmp", thumb_path)
+
+    payments_col.update_one({"id": payment_id}, {"$set": {"receipt_cached_at": datetime.utcnow()}})
+
+
+async def fetch_from_telegram(token: str, file_id: str) -> bytes:
+    """Download a file from the Bot API by file_id"""
+    async with httpx.AsyncClient(timeout=30) as client:
+        response = await client.get(f"{TELEGRAM_API_URL}/bot{token}/getFile", params={"file_id": file_id})
+        response.raise_for_status()
+        file_path = response.json()["result"]["file_path"]
+        response = await client.get(f"{TELEGRAM_API_URL}/file/bot{token}/{file_path}")
+        response.raise_for_status()
+        return response.content
@@ -0,0 +1,60 @@
+"""
+Production entry point for the API: one uvicorn worker per CPU
+
+    python run.py                      # workers = CPUs available to the process
+    WEB_CONCURRENCY=4 PORT=8001 python run.py
+
+On SIGTERM/SIGINT the workers stop accepting connections and get
+GRACEFUL_TIMEOUT_SECONDS to finish in-flight requests before they are closed.
+"""
+
+import os
+import shutil
+import tempfile
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import uvicorn
+
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", "8001"))
+GRACEFUL_TIMEOUT_SECONDS = int(os.environ.get("GRACEFUL_TIMEOUT_SECONDS", "30"))
+
+
+def cpu_count() -> int:
+    """CPUs this process may run on (respects taskset/cpuset limits)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def prepare_metrics_dir(workers: int):
+    """Shared Prometheus sample files for multi-worker runs, emptied on every start"""
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not path:
+        if workers == 1:
+            return
+        path = os.path.join(tempfile.gettempdir(), f"v2ray-bot-metrics-{PORT}")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def main():
+    workers = int(os.environ.get("WEB_CONCURRENCY") or cpu_count())
+    prepare_metrics_dir(workers)
+    print(f"Starting API on {HOST}:{PORT} with {workers} worker(s)")
+    uvicorn.run(
+        "server:app",
+        host=HOST,
+        port=PORT,
+        workers=workers,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT_SECONDS,
+        proxy_headers=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
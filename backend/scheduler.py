@@ -0,0 +1,12 @@
+"""
+Background job scheduler running inside the API process
+"""
+
+import os
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+# SCHEDULER_ENABLED=0 runs the API without background jobs (benchmarks)
+SCHEDULER_ENABLED = os.environ.get("SCHEDULER_ENABLED", "1") != "0"
+
+scheduler = AsyncIOScheduler(timezone="UTC", job_defaults={"coalesce": True, "max_instances": 1})
@@ -1,10 +1,16 @@
-from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, Request, status, UploadFile, File, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from pymongo import MongoClient
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
+from pymongo import UpdateOne, monitoring
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from PIL import UnidentifiedImageError
+from starlette.concurrency import run_in_threadpool
 from datetime import datetime, timedelta
 from typing import List, Optional
 from contextlib import asynccontextmanager
+import asyncio
 import os
+import secrets
 import uuid
 import httpx
 import base64
@@ -19,27 +25,69 @@ from models import (
     CategoryCreate, CategoryUpdate,
     PlanCreate, PlanUpdate,
     OrderStatus, PaymentStatus, PaymentReview,
-    DiscountCodeCreate, DiscountCodeUpdate,
+    DiscountCodeCreate, DiscountCodeBatch, DiscountCodeUpdate,
     DepartmentCreate, DepartmentUpdate,
     TicketStatus, TicketPriority, TicketReply, TicketUpdate,
     ResellerCreate, ResellerUpdate,
-    BotSettingsUpdate, BroadcastCreate, DashboardStats
+    BotSettingsUpdate, BroadcastCreate, DashboardStats,
+    BulkBanRequest, BulkWalletRequest, BulkPlanPriceRequest, BulkPaymentReview
 )
 from auth import (
-    get_password_hash, verify_password, create_access_token,
-    get_current_user, require_super_admin, require_admin, require_support
+    STREAM_TOKEN_SECONDS, get_password_hash, verify_password, create_access_token, create_stream_token,
+    get_current_user, get_stream_user, require_super_admin, require_admin, require_support
 )
+from scheduler import SCHEDULER_ENABLED, scheduler
+from server_monitor import HEALTH_CHECK_INTERVAL_SECONDS, HEALTH_HISTORY_DAYS, PER_ROUND_FIELDS, check_servers, get_health_summary
+from traffic_sync import TRAFFIC_SYNC_INTERVAL_SECONDS, sync_traffic
+from subscription_expiry import EXPIRY_SWEEP_INTERVAL_SECONDS, sweep_subscriptions
+from order_reaper import ORDER_REAPER_INTERVAL_SECONDS, reap_pending_orders
+from receipts import fetch_from_telegram, receipt_paths, store_receipt
+from fieldsets import parse_fields, projection, wants, attach
+from exports import EXPORTS, build_query, csv_chunks, gzip_chunks, iter_documents, ndjson_chunks, user_search
+from imports import IMPORTS, generate_codes, run_import, spool_upload
+from outbox import OUTBOX_INTERVAL_SECONDS, dispatch_outbox, enqueue, init_outbox_indexes, notification
+from ticket_messages import (
+    MESSAGES_PAGE_SIZE, MIGRATION_RETRY_SECONDS, add_message, get_messages, init_ticket_message_indexes, migrate_ticket,
+    migrate_ticket_messages, new_message
+)
+from events import EVENT_TYPES, EVENTS_HEARTBEAT_SECONDS, EVENTS_RETRY_SECONDS, ORDER_STATUS, ROLE_EVENTS, TICKET_REPLY, event_hub, format_sse
+from etags import VersionedCache, bump_version, conditional_get
+from compression import CompressionMiddleware
+from metrics import METRICS_TOKEN, MetricsMiddleware, mark_process_dead, register_mongo_listeners, render_metrics
+from query_recorder import QueryBudgetMiddleware, QueryRecorderListener
+from slow_queries import SLOW_QUERIES_COLLECTION, slow_query_log
+from database import (
+    configure, close_client, db, analytics_db, get_client, run_transaction, warmup,
+    admins_col, users_col, servers_col, categories_col, plans_col, orders_col, payments_col,
+    discounts_col, departments_col, tickets_col, resellers_col, settings_col, subscriptions_col, versions_col
+)
+from locks import LeaderLease, startup_lock
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    init_super_admin()
-    init_bot_settings()
-    init_default_departments()
+    # Runs in every worker; the lock keeps the seeders from racing each other
+    warmup()
+    slow_query_log.start(get_client())
+    with startup_lock(db):
+        init_indexes()
+        init_super_admin()
+        init_bot_settings()
+        init_default_departments()
+    if SCHEDULER_ENABLED:
+        jobs_lease.renew(db)
+        init_jobs()
+        scheduler.start()
     yield
+    await event_hub.stop()
+    if SCHEDULER_ENABLED:
+        scheduler.shutdown(wait=False)
+    jobs_lease.release(db)
+    mark_process_dead()
+    close_client()
 
 
-app = FastAPI(title="V2Ray Sales Bot API", version="1.0.0", lifespan=lifespan)
+app = FastAPI(title="V2Ray Sales Bot API", version="1.0.0", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -48,75 +96,166 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(QueryBudgetMiddleware)
+
+# MongoDB (the client itself is created lazily in each worker process)
+register_mongo_listeners()
+monitoring.register(QueryRecorderListener())
+slow_query_log.register()
+configure(app_name="v2ray-api")
+jobs_lease = LeaderLease("jobs")
+
 
-# MongoDB
-MONGO_URL = os.environ.get("MONGO_URL")
-DB_NAME = os.environ.get("DB_NAME", "v2ray_bot")
-client = MongoClient(MONGO_URL)
-db = client[DB_NAME]
-
-# Collections
-admins_col = db["admins"]
-users_col = db["telegram_users"]
-servers_col = db["servers"]
-categories_col = db["categories"]
-plans_col = db["plans"]
-orders_col = db["orders"]
-payments_col = db["payments"]
-discounts_col = db["discount_codes"]
-departments_col = db["departments"]
-tickets_col = db["tickets"]
-resellers_col = db["resellers"]
-settings_col = db["bot_settings"]
-subscriptions_col = db["subscriptions"]
+def count_total(col, query: dict) -> int:
+    """Total for list endpoints; unfiltered totals come from collection metadata instead of a scan"""
+    return col.count_documents(query) if query else col.estimated_document_count()
 
 
 # ==================== INITIALIZATION ====================
 
+def init_indexes():
+    db["server_health"].create_index([("server_id", 1), ("checked_at", -1)])
+    db["server_health"].create_index("checked_at", expireAfterSeconds=HEALTH_HISTORY_DAYS * 86400)
+    users_col.create_index("telegram_id")
+    users_col.create_index("created_at")
+    users_col.create_index("wallet_batch", sparse=True)
+    subscriptions_col.create_index("id")
+    subscriptions_col.create_index([("server_id", 1), ("is_active", 1)])
+    subscriptions_col.create_index([("is_active", 1), ("expires_at", 1)])
+    subscriptions_col.create_index([("is_active", 1), ("created_at", -1)])
+    subscriptions_col.create_index([("telegram_user_id", 1), ("created_at", -1)])
+    subscriptions_col.create_index("created_at")
+    orders_col.create_index("id")
+    orders_col.create_index([("status", 1), ("created_at", 1)])
+    orders_col.create_index([("status", 1), ("confirmed_at", 1)])
+    orders_col.create_index([("telegram_user_id", 1), ("created_at", -1)])
+    orders_col.create_index("created_at")
+    payments_col.create_index("id")
+    payments_col.create_index("order_id")
+    payments_col.create_index("review_batch", sparse=True)
+    payments_col.create_index([("status", 1), ("created_at", -1)])
+    payments_col.create_index("created_at")
+    tickets_col.create_index("id")
+    tickets_col.create_index([("status", 1), ("updated_at", -1)])
+    tickets_col.create_index([("department_id", 1), ("updated_at", -1)])
+    tickets_col.create_index([("telegram_user_id", 1), ("updated_at", -1)])
+    tickets_col.create_index("updated_at")
+    tickets_col.create_index("created_at")
+    init_ticket_message_indexes(db)
+    init_discount_code_index()
+    discounts_col.create_index([("batch_id", 1), ("created_at", 1)], sparse=True)
+    discounts_col.create_index("created_at")
+    resellers_col.create_index("telegram_user_id")
+    init_outbox_indexes(db)
+
+
+def init_discount_code_index():
+    # Replaces the earlier non-unique index (same key, so it has to go first);
+    # imports and the code generator rely on the duplicate key error
+    if "code_1" in discounts_col.index_information():
+        discounts_col.drop_index("code_1")
+    try:
+        discounts_col.create_index("code", unique=True, name="code_unique")
+    except OperationFailure as e:
+        print(f"Unique index on discount_codes.code not created, remove the duplicate codes: {e}")
+        discounts_col.create_index("code")
+
+
+TICKET_MESSAGES_MIGRATION_JOB = "ticket_messages_migration"
+
+
+def init_jobs():
+    # Every worker runs the scheduler, but only the lease holder runs the jobs
+    scheduler.add_job(
+        jobs_lease.renew, "interval", seconds=jobs_lease.renew_interval, args=[db],
+        id="jobs_lease", replace_existing=True
+    )
+    scheduler.add_job(
+        jobs_lease.only(check_servers), "interval", seconds=HEALTH_CHECK_INTERVAL_SECONDS, args=[db],
+        id="server_health", replace_existing=True, next_run_time=datetime.utcnow()
+    )
+    scheduler.add_job(
+        jobs_lease.only(sync_traffic), "interval", seconds=TRAFFIC_SYNC_INTERVAL_SECONDS, args=[db],
+        id="traffic_sync", replace_existing=True
+    )
+    scheduler.add_job(
+        jobs_lease.only(sweep_subscriptions), "interval", seconds=EXPIRY_SWEEP_INTERVAL_SECONDS, args=[db],
+        id="expiry_sweep", replace_existing=True
+    )
+    scheduler.add_job(
+        jobs_lease.only(reap_pending_orders), "interval", seconds=ORDER_REAPER_INTERVAL_SECONDS, args=[db],
+        id="order_reaper", replace_existing=True
+    )
+    scheduler.add_job(
+        jobs_lease.only(dispatch_outbox), "interval", seconds=OUTBOX_INTERVAL_SECONDS, args=[db],
+        id="notification_outbox", replace_existing=True
+    )
+    # Retried (by whichever process leads) until no ticket embeds its messages, then removed
+    scheduler.add_job(
+        jobs_lease.only(migrate_ticket_messages_job), "interval", seconds=MIGRATION_RETRY_SECONDS,
+        id=TICKET_MESSAGES_MIGRATION_JOB, replace_existing=True, next_run_time=datetime.utcnow()
+    )
+
+
+def migrate_ticket_messages_job():
+    migrate_ticket_messages(db)
+    if not tickets_col.find_one({"messages": {"$exists": True}}, {"_id": 1}):
+        scheduler.remove_job(TICKET_MESSAGES_MIGRATION_JOB)
+
+
 def init_super_admin():
-    if admins_col.count_documents({"role": UserRole.SUPER_ADMIN.value}) == 0:
-        admin = {
-            "id": str(uuid.uuid4()),
-            "username": "admin",
-            "hashed_password": get_password_hash("admin"),
-            "role": UserRole.SUPER_ADMIN.value,
-            "is_active": True,
-            "created_at": datetime.utcnow()
-        }
-        admins_col.insert_one(admin)
+    # Checked first so the password is only hashed when the admin is missing
+    if admins_col.find_one({"role": UserRole.SUPER_ADMIN.value}, {"_id": 1}):
+        return
+    admin = {
+        "id": str(uuid.uuid4()),
+        "username": "admin",
+        "hashed_password": get_password_hash("admin"),
+        "is_active": True,
+        "created_at": datetime.utcnow()
+    }
+    result = admins_col.update_one({"role": UserRole.SUPER_ADMIN.value}, {"$setOnInsert": admin}, upsert=True)
+    if result.upserted_id is not None:
         print("Default admin created: admin/admin")
 
 
 def init_bot_settings():
-    if settings_col.count_documents({"id": "bot_settings"}) == 0:
-        settings = {
-            "id": "bot_settings",
-            "bot_token": "",
-            "bot_username": "",
-            "channel_id": "",
-            "channel_username": "",
-            "support_username": "",
-            "card_number": "",
-            "card_holder": "",
-            "welcome_message": "به ربات فروش V2Ray خوش آمدید! 🎉",
-            "rules_message": "لطفاً قوانین را مطالعه کنید.",
-            "payment_timeout_minutes": 30,
-            "test_account_enabled": True,
-            "referral_enabled": True,
-            "referral_percent": 10,
-            "min_withdrawal": 50000
-        }
-        settings_col.insert_one(settings)
+    settings = {
+        "bot_token": "",
+        "bot_username": "",
+        "channel_id": "",
+        "channel_username": "",
+        "support_username": "",
+        "card_number": "",
+        "card_holder": "",
+        "welcome_message": "به ربات فروش V2Ray خوش آمدید! 🎉",
+        "rules_message": "لطفاً قوانین را مطالعه کنید.",
+        "payment_timeout_minutes": 30,
+        "test_account_enabled": True,
+        "referral_enabled": True,
+        "referral_percent": 10,
+        "min_withdrawal": 50000,
+        "expiry_reminder_days": 3
+    }
+    settings_col.update_one({"id": "bot_settings"}, {"$setOnInsert": settings}, upsert=True)
 
 
 def init_default_departments():
-    if departments_col.count_documents({}) == 0:
-        departments = [
-            {"id": str(uuid.uuid4()), "name": "پشتیبانی فنی", "description": "مشکلات فنی و اتصال", "is_active": True, "sort_order": 1, "created_at": datetime.utcnow()},
-            {"id": str(uuid.uuid4()), "name": "مالی", "description": "مشکلات پرداخت و شارژ", "is_active": True, "sort_order": 2, "created_at": datetime.utcnow()},
-            {"id": str(uuid.uuid4()), "name": "فروش", "description": "سوالات قبل از خرید", "is_active": True, "sort_order": 3, "created_at": datetime.utcnow()},
-        ]
-        departments_col.insert_many(departments)
+    if departments_col.find_one({}, {"_id": 1}):
+        return
+    departments = [
+        {"name": "پشتیبانی فنی", "description": "مشکلات فنی و اتصال", "sort_order": 1},
+        {"name": "مالی", "description": "مشکلات پرداخت و شارژ", "sort_order": 2},
+        {"name": "فروش", "description": "سوالات قبل از خرید", "sort_order": 3},
+    ]
+    for department in departments:
+        departments_col.update_one(
+            {"name": department["name"]},
+            {"$setOnInsert": {**department, "id": str(uuid.uuid4()), "is_active": True, "created_at": datetime.utcnow()}},
+            upsert=True
+        )
 
 
 # ==================== AUTH ROUTES ====================
@@ -201,12 +340,18 @@ async def delete_admin(admin_id: str, current_user: TokenData = Depends(require_
 
 # ==================== SERVER MANAGEMENT ====================
 
-@app.get("/api/servers")
+@app.get("/api/servers", dependencies=[Depends(conditional_get(versions_col, "servers", auth=require_admin))])
 async def get_servers(current_user: TokenData = Depends(require_admin)):
-    servers = list(servers_col.find({}, {"_id": 0}))
+    # Latency and last check time are in /api/servers/health; leaving them out keeps the ETag stable between probes
+    servers = list(servers_col.find({}, {"_id": 0, **{field: 0 for field in PER_ROUND_FIELDS}}))
     return servers
 
 
+@app.get("/api/servers/health")
+async def get_servers_health(current_user: TokenData = Depends(require_admin)):
+    return get_health_summary(analytics_db)
+
+
 @app.post("/api/servers")
 async def create_server(server: ServerCreate, current_user: TokenData = Depends(require_admin)):
     new_server = {
@@ -216,6 +361,7 @@ async def create_server(server: ServerCreate, current_user: TokenData = Depends(
         "created_at": datetime.utcnow()
     }
     servers_col.insert_one(new_server)
+    bump_version(versions_col, "servers")
     return {k: v for k, v in new_server.items() if k != "_id"}
 
 
@@ -228,6 +374,7 @@ async def update_server(server_id: str, server_update: ServerUpdate, current_use
     update_data = {k: v for k, v in server_update.model_dump().items() if v is not None}
     if update_data:
         servers_col.update_one({"id": server_id}, {"$set": update_data})
+        bump_version(versions_col, "servers")
     
     return servers_col.find_one({"id": server_id}, {"_id": 0})
 
@@ -237,6 +384,7 @@ async def delete_server(server_id: str, current_user: TokenData = Depends(requir
     result = servers_col.delete_one({"id": server_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Server not found")
+    bump_version(versions_col, "servers")
     return {"message": "Server deleted"}
 
 
@@ -261,7 +409,7 @@ async def test_server_connection(server_id: str, current_user: TokenData = Depen
 
 # ==================== CATEGORY MANAGEMENT ====================
 
-@app.get("/api/categories")
+@app.get("/api/categories", dependencies=[Depends(conditional_get(versions_col, "categories", auth=require_admin))])
 async def get_categories(current_user: TokenData = Depends(require_admin)):
     categories = list(categories_col.find({}, {"_id": 0}).sort("sort_order", 1))
     return categories
@@ -275,6 +423,7 @@ async def create_category(category: CategoryCreate, current_user: TokenData = De
         "created_at": datetime.utcnow()
     }
     categories_col.insert_one(new_category)
+    bump_version(versions_col, "categories")
     return {k: v for k, v in new_category.items() if k != "_id"}
 
 
@@ -287,6 +436,7 @@ async def update_category(category_id: str, category_update: CategoryUpdate, cur
     update_data = {k: v for k, v in category_update.model_dump().items() if v is not None}
     if update_data:
         categories_col.update_one({"id": category_id}, {"$set": update_data})
+        bump_version(versions_col, "categories")
     
     return categories_col.find_one({"id": category_id}, {"_id": 0})
 
@@ -300,12 +450,17 @@ async def delete_category(category_id: str, current_user: TokenData = Depends(re
     result = categories_col.delete_one({"id": category_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Category not found")
+    bump_version(versions_col, "categories")
     return {"message": "Category deleted"}
 
 
 # ==================== PLAN MANAGEMENT ====================
 
-@app.get("/api/plans")
+# Bumped when plan terms change (not on sales_count), so the cache survives a stream of sales
+PLAN_TERMS = "plan_terms"
+plan_cache = VersionedCache(versions_col, PLAN_TERMS, lambda: {p["id"]: p for p in plans_col.find({}, {"_id": 0})})
+
+@app.get("/api/plans", dependencies=[Depends(conditional_get(versions_col, "plans", "categories", auth=require_admin))])
 async def get_plans(category_id: Optional[str] = None, current_user: TokenData = Depends(require_admin)):
     query = {}
     if category_id:
@@ -331,6 +486,7 @@ async def create_plan(plan: PlanCreate, current_user: TokenData = Depends(requir
         "created_at": datetime.utcnow()
     }
     plans_col.insert_one(new_plan)
+    bump_version(versions_col, "plans", PLAN_TERMS)
     return {k: v for k, v in new_plan.items() if k != "_id"}
 
 
@@ -343,6 +499,7 @@ async def update_plan(plan_id: str, plan_update: PlanUpdate, current_user: Token
     update_data = {k: v for k, v in plan_update.model_dump().items() if v is not None}
     if update_data:
         plans_col.update_one({"id": plan_id}, {"$set": update_data})
+        bump_version(versions_col, "plans", PLAN_TERMS)
     
     return plans_col.find_one({"id": plan_id}, {"_id": 0})
 
@@ -352,6 +509,7 @@ async def delete_plan(plan_id: str, current_user: TokenData = Depends(require_ad
     result = plans_col.delete_one({"id": plan_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Plan not found")
+    bump_version(versions_col, "plans", PLAN_TERMS)
     return {"message": "Plan deleted"}
 
 
@@ -362,23 +520,26 @@ async def get_orders(
     status: Optional[str] = None,
     limit: int = 50,
     skip: int = 0,
+    fields: Optional[str] = None,
     current_user: TokenData = Depends(require_admin)
 ):
     query = {}
     if status:
         query["status"] = status
     
-    orders = list(orders_col.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit))
-    total = orders_col.count_documents(query)
+    fieldset = parse_fields(fields)
+    orders = list(analytics_db["orders"].find(
+        query, projection(fieldset, required=["telegram_user_id", "plan_id"])
+    ).sort("created_at", -1).skip(skip).limit(limit))
+    total = count_total(analytics_db["orders"], query)
     
     # Enrich with user and plan info
-    for order in orders:
-        user = users_col.find_one({"telegram_id": order.get("telegram_user_id")}, {"_id": 0})
-        plan = plans_col.find_one({"id": order.get("plan_id")}, {"_id": 0})
-        order["user"] = user
-        order["plan"] = plan
+    if wants(fieldset, "user"):
+        attach(orders, "telegram_user_id", analytics_db["telegram_users"], "telegram_id", "user", projection(fieldset, "user"))
+    if wants(fieldset, "plan"):
+        attach(orders, "plan_id", analytics_db["plans"], "id", "plan", projection(fieldset, "plan"))
     
-    return {"orders": orders, "total": total}
+    return ORJSONResponse({"orders": orders, "total": total})
 
 
 @app.get("/api/payments")
@@ -386,73 +547,155 @@ async def get_payments(
     status: Optional[str] = None,
     limit: int = 50,
     skip: int = 0,
+    fields: Optional[str] = None,
     current_user: TokenData = Depends(require_admin)
 ):
     query = {}
     if status:
         query["status"] = status
     
-    payments = list(payments_col.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit))
-    total = payments_col.count_documents(query)
-    
-    for payment in payments:
-        order = orders_col.find_one({"id": payment.get("order_id")}, {"_id": 0})
-        if order:
-            user = users_col.find_one({"telegram_id": order.get("telegram_user_id")}, {"_id": 0})
-            payment["order"] = order
-            payment["user"] = user
-    
-    return {"payments": payments, "total": total}
+    fieldset = parse_fields(fields)
+    payments = list(payments_col.find(
+        query, projection(fieldset, required=["order_id"])
+    ).sort("created_at", -1).skip(skip).limit(limit))
+    total = count_total(payments_col, query)
+    
+    want_order, want_user = wants(fieldset, "order"), wants(fieldset, "user")
+    if want_order or want_user:
+        order_fields = projection(fieldset, "order", required=["telegram_user_id"]) if want_order else {"_id": 0, "telegram_user_id": 1}
+        attach(payments, "order_id", orders_col, "id", "order", order_fields)
+        if want_user:
+            orders = [payment["order"] for payment in payments if payment["order"]]
+            attach(orders, "telegram_user_id", users_col, "telegram_id", "user", projection(fieldset, "user"))
+            for payment in payments:
+                payment["user"] = payment["order"].pop("user") if payment["order"] else None
+        if not want_order:
+            for payment in payments:
+                payment.pop("order")
+    
+    return ORJSONResponse({"payments": payments, "total": total})
+
+
+@app.get("/api/payments/{payment_id}/receipt")
+async def get_payment_receipt(payment_id: str, thumb: bool = False, current_user: TokenData = Depends(require_admin)):
+    full_path, thumb_path = receipt_paths(payment_id)
+    path = thumb_path if thumb else full_path
+    
+    if not os.path.exists(path):
+        # Not cached yet (e.g. the bot's background download failed): fetch it once
+        payment = payments_col.find_one({"id": payment_id}, {"receipt_file_id": 1})
+        if not payment:
+            raise HTTPException(status_code=404, detail="Payment not found")
+        if not payment.get("receipt_file_id"):
+            raise HTTPException(status_code=404, detail="Receipt not found")
+        
+        settings = settings_col.find_one({"id": "bot_settings"}, {"bot_token": 1}) or {}
+        if not settings.get("bot_token"):
+            raise HTTPException(status_code=503, detail="Bot token not set")
+        try:
+            data = await fetch_from_telegram(settings["bot_token"], payment["receipt_file_id"])
+        except Exception:
+            raise HTTPException(status_code=502, detail="دریافت رسید از تلگرام ناموفق بود")
+        try:
+            # Decoding and re-encoding the image is CPU work, kept off the event loop
+            await run_in_threadpool(store_receipt, payments_col, payment_id, data)
+        except UnidentifiedImageError:
+            raise HTTPException(status_code=502, detail="فایل رسید تصویر معتبری نیست")
+    
+    return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": "private, max-age=31536000, immutable"})
+
+
+def new_subscription(order: dict, plan: dict, now: datetime) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "telegram_user_id": order["telegram_user_id"],
+        "order_id": order["id"],
+        "plan_id": plan["id"],
+        "server_id": order["server_id"],
+        "config_data": None,
+        "expires_at": now + timedelta(days=plan["duration_days"]),
+        "traffic_limit": plan.get("traffic_gb"),
+        "traffic_used": 0,
+        "is_active": True,
+        "created_at": now
+    }
+
+
+def review_notification(order: dict, status: PaymentStatus, plan: Optional[dict], admin_note: Optional[str], now: datetime) -> dict:
+    """Outbox message telling the buyer how their payment was reviewed"""
+    if status == PaymentStatus.APPROVED:
+        text = "✅ پرداخت شما تأیید شد"
+        if plan:
+            text += f" و اشتراک «{plan['name']}» فعال شد.\nبرای مشاهده کانفیگ به بخش «📋 اشتراک‌های من» مراجعه کنید."
+        else:
+            text += "."
+    else:
+        text = "❌ پرداخت شما تأیید نشد."
+        if admin_note:
+            text += f"\nتوضیحات: {admin_note}"
+    return notification(order["telegram_user_id"], text, f"payment_{status.value}", now=now)
 
 
 @app.put("/api/payments/{payment_id}/review")
 async def review_payment(payment_id: str, review: PaymentReview, current_user: TokenData = Depends(require_admin)):
-    payment = payments_col.find_one({"id": payment_id})
-    if not payment:
-        raise HTTPException(status_code=404, detail="Payment not found")
-    
-    payments_col.update_one(
-        {"id": payment_id},
-        {"$set": {
-            "status": review.status.value,
-            "admin_note": review.admin_note,
-            "reviewed_by": current_user.user_id,
-            "reviewed_at": datetime.utcnow()
-        }}
-    )
-    
-    order = orders_col.find_one({"id": payment["order_id"]})
-    
-    if review.status == PaymentStatus.APPROVED:
-        orders_col.update_one(
-            {"id": payment["order_id"]},
-            {"$set": {"status": OrderStatus.CONFIRMED.value, "confirmed_at": datetime.utcnow()}}
+    if review.status == PaymentStatus.PENDING:
+        raise HTTPException(status_code=400, detail="Review status must be approved or rejected")
+    now = datetime.utcnow()
+    
+    def apply(session):
+        # Only a pending payment can be claimed, so two admins cannot both review it
+        payment = payments_col.find_one_and_update(
+            {"id": payment_id, "status": PaymentStatus.PENDING.value},
+            {"$set": {
+                "status": review.status.value,
+                "admin_note": review.admin_note,
+                "reviewed_by": current_user.user_id,
+                "reviewed_at": now
+            }},
+            projection={"_id": 0, "order_id": 1},
+            session=session
         )
+        if not payment:
+            return None, False
+        if review.status == PaymentStatus.REJECTED:
+            order = orders_col.find_one_and_update(
+                {"id": payment["order_id"]},
+                {"$set": {"status": OrderStatus.CANCELLED.value}},
+                projection={"_id": 0, "telegram_user_id": 1},
+                session=session
+            )
+            if order:
+                enqueue(db, [review_notification(order, review.status, None, review.admin_note, now)], session=session)
+            return payment, False
         
-        if order:
-            plan = plans_col.find_one({"id": order["plan_id"]})
-            if plan:
-                subscription = {
-                    "id": str(uuid.uuid4()),
-                    "telegram_user_id": order["telegram_user_id"],
-                    "order_id": order["id"],
-                    "plan_id": plan["id"],
-                    "server_id": order["server_id"],
-                    "config_data": None,
-                    "expires_at": datetime.utcnow() + timedelta(days=plan["duration_days"]),
-                    "traffic_limit": plan.get("traffic_gb"),
-                    "traffic_used": 0,
-                    "is_active": True,
-                    "created_at": datetime.utcnow()
-                }
-                subscriptions_col.insert_one(subscription)
-                plans_col.update_one({"id": plan["id"]}, {"$inc": {"sales_count": 1}})
-    
-    elif review.status == PaymentStatus.REJECTED:
-        orders_col.update_one(
+        order = orders_col.find_one_and_update(
             {"id": payment["order_id"]},
-            {"$set": {"status": OrderStatus.CANCELLED.value}}
+            {"$set": {"status": OrderStatus.CONFIRMED.value, "confirmed_at": now}},
+            projection={"_id": 0, "id": 1, "telegram_user_id": 1, "plan_id": 1, "server_id": 1},
+            session=session
         )
+        if not order:
+            return payment, False
+        plan = plan_cache.lookup(order["plan_id"])
+        # Sent by the dispatcher once this commits, so the admin never waits on Telegram
+        enqueue(db, [review_notification(order, review.status, plan, review.admin_note, now)], session=session)
+        if not plan:
+            return payment, False
+        subscriptions_col.insert_one(new_subscription(order, plan, now), session=session)
+        plans_col.update_one({"id": plan["id"]}, {"$inc": {"sales_count": 1}}, session=session)
+        return payment, True
+    
+    payment, sold = run_transaction(apply)
+    if payment is None:
+        existing = payments_col.find_one({"id": payment_id}, {"_id": 0, "status": 1})
+        if not existing:
+            raise HTTPException(status_code=404, detail="Payment not found")
+        raise HTTPException(status_code=409, detail=f"Payment already {existing['status']}")
+    
+    if sold:
+        bump_version(versions_col, "plans")
+    order_status = OrderStatus.CONFIRMED if review.status == PaymentStatus.APPROVED else OrderStatus.CANCELLED
+    event_hub.publish(ORDER_STATUS, {"id": payment["order_id"], "status": order_status.value})
     
     return {"message": "Payment reviewed"}
 
@@ -460,9 +703,20 @@ async def review_payment(payment_id: str, review: PaymentReview, current_user: T
 # ==================== DISCOUNT CODES ====================
 
 @app.get("/api/discount-codes")
-async def get_discount_codes(current_user: TokenData = Depends(require_admin)):
-    codes = list(discounts_col.find({}, {"_id": 0}))
-    return codes
+async def get_discount_codes(
+    batch_id: Optional[str] = None,
+    limit: int = 50,
+    skip: int = 0,
+    current_user: TokenData = Depends(require_admin)
+):
+    query = {}
+    if batch_id:
+        # Codes from one /api/discount-codes/generate call
+        query["batch_id"] = batch_id
+    
+    codes = list(discounts_col.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit))
+    total = count_total(discounts_col, query)
+    return ORJSONResponse({"discount_codes": codes, "total": total})
 
 
 @app.post("/api/discount-codes")
@@ -477,10 +731,23 @@ async def create_discount_code(code: DiscountCodeCreate, current_user: TokenData
         "used_count": 0,
         "created_at": datetime.utcnow()
     }
-    discounts_col.insert_one(new_code)
+    try:
+        discounts_col.insert_one(new_code)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="کد تکراری است")
     return {k: v for k, v in new_code.items() if k != "_id"}
 
 
+@app.post("/api/discount-codes/generate")
+async def generate_discount_codes(batch: DiscountCodeBatch, current_user: TokenData = Depends(require_admin)):
+    template = batch.model_dump(exclude={"count", "prefix", "length"})
+    batch_id = str(uuid.uuid4())
+    codes = await run_in_threadpool(generate_codes, discounts_col, template, batch.count, batch.prefix.upper(), batch.length, batch_id)
+    if len(codes) < batch.count:
+        print(f"Discount code batch {batch_id}: generated {len(codes)} of {batch.count}")
+    return {"batch_id": batch_id, "count": len(codes), "codes": codes}
+
+
 @app.put("/api/discount-codes/{code_id}")
 async def update_discount_code(code_id: str, code_update: DiscountCodeUpdate, current_user: TokenData = Depends(require_admin)):
     code = discounts_col.find_one({"id": code_id})
@@ -492,7 +759,10 @@ async def update_discount_code(code_id: str, code_update: DiscountCodeUpdate, cu
         update_data["code"] = update_data["code"].upper()
     
     if update_data:
-        discounts_col.update_one({"id": code_id}, {"$set": update_data})
+        try:
+            discounts_col.update_one({"id": code_id}, {"$set": update_data})
+        except DuplicateKeyError:
+            raise HTTPException(status_code=400, detail="کد تکراری است")
     
     return discounts_col.find_one({"id": code_id}, {"_id": 0})
 
@@ -507,7 +777,7 @@ async def delete_discount_code(code_id: str, current_user: TokenData = Depends(r
 
 # ==================== DEPARTMENTS ====================
 
-@app.get("/api/departments")
+@app.get("/api/departments", dependencies=[Depends(conditional_get(versions_col, "departments", auth=require_support))])
 async def get_departments(current_user: TokenData = Depends(require_support)):
     departments = list(departments_col.find({}, {"_id": 0}).sort("sort_order", 1))
     return departments
@@ -521,6 +791,7 @@ async def create_department(dept: DepartmentCreate, current_user: TokenData = De
         "created_at": datetime.utcnow()
     }
     departments_col.insert_one(new_dept)
+    bump_version(versions_col, "departments")
     return {k: v for k, v in new_dept.items() if k != "_id"}
 
 
@@ -533,6 +804,7 @@ async def update_department(dept_id: str, dept_update: DepartmentUpdate, current
     update_data = {k: v for k, v in dept_update.model_dump().items() if v is not None}
     if update_data:
         departments_col.update_one({"id": dept_id}, {"$set": update_data})
+        bump_version(versions_col, "departments")
     
     return departments_col.find_one({"id": dept_id}, {"_id": 0})
 
@@ -542,6 +814,7 @@ async def delete_department(dept_id: str, current_user: TokenData = Depends(requ
     result = departments_col.delete_one({"id": dept_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Department not found")
+    bump_version(versions_col, "departments")
     return {"message": "Department deleted"}
 
 
@@ -553,6 +826,7 @@ async def get_tickets(
     department_id: Optional[str] = None,
     limit: int = 50,
     skip: int = 0,
+    fields: Optional[str] = None,
     current_user: TokenData = Depends(require_support)
 ):
     query = {}
@@ -561,23 +835,46 @@ async def get_tickets(
     if department_id:
         query["department_id"] = department_id
     
-    tickets = list(tickets_col.find(query, {"_id": 0}).sort("updated_at", -1).skip(skip).limit(limit))
-    total = tickets_col.count_documents(query)
+    fieldset = parse_fields(fields)
+    fields_projection = projection(fieldset, required=["telegram_user_id", "department_id"])
+    if fieldset is None:
+        # Tickets not migrated yet still embed their messages; the list has message_count and last_message
+        fields_projection["messages"] = 0
+    tickets = list(tickets_col.find(
+        query, fields_projection
+    ).sort("updated_at", -1).skip(skip).limit(limit))
+    total = count_total(tickets_col, query)
     
-    for ticket in tickets:
-        user = users_col.find_one({"telegram_id": ticket.get("telegram_user_id")}, {"_id": 0})
-        dept = departments_col.find_one({"id": ticket.get("department_id")}, {"_id": 0})
-        ticket["user"] = user
-        ticket["department"] = dept
+    if wants(fieldset, "user"):
+        attach(tickets, "telegram_user_id", users_col, "telegram_id", "user", projection(fieldset, "user"))
+    if wants(fieldset, "department"):
+        attach(tickets, "department_id", departments_col, "id", "department", projection(fieldset, "department"))
     
-    return {"tickets": tickets, "total": total}
+    return ORJSONResponse({"tickets": tickets, "total": total})
 
 
 @app.get("/api/tickets/{ticket_id}")
-async def get_ticket(ticket_id: str, current_user: TokenData = Depends(require_support)):
+async def get_ticket(
+    ticket_id: str,
+    before: Optional[datetime] = None,
+    before_id: Optional[str] = None,
+    limit: int = MESSAGES_PAGE_SIZE,
+    current_user: TokenData = Depends(require_support)
+):
+    """The ticket with its newest messages; ?before=<messages_before>&before_id=<messages_before_id> pages back"""
     ticket = tickets_col.find_one({"id": ticket_id}, {"_id": 0})
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
+    if "messages" in ticket:
+        # Not reached by the migration yet
+        migrate_ticket(db, ticket_id)
+        ticket = tickets_col.find_one({"id": ticket_id}, {"_id": 0, "messages": 0})
+    
+    messages, has_more = get_messages(db, ticket_id, before, before_id, min(max(limit, 1), 200))
+    ticket["messages"] = messages
+    ticket["has_more_messages"] = has_more
+    ticket["messages_before"] = messages[0]["created_at"] if has_more else None
+    ticket["messages_before_id"] = messages[0]["id"] if has_more else None
     
     user = users_col.find_one({"telegram_id": ticket.get("telegram_user_id")}, {"_id": 0})
     dept = departments_col.find_one({"id": ticket.get("department_id")}, {"_id": 0})
@@ -589,30 +886,35 @@ async def get_ticket(ticket_id: str, current_user: TokenData = Depends(require_s
 
 @app.post("/api/tickets/{ticket_id}/reply")
 async def reply_ticket(ticket_id: str, reply: TicketReply, current_user: TokenData = Depends(require_support)):
-    ticket = tickets_col.find_one({"id": ticket_id})
+    now = datetime.utcnow()
+    message = new_message(ticket_id, reply.message, True, current_user.user_id, current_user.username, now)
+    
+    def apply(session):
+        ticket = add_message(
+            db, message,
+            {"status": TicketStatus.ANSWERED.value, "updated_at": now, "last_reply_by": "admin"},
+            session=session,
+            projection={"telegram_user_id": 1, "subject": 1}
+        )
+        if ticket:
+            enqueue(db, [notification(
+                ticket["telegram_user_id"],
+                f"💬 پاسخ جدید به تیکت «{ticket.get('subject', '')}»:\n\n{reply.message}",
+                "ticket_reply",
+                now=now
+            )], session=session)
+        return ticket
+    
+    ticket = run_transaction(apply)
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
-    
-    message = {
-        "id": str(uuid.uuid4()),
-        "message": reply.message,
-        "is_admin": True,
-        "admin_id": current_user.user_id,
-        "admin_username": current_user.username,
-        "created_at": datetime.utcnow()
-    }
-    
-    tickets_col.update_one(
-        {"id": ticket_id},
-        {
-            "$push": {"messages": message},
-            "$set": {
-                "status": TicketStatus.ANSWERED.value,
-                "updated_at": datetime.utcnow(),
-                "last_reply_by": "admin"
-            }
-        }
-    )
+    if "message_count" not in ticket:
+        # Answered before the migration reached it: the count only has this reply so far
+        migrate_ticket(db, ticket_id)
+    event_hub.publish(TICKET_REPLY, {
+        "ticket_id": ticket_id,
+        **{k: message[k] for k in ("id", "is_admin", "admin_username", "created_at")}
+    })
     
     return {"message": "Reply sent"}
 
@@ -632,7 +934,7 @@ async def update_ticket(ticket_id: str, ticket_update: TicketUpdate, current_use
     update_data["updated_at"] = datetime.utcnow()
     
     tickets_col.update_one({"id": ticket_id}, {"$set": update_data})
-    return tickets_col.find_one({"id": ticket_id}, {"_id": 0})
+    return tickets_col.find_one({"id": ticket_id}, {"_id": 0, "messages": 0})
 
 
 # ==================== RESELLERS ====================
@@ -718,24 +1020,21 @@ async def get_telegram_users(
     is_banned: Optional[bool] = None,
     limit: int = 50,
     skip: int = 0,
+    fields: Optional[str] = None,
     current_user: TokenData = Depends(require_admin)
 ):
     query = {}
     if search:
-        query["$or"] = [
-            {"username": {"$regex": search, "$options": "i"}},
-            {"first_name": {"$regex": search, "$options": "i"}},
-            {"telegram_id": {"$regex": search, "$options": "i"}} if search.isdigit() else {}
-        ]
+        query.update(user_search(search))
     if is_reseller is not None:
         query["is_reseller"] = is_reseller
     if is_banned is not None:
         query["is_banned"] = is_banned
     
-    users = list(users_col.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit))
-    total = users_col.count_documents(query)
+    users = list(analytics_db["telegram_users"].find(query, projection(parse_fields(fields))).sort("created_at", -1).skip(skip).limit(limit))
+    total = count_total(analytics_db["telegram_users"], query)
     
-    return {"users": users, "total": total}
+    return ORJSONResponse({"users": users, "total": total})
 
 
 @app.put("/api/users/{telegram_id}/ban")
@@ -761,7 +1060,7 @@ async def update_wallet(telegram_id: int, amount: float, current_user: TokenData
 
 # ==================== BOT SETTINGS ====================
 
-@app.get("/api/settings")
+@app.get("/api/settings", dependencies=[Depends(conditional_get(versions_col, "bot_settings", auth=require_admin))])
 async def get_settings(current_user: TokenData = Depends(require_admin)):
     settings = settings_col.find_one({"id": "bot_settings"}, {"_id": 0})
     return settings
@@ -772,6 +1071,7 @@ async def update_settings(settings_update: BotSettingsUpdate, current_user: Toke
     update_data = {k: v for k, v in settings_update.model_dump().items() if v is not None}
     if update_data:
         settings_col.update_one({"id": "bot_settings"}, {"$set": update_data})
+        bump_version(versions_col, "bot_settings")
     return settings_col.find_one({"id": "bot_settings"}, {"_id": 0})
 
 
@@ -794,6 +1094,293 @@ async def send_broadcast(broadcast: BroadcastCreate, background_tasks: Backgroun
     }
 
 
+# ==================== BULK OPERATIONS ====================
+
+def bulk_response(results: List[dict]) -> dict:
+    succeeded = sum(1 for r in results if r["ok"])
+    return {"results": results, "succeeded": succeeded, "failed": len(results) - succeeded}
+
+
+@app.post("/api/bulk/users/ban")
+async def bulk_ban_users(request: BulkBanRequest, current_user: TokenData = Depends(require_admin)):
+    ids = list(dict.fromkeys(request.telegram_ids))
+    found = {u["telegram_id"] for u in users_col.find({"telegram_id": {"$in": ids}}, {"_id": 0, "telegram_id": 1})}
+    if found:
+        users_col.update_many({"telegram_id": {"$in": list(found)}}, {"$set": {"is_banned": request.is_banned}})
+    
+    results = [
+        {"telegram_id": telegram_id, "ok": True, "is_banned": request.is_banned} if telegram_id in found
+        else {"telegram_id": telegram_id, "ok": False, "error": "User not found"}
+        for telegram_id in ids
+    ]
+    return bulk_response(results)
+
+
+@app.post("/api/bulk/users/wallet")
+async def bulk_adjust_wallets(request: BulkWalletRequest, current_user: TokenData = Depends(require_admin)):
+    totals = {}
+    for adjustment in request.adjustments:
+        totals[adjustment.telegram_id] = totals.get(adjustment.telegram_id, 0) + adjustment.amount
+    
+    balances = {
+        u["telegram_id"]: u.get("wallet_balance", 0)
+        for u in users_col.find({"telegram_id": {"$in": list(totals)}}, {"_id": 0, "telegram_id": 1, "wallet_balance": 1})
+    }
+    
+    batch_id = str(uuid.uuid4())
+    results, operations, guarded = {}, [], set()
+    for telegram_id, amount in totals.items():
+        if telegram_id not in balances:
+            results[telegram_id] = {"telegram_id": telegram_id, "ok": False, "error": "User not found"}
+            continue
+        query = {"telegram_id": telegram_id}
+        if amount < 0 and not request.allow_negative:
+            if balances[telegram_id] + amount < 0:
+                results[telegram_id] = {"telegram_id": telegram_id, "ok": False, "error": "موجودی کافی نیست"}
+                continue
+            # Re-checked by the update itself in case the balance changed meanwhile
+            query["wallet_balance"] = {"$gte": -amount}
+            guarded.add(telegram_id)
+        # The batch id tells which updates matched
+        operations.append(UpdateOne(query, {"$inc": {"wallet_balance": amount}, "$set": {"wallet_batch": batch_id}}))
+    
+    if operations:
+        users_col.bulk_write(operations, ordered=False)
+    stored = {
+        u["telegram_id"]: u["wallet_balance"]
+        for u in users_col.find({"wallet_batch": batch_id}, {"_id": 0, "telegram_id": 1, "wallet_balance": 1})
+    }
+    for telegram_id, amount in totals.items():
+        if telegram_id in results:
+            continue
+        if telegram_id in stored:
+            results[telegram_id] = {"telegram_id": telegram_id, "ok": True, "amount": amount, "wallet_balance": stored[telegram_id]}
+        else:
+            error = "موجودی کافی نیست" if telegram_id in guarded else "User not found"
+            results[telegram_id] = {"telegram_id": telegram_id, "ok": False, "error": error}
+    return bulk_response([results[telegram_id] for telegram_id in totals])
+
+
+@app.post("/api/bulk/plans/price")
+async def bulk_update_plan_prices(request: BulkPlanPriceRequest, current_user: TokenData = Depends(require_admin)):
+    plans = list(plans_col.find({"category_id": request.category_id}, {"_id": 0, "id": 1, "name": 1, "price": 1}))
+    if not plans:
+        raise HTTPException(status_code=404, detail="No plans in this category")
+    
+    factor = 1 + request.percent / 100
+    batch_id = str(uuid.uuid4())
+    new_prices, operations = {}, []
+    for plan in plans:
+        new_price = round(plan["price"] * factor / request.round_to) * request.round_to
+        # Rounding a cheap plan (or a large cut) down to zero would make it free
+        if new_price > 0:
+            new_prices[plan["id"]] = new_price
+            # Only applied if nobody changed the price since it was read; the batch id tells which ones were
+            operations.append(UpdateOne(
+                {"id": plan["id"], "price": plan["price"]}, {"$set": {"price": new_price, "price_batch": batch_id}}
+            ))
+    
+    updated = set()
+    if operations:
+        plans_col.bulk_write(operations, ordered=False)
+        updated = {p["id"] for p in plans_col.find({"price_batch": batch_id}, {"_id": 0, "id": 1})}
+    results = []
+    for plan in plans:
+        result = {"id": plan["id"], "name": plan["name"], "old_price": plan["price"]}
+        if plan["id"] not in new_prices:
+            results.append({**result, "ok": False, "error": "قیمت جدید باید بیشتر از صفر باشد"})
+        elif plan["id"] in updated:
+            results.append({**result, "ok": True, "new_price": new_prices[plan["id"]]})
+        else:
+            results.append({**result, "ok": False, "error": "قیمت در این فاصله تغییر کرده است"})
+    
+    if updated:
+        bump_version(versions_col, "plans", PLAN_TERMS)
+    return bulk_response(results)
+
+
+@app.post("/api/bulk/payments/review")
+async def bulk_review_payments(request: BulkPaymentReview, current_user: TokenData = Depends(require_admin)):
+    if request.status == PaymentStatus.PENDING:
+        raise HTTPException(status_code=400, detail="Review status must be approved or rejected")
+    ids = list(dict.fromkeys(request.payment_ids))
+    now = datetime.utcnow()
+    batch_id = str(uuid.uuid4())
+    
+    def apply(session):
+        # Claim the pending ones in one update; the batch id tells which ones this request won
+        payments_col.update_many(
+            {"id": {"$in": ids}, "status": PaymentStatus.PENDING.value},
+            {"$set": {
+                "status": request.status.value,
+                "admin_note": request.admin_note,
+                "reviewed_by": current_user.user_id,
+                "reviewed_at": now,
+                "review_batch": batch_id
+            }},
+            session=session
+        )
+        claimed = {p["id"]: p for p in payments_col.find({"review_batch": batch_id}, {"_id": 0, "id": 1, "order_id": 1}, session=session)}
+        if not claimed:
+            return claimed, False
+        
+        order_ids = [p["order_id"] for p in claimed.values()]
+        orders = list(orders_col.find(
+            {"id": {"$in": order_ids}}, {"_id": 0, "id": 1, "telegram_user_id": 1, "plan_id": 1, "server_id": 1}, session=session
+        ))
+        if request.status == PaymentStatus.REJECTED:
+            orders_col.update_many({"id": {"$in": order_ids}}, {"$set": {"status": OrderStatus.CANCELLED.value}}, session=session)
+            enqueue(db, [review_notification(o, request.status, None, request.admin_note, now) for o in orders], session=session)
+            return claimed, False
+        
+        orders_col.update_many(
+            {"id": {"$in": order_ids}},
+            {"$set": {"status": OrderStatus.CONFIRMED.value, "confirmed_at": now}},
+            session=session
+        )
+        subscriptions, sales, notifications = [], {}, []
+        for order in orders:
+            plan = plan_cache.lookup(order["plan_id"])
+            notifications.append(review_notification(order, request.status, plan, request.admin_note, now))
+            if plan:
+                subscriptions.append(new_subscription(order, plan, now))
+                sales[plan["id"]] = sales.get(plan["id"], 0) + 1
+        if subscriptions:
+            subscriptions_col.insert_many(subscriptions, ordered=False, session=session)
+        enqueue(db, notifications, session=session)
+        if sales:
+            plans_col.bulk_write(
+                [UpdateOne({"id": plan_id}, {"$inc": {"sales_count": n}}) for plan_id, n in sales.items()],
+                ordered=False, session=session
+            )
+        return claimed, bool(sales)
+    
+    claimed, sold = run_transaction(apply)
+    existing = {p["id"]: p["status"] for p in payments_col.find(
+        {"id": {"$in": [i for i in ids if i not in claimed]}}, {"_id": 0, "id": 1, "status": 1}
+    )} if len(claimed) < len(ids) else {}
+    
+    if sold:
+        bump_version(versions_col, "plans")
+    order_status = OrderStatus.CONFIRMED if request.status == PaymentStatus.APPROVED else OrderStatus.CANCELLED
+    for payment in claimed.values():
+        event_hub.publish(ORDER_STATUS, {"id": payment["order_id"], "status": order_status.value})
+    
+    results = []
+    for payment_id in ids:
+        if payment_id in claimed:
+            results.append({"id": payment_id, "ok": True, "status": request.status.value})
+        elif payment_id in existing:
+            results.append({"id": payment_id, "ok": False, "error": f"Payment already {existing[payment_id]}"})
+        else:
+            results.append({"id": payment_id, "ok": False, "error": "Payment not found"})
+    return bulk_response(results)
+
+
+# ==================== EXPORT ====================
+
+@app.get("/api/export/{name}")
+async def export_collection(
+    name: str,
+    request: Request,
+    format: str = "csv",
+    gzip: bool = False,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    current_user: TokenData = Depends(require_admin)
+):
+    export = EXPORTS.get(name)
+    if not export:
+        raise HTTPException(status_code=404, detail="Export not found")
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    try:
+        query = build_query(export, dict(request.query_params), date_from, date_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    columns = [f.strip() for f in fields.split(",") if f.strip()] if fields else export["columns"]
+    # A sync generator: Starlette iterates it in the threadpool, one cursor batch at a time
+    docs = iter_documents(analytics_db[export["collection"]], query, columns, export["date_field"])
+    chunks = csv_chunks(docs, columns) if format == "csv" else ndjson_chunks(docs)
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    filename = f"{name}-{datetime.utcnow():%Y%m%d-%H%M%S}.{format}"
+    if gzip:
+        # Served as a .gz file rather than Content-Encoding, so clients save it compressed
+        chunks = gzip_chunks(chunks)
+        media_type = "application/gzip"
+        filename += ".gz"
+    
+    return StreamingResponse(chunks, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+# ==================== IMPORT ====================
+
+@app.post("/api/import/{name}")
+async def import_collection(
+    name: str,
+    request: Request,
+    format: str = "csv",
+    on_conflict: str = "skip",
+    dry_run: bool = False,
+    current_user: TokenData = Depends(require_admin)
+):
+    """Raw CSV/NDJSON body, e.g. curl --data-binary @users.csv"""
+    if name not in IMPORTS:
+        raise HTTPException(status_code=404, detail="Import not found")
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    if on_conflict not in ("skip", "update"):
+        raise HTTPException(status_code=400, detail="on_conflict must be skip or update")
+    
+    spool = await spool_upload(request)
+    try:
+        report = await run_in_threadpool(run_import, db, name, spool, format, on_conflict, dry_run)
+    finally:
+        spool.close()
+    if name == "plans" and report["inserted"]:
+        bump_version(versions_col, "plans", PLAN_TERMS)
+    return report
+
+
+# ==================== EVENTS ====================
+
+@app.get("/api/events")
+async def stream_events(types: Optional[str] = None, current_user: TokenData = Depends(get_stream_user)):
+    """Server-Sent Events for the admin panel: new payments and tickets, ticket replies, order status"""
+    allowed = set(ROLE_EVENTS.get(current_user.role, EVENT_TYPES))
+    if types:
+        allowed &= {t.strip() for t in types.split(",")}
+    
+    async def stream():
+        queue = await event_hub.subscribe()
+        try:
+            yield f"retry: {int(EVENTS_RETRY_SECONDS * 1000)}\n\n".encode()
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle connection
+                    yield b": ping\n\n"
+                    continue
+                if event["type"] in allowed:
+                    yield format_sse(event)
+        finally:
+            event_hub.unsubscribe(queue)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
+@app.post("/api/events/token")
+async def create_events_token(current_user: TokenData = Depends(require_support)):
+    """Short-lived token for /api/events?token=, so the session token stays out of URLs and access logs"""
+    return {"token": create_stream_token(current_user), "expires_in": STREAM_TOKEN_SECONDS}
+
+
 # ==================== SUBSCRIPTIONS ====================
 
 @app.get("/api/subscriptions")
@@ -801,22 +1388,25 @@ async def get_subscriptions(
     is_active: Optional[bool] = None,
     limit: int = 50,
     skip: int = 0,
+    fields: Optional[str] = None,
     current_user: TokenData = Depends(require_admin)
 ):
     query = {}
     if is_active is not None:
         query["is_active"] = is_active
     
-    subs = list(subscriptions_col.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit))
-    total = subscriptions_col.count_documents(query)
+    fieldset = parse_fields(fields)
+    subs = list(analytics_db["subscriptions"].find(
+        query, projection(fieldset, required=["telegram_user_id", "plan_id"])
+    ).sort("created_at", -1).skip(skip).limit(limit))
+    total = count_total(analytics_db["subscriptions"], query)
     
-    for sub in subs:
-        user = users_col.find_one({"telegram_id": sub.get("telegram_user_id")}, {"_id": 0})
-        plan = plans_col.find_one({"id": sub.get("plan_id")}, {"_id": 0})
-        sub["user"] = user
-        sub["plan"] = plan
+    if wants(fieldset, "user"):
+        attach(subs, "telegram_user_id", analytics_db["telegram_users"], "telegram_id", "user", projection(fieldset, "user"))
+    if wants(fieldset, "plan"):
+        attach(subs, "plan_id", analytics_db["plans"], "id", "plan", projection(fieldset, "plan"))
     
-    return {"subscriptions": subs, "total": total}
+    return ORJSONResponse({"subscriptions": subs, "total": total})
 
 
 # ==================== DASHBOARD ====================
@@ -825,20 +1415,20 @@ async def get_subscriptions(
 async def get_dashboard_stats(current_user: TokenData = Depends(require_admin)):
     today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
     
-    total_users = users_col.count_documents({})
-    total_orders = orders_col.count_documents({})
-    pending_payments = payments_col.count_documents({"status": PaymentStatus.PENDING.value})
-    active_subs = subscriptions_col.count_documents({"is_active": True, "expires_at": {"$gt": datetime.utcnow()}})
-    open_tickets = tickets_col.count_documents({"status": {"$in": [TicketStatus.OPEN.value, TicketStatus.WAITING.value]}})
-    total_resellers = resellers_col.count_documents({})
+    total_users = analytics_db["telegram_users"].estimated_document_count()
+    total_orders = analytics_db["orders"].estimated_document_count()
+    pending_payments = analytics_db["payments"].count_documents({"status": PaymentStatus.PENDING.value})
+    active_subs = analytics_db["subscriptions"].count_documents({"is_active": True, "expires_at": {"$gt": datetime.utcnow()}})
+    open_tickets = analytics_db["tickets"].count_documents({"status": {"$in": [TicketStatus.OPEN.value, TicketStatus.WAITING.value]}})
+    total_resellers = analytics_db["resellers"].estimated_document_count()
     
     # Revenue
-    confirmed_orders = list(orders_col.find({"status": OrderStatus.CONFIRMED.value}, {"final_price": 1, "confirmed_at": 1}))
+    confirmed_orders = list(analytics_db["orders"].find({"status": OrderStatus.CONFIRMED.value}, {"final_price": 1, "confirmed_at": 1}))
     total_revenue = sum(o.get("final_price", 0) for o in confirmed_orders)
     today_revenue = sum(o.get("final_price", 0) for o in confirmed_orders if o.get("confirmed_at") and o["confirmed_at"] >= today)
     
-    today_orders = orders_col.count_documents({"created_at": {"$gte": today}})
-    today_users = users_col.count_documents({"created_at": {"$gte": today}})
+    today_orders = analytics_db["orders"].count_documents({"created_at": {"$gte": today}})
+    today_users = analytics_db["telegram_users"].count_documents({"created_at": {"$gte": today}})
     
     return DashboardStats(
         total_users=total_users,
@@ -861,15 +1451,15 @@ async def get_dashboard_chart(days: int = 7, current_user: TokenData = Depends(r
         date = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=i)
         next_date = date + timedelta(days=1)
         
-        orders = orders_col.count_documents({
+        orders = analytics_db["orders"].count_documents({
             "created_at": {"$gte": date, "$lt": next_date}
         })
-        confirmed = list(orders_col.find({
+        confirmed = list(analytics_db["orders"].find({
             "status": OrderStatus.CONFIRMED.value,
             "confirmed_at": {"$gte": date, "$lt": next_date}
         }, {"final_price": 1}))
         revenue = sum(o.get("final_price", 0) for o in confirmed)
-        users = users_col.count_documents({"created_at": {"$gte": date, "$lt": next_date}})
+        users = analytics_db["telegram_users"].count_documents({"created_at": {"$gte": date, "$lt": next_date}})
         
         data.append({
             "date": date.strftime("%Y-%m-%d"),
@@ -881,6 +1471,31 @@ async def get_dashboard_chart(days: int = 7, current_user: TokenData = Depends(r
     return data
 
 
+# ==================== SLOW QUERIES ====================
+
+@app.get("/api/admin/slow-queries")
+async def get_slow_queries(
+    collection: Optional[str] = None,
+    limit: int = 50,
+    current_user: TokenData = Depends(require_super_admin)
+):
+    query = {}
+    if collection:
+        query["collection"] = collection
+    
+    entries = list(analytics_db[SLOW_QUERIES_COLLECTION].find(query).sort("total_ms", -1).limit(limit))
+    for entry in entries:
+        entry["id"] = entry.pop("_id")
+        entry["avg_ms"] = entry["total_ms"] / entry["count"]
+    return entries
+
+
+@app.delete("/api/admin/slow-queries")
+async def clear_slow_queries(current_user: TokenData = Depends(require_super_admin)):
+    db[SLOW_QUERIES_COLLECTION].delete_many({})
+    return {"message": "Slow query log cleared"}
+
+
 # ==================== HEALTH CHECK ====================
 
 @app.get("/api/health")
@@ -888,6 +1503,17 @@ async def health_check():
     return {"status": "ok", "timestamp": datetime.utcnow().isoformat()}
 
 
+@app.get("/api/metrics")
+async def get_metrics(request: Request):
+    # Route and database statistics are not public: off until a scrape token is configured
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Metrics disabled, set METRICS_TOKEN")
+    if not secrets.compare_digest(request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -0,0 +1,158 @@
+"""
+Server health monitor: probes all active panels concurrently, records latency/error
+history and live client counts, and picks servers for new orders by load
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from pymongo import UpdateOne
+
+from etags import bump_version
+from panel_api import PanelClient, count_clients
+
+HEALTH_CHECK_INTERVAL_SECONDS = int(os.environ.get("HEALTH_CHECK_INTERVAL_SECONDS", "60"))
+HEALTH_CHECK_CONCURRENCY = int(os.environ.get("HEALTH_CHECK_CONCURRENCY", "20"))
+HEALTH_FAILURE_THRESHOLD = int(os.environ.get("HEALTH_FAILURE_THRESHOLD", "2"))
+HEALTH_HISTORY_DAYS = int(os.environ.get("HEALTH_HISTORY_DAYS", "7"))
+# Change on every probe; served by /api/servers/health, not /api/servers
+PER_ROUND_FIELDS = ("health.latency_ms", "health.checked_at")
+
+
+async def probe_server(server: dict) -> dict:
+    """Log in to a panel and read its client counts"""
+    started = time.perf_counter()
+    result = {"server_id": server["id"], "ok": False, "latency_ms": None, "error": None,
+              "clients": None, "online": None, "checked_at": datetime.utcnow()}
+    try:
+        async with PanelClient(server) as panel:
+            result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            inbounds, online = await asyncio.gather(panel.list_inbounds(), panel.online_clients())
+        result["clients"] = count_clients(inbounds)
+        result["online"] = len(online)
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = str(e) or e.__class__.__name__
+    return result
+
+
+def stored_value(doc: dict, field: str):
+    for key in field.split("."):
+        doc = (doc or {}).get(key)
+    return doc
+
+
+async def check_servers(db):
+    """Probe every active server and store the results"""
+    servers_col = db["servers"]
+    servers = list(servers_col.find({"is_active": True}, {"_id": 0}))
+    if not servers:
+        return []
+
+    semaphore = asyncio.Semaphore(HEALTH_CHECK_CONCURRENCY)
+
+    async def bounded(server):
+        async with semaphore:
+            return await probe_server(server)
+
+    results = await asyncio.gather(*(bounded(server) for server in servers))
+    stored = {s["id"]: s for s in servers}
+
+    updates = []
+    changed = False
+    for result in results:
+        server = stored[result["server_id"]]
+        health = server.get("health") or {}
+        failures = 0 if result["ok"] else health.get("consecutive_failures", 0) + 1
+        fields = {
+            "health.status": "up" if failures < HEALTH_FAILURE_THRESHOLD else "down",
+            "health.latency_ms": result["latency_ms"],
+            "health.error": result["error"],
+            "health.consecutive_failures": failures,
+            "health.checked_at": result["checked_at"],
+        }
+        if result["ok"]:
+            fields["current_users"] = result["clients"]
+            fields["online_users"] = result["online"]
+        updates.append(UpdateOne({"id": result["server_id"]}, {"$set": fields}))
+        changed = changed or any(
+            stored_value(server, field) != value for field, value in fields.items() if field not in PER_ROUND_FIELDS
+        )
+
+    servers_col.bulk_write(updates, ordered=False)
+    # /api/servers leaves out the per-round fields, so its ETag only moves when something it shows changed
+    if changed:
+        bump_version(db["collection_versions"], "servers")
+    db["server_health"].insert_many([dict(r) for r in results], ordered=False)
+    return results
+
+
+def get_health_summary(db) -> List[dict]:
+    """Current state plus 24h uptime/latency for every server"""
+    since = datetime.utcnow() - timedelta(hours=24)
+    stats = {
+        row["_id"]: row for row in db["server_health"].aggregate([
+            {"$match": {"checked_at": {"$gte": since}}},
+            {"$group": {
+                "_id": "$server_id",
+                "checks": {"$sum": 1},
+                "ok": {"$sum": {"$cond": ["$ok", 1, 0]}},
+                "avg_latency_ms": {"$avg": "$latency_ms"},
+                "max_latency_ms": {"$max": "$latency_ms"},
+            }}
+        ])
+    }
+
+    summary = []
+    for server in db["servers"].find({}, {"_id": 0, "panel_password": 0}).sort("name", 1):
+        health = server.get("health") or {}
+        row = stats.get(server["id"], {})
+        summary.append({
+            "id": server["id"],
+            "name": server["name"],
+            "is_active": server.get("is_active", True),
+            "status": health.get("status", "unknown") if server.get("is_active", True) else "disabled",
+            "latency_ms": health.get("latency_ms"),
+            "error": health.get("error"),
+            "checked_at": health.get("checked_at"),
+            "current_users": server.get("current_users", 0),
+            "online_users": server.get("online_users"),
+            "max_users": server.get("max_users"),
+            "load": server_load(server),
+            "uptime_24h": round(row["ok"] / row["checks"] * 100, 1) if row.get("checks") else None,
+            "avg_latency_ms_24h": round(row["avg_latency_ms"], 1) if row.get("avg_latency_ms") is not None else None,
+            "max_latency_ms_24h": row.get("max_latency_ms"),
+        })
+    return summary
+
+
+def server_load(server: dict) -> float:
+    """Fraction of capacity in use (0 for servers without max_users)"""
+    if not server.get("max_users"):
+        return 0.0
+    return server.get("current_users", 0) / server["max_users"]
+
+
+def is_available(server: dict) -> bool:
+    """Healthy (or not checked recently) and not full"""
+    health = server.get("health") or {}
+    checked_at = health.get("checked_at")
+    stale = not checked_at or checked_at < datetime.utcnow() - timedelta(seconds=HEALTH_CHECK_INTERVAL_SECONDS * 3)
+    if health.get("status") == "down" and not stale:
+        return False
+    if server.get("max_users") and server.get("current_users", 0) >= server["max_users"]:
+        return False
+    return True
+
+
+def select_servers(servers: List[dict]) -> List[dict]:
+    """Available servers, least loaded first"""
+    available = [s for s in servers if is_available(s)]
+    return sorted(available, key=lambda s: (
+        server_load(s),
+        s.get("current_users", 0),
+        (s.get("health") or {}).get("latency_ms") or 0
+    ))
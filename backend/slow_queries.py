@@ -0,0 +1,158 @@
+"""
+Slow-operation log: Mongo commands over SLOW_QUERY_MS are aggregated per
+(query shape, route) in the slow_queries collection, with a sampled
+explain() showing whether the plan was a COLLSCAN or an in-memory SORT
+"""
+
+import hashlib
+import os
+import queue
+import random
+import threading
+from datetime import datetime
+from typing import List
+
+from pymongo import monitoring
+
+from query_recorder import current_operation, query_shape
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+EXPLAIN_SAMPLE_RATE = float(os.environ.get("EXPLAIN_SAMPLE_RATE", "0.1"))
+
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+# Session/transport fields that explain() does not accept
+COMMAND_METADATA = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern"}
+
+SLOW_QUERIES_COLLECTION = "slow_queries"
+
+
+def plan_stages(plan) -> List[str]:
+    """Flatten the stage names of an explain() plan tree"""
+    if not isinstance(plan, dict):
+        return []
+    stages = [plan["stage"]] if "stage" in plan else []
+    for key in ("inputStage", "queryPlan", "outerStage", "innerStage"):
+        stages += plan_stages(plan.get(key))
+    for child in plan.get("inputStages", []):
+        stages += plan_stages(child)
+    return stages
+
+
+def explain_summary(explain: dict) -> dict:
+    """Winning plan stages of a find/aggregate/count explain() result"""
+    planner = explain.get("queryPlanner")
+    if planner is None:
+        for stage in explain.get("stages", []):
+            if "$cursor" in stage:
+                planner = stage["$cursor"].get("queryPlanner")
+                break
+    stages = plan_stages((planner or {}).get("winningPlan"))
+    return {
+        "stages": stages,
+        "collscan": "COLLSCAN" in stages,
+        "in_memory_sort": "SORT" in stages,
+        "index_names": sorted({name for name in _index_names((planner or {}).get("winningPlan"))}),
+    }
+
+
+def _index_names(plan) -> List[str]:
+    if not isinstance(plan, dict):
+        return []
+    names = [plan["indexName"]] if "indexName" in plan else []
+    for key in ("inputStage", "queryPlan", "outerStage", "innerStage"):
+        names += _index_names(plan.get(key))
+    for child in plan.get("inputStages", []):
+        names += _index_names(child)
+    return names
+
+
+def explain_command(db, command_name: str, command: dict, verbosity: str = "queryPlanner") -> dict:
+    """Run explain() for a captured command"""
+    command = {k: v for k, v in command.items() if not k.startswith("$") and k not in COMMAND_METADATA}
+    if command_name == "aggregate":
+        command.pop("cursor", None)
+    return db.command("explain", command, verbosity=verbosity)
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS):
+        self.threshold_ms = threshold_ms
+        self.queue = queue.Queue(maxsize=1000)
+        self._pending = {}
+
+    def started(self, event):
+        if event.command_name not in EXPLAINABLE_COMMANDS:
+            return
+        if event.command.get(event.command_name) == SLOW_QUERIES_COLLECTION:
+            return
+        self._pending[(event.connection_id, event.request_id)] = (
+            event.database_name, dict(event.command), current_operation()
+        )
+
+    def succeeded(self, event):
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        duration_ms = event.duration_micros / 1000
+        if pending is None or duration_ms < self.threshold_ms:
+            return
+        database_name, command, operation = pending
+        try:
+            self.queue.put_nowait((database_name, event.command_name, command, operation, duration_ms))
+        except queue.Full:
+            pass
+
+    def failed(self, event):
+        self._pending.pop((event.connection_id, event.request_id), None)
+
+
+class SlowQueryLog:
+    """Owns the listener and the writer thread that records slow queries"""
+
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS, sample_rate: float = EXPLAIN_SAMPLE_RATE):
+        self.listener = SlowQueryListener(threshold_ms)
+        self.sample_rate = sample_rate
+        self.client = None
+        self._thread = None
+
+    def register(self):
+        """Must run before any MongoClient is created"""
+        monitoring.register(self.listener)
+
+    def start(self, client):
+        self.client = client
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="slow-query-log", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self.listener.queue.get()
+            try:
+                self.record(*item)
+            except Exception as e:
+                print(f"Slow query log failed: {e}")
+
+    def record(self, database_name: str, command_name: str, command: dict, operation: str, duration_ms: float):
+        db = self.client[database_name]
+        shape = query_shape(command_name, command)
+        key = hashlib.sha1(f"{shape}|{operation}".encode()).hexdigest()
+        collection = command.get(command_name)
+        now = datetime.utcnow()
+
+        col = db[SLOW_QUERIES_COLLECTION]
+        existing = col.find_one({"_id": key}, {"explain": 1})
+        update = {
+            "$inc": {"count": 1, "total_ms": duration_ms},
+            "$max": {"max_ms": duration_ms},
+            "$set": {"last_seen": now},
+            "$setOnInsert": {"shape": shape, "operation": operation, "collection": collection, "first_seen": now},
+        }
+        if existing is None or existing.get("explain") is None or random.random() < self.sample_rate:
+            try:
+                summary = explain_summary(explain_command(db, command_name, command))
+                update["$set"].update({"explain": summary, "explained_at": now})
+            except Exception as e:
+                update["$set"]["explain_error"] = str(e)
+        col.update_one({"_id": key}, update, upsert=True)
+
+
+slow_query_log = SlowQueryLog()
@@ -0,0 +1,125 @@
+"""
+Expiry sweeper: deactivates expired or over-quota subscriptions in batches,
+disables their clients on the panel, and queues reminders before expiry
+"""
+
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import List
+
+from outbox import enqueue, notification
+from panel_api import PanelClient, client_email
+
+EXPIRY_SWEEP_INTERVAL_SECONDS = int(os.environ.get("EXPIRY_SWEEP_INTERVAL_SECONDS", "600"))
+EXPIRY_SWEEP_BATCH_SIZE = int(os.environ.get("EXPIRY_SWEEP_BATCH_SIZE", "500"))
+DEFAULT_REMINDER_DAYS = 3
+
+SWEEP_PROJECTION = {"_id": 1, "id": 1, "server_id": 1, "panel_email": 1, "expires_at": 1}
+
+
+async def disable_on_panel(server: dict, subs: List[dict]) -> List:
+    """Disable the clients of subs on one panel; returns the _ids that are safe to deactivate"""
+    try:
+        async with PanelClient(server) as panel:
+            inbounds = await panel.list_inbounds()
+            done = []
+            for sub in subs:
+                email = client_email(sub)
+                inbound = next((i for i in inbounds if any(
+                    s.get("email") == email for s in i.get("clientStats") or []
+                )), None)
+                if inbound is not None:
+                    await panel.set_client_enabled(inbound, email, False)
+                done.append(sub["_id"])
+            return done
+    except Exception as e:
+        print(f"Expiry sweep: {server['name']} failed: {e}")
+        return []
+
+
+async def deactivate_batch(db, subs: List[dict], reason: str, now: datetime) -> int:
+    server_ids = {sub["server_id"] for sub in subs}
+    servers = {s["id"]: s for s in db["servers"].find({"id": {"$in": list(server_ids)}, "is_active": True}, {"_id": 0})}
+
+    by_server = {}
+    ready = []
+    for sub in subs:
+        if sub["server_id"] in servers:
+            by_server.setdefault(sub["server_id"], []).append(sub)
+        else:
+            ready.append(sub["_id"])
+
+    results = await asyncio.gather(*(disable_on_panel(servers[sid], group) for sid, group in by_server.items()))
+    for done in results:
+        ready += done
+
+    if not ready:
+        return 0
+    return db["subscriptions"].update_many(
+        {"_id": {"$in": ready}, "is_active": True},
+        {"$set": {"is_active": False, "deactivated_at": now, "deactivation_reason": reason}}
+    ).modified_count
+
+
+async def sweep(db, query: dict, reason: str, now: datetime) -> int:
+    cursor = db["subscriptions"].find(query, SWEEP_PROJECTION, batch_size=EXPIRY_SWEEP_BATCH_SIZE)
+    deactivated = 0
+    batch = []
+    for sub in cursor:
+        batch.append(sub)
+        if len(batch) >= EXPIRY_SWEEP_BATCH_SIZE:
+            deactivated += await deactivate_batch(db, batch, reason, now)
+            batch = []
+    if batch:
+        deactivated += await deactivate_batch(db, batch, reason, now)
+    return deactivated
+
+
+async def send_reminders(db, now: datetime) -> int:
+    """Queue reminders in the notification outbox; the dispatcher sends them"""
+    settings = db["bot_settings"].find_one({"id": "bot_settings"}) or {}
+    days = settings.get("expiry_reminder_days", DEFAULT_REMINDER_DAYS)
+    if not days:
+        return 0
+
+    subscriptions_col = db["subscriptions"]
+    query = {
+        "is_active": True,
+        "expires_at": {"$gt": now, "$lte": now + timedelta(days=days)},
+        "reminded_at": None
+    }
+    subs = list(subscriptions_col.find(query, {"_id": 1, "telegram_user_id": 1, "plan_id": 1, "expires_at": 1}))
+    if not subs:
+        return 0
+
+    plans = {p["id"]: p["name"] for p in db["plans"].find({"id": {"$in": list({s["plan_id"] for s in subs})}}, {"id": 1, "name": 1})}
+    notifications = [
+        notification(
+            sub["telegram_user_id"],
+            f"⏰ اشتراک «{plans.get(sub['plan_id'], 'نامشخص')}» شما "
+            f"{max(0, (sub['expires_at'] - now).days)} روز دیگر منقضی می‌شود.\n"
+            "برای تمدید از منوی «🛒 خرید اشتراک» اقدام کنید.",
+            "expiry_reminder",
+            # Keyed by subscription, so a sweep that dies before marking reminded_at does not queue it twice
+            key=f"reminder:{sub['_id']}",
+            now=now
+        )
+        for sub in subs
+    ]
+    enqueue(db, notifications)
+    subscriptions_col.update_many({"_id": {"$in": [sub["_id"] for sub in subs]}}, {"$set": {"reminded_at": now}})
+    return len(subs)
+
+
+async def sweep_subscriptions(db):
+    """Scheduled entry point"""
+    now = datetime.utcnow()
+    expired = await sweep(db, {"is_active": True, "expires_at": {"$lte": now}}, "expired", now)
+    over_quota = await sweep(db, {
+        "is_active": True,
+        "traffic_limit": {"$gt": 0},
+        "$expr": {"$gte": ["$traffic_used", "$traffic_limit"]}
+    }, "traffic", now)
+    reminded = await send_reminders(db, now)
+    return {"expired": expired, "over_quota": over_quota, "reminded": reminded}
@@ -12,25 +12,27 @@ from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
     ConversationHandler, ContextTypes, filters
 )
-from pymongo import MongoClient
+from pymongo import monitoring
+
+from bot_metrics import InstrumentedRequest, instrument_handlers, start_metrics_server
+from etags import bump_version
+from metrics import register_mongo_listeners
+from query_recorder import QueryRecorderListener
+from slow_queries import slow_query_log
+from receipts import store_receipt
+from server_monitor import select_servers
+from ticket_messages import TICKET_MESSAGES_COLLECTION, new_message, preview
+from database import (
+    configure, get_client, warmup, db,
+    users_col, plans_col, orders_col, payments_col, tickets_col, departments_col,
+    settings_col, subscriptions_col, servers_col, discounts_col, resellers_col, versions_col
+)
 
 # MongoDB Connection
-MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
-DB_NAME = os.environ.get("DB_NAME", "v2ray_bot")
-mongo_client = MongoClient(MONGO_URL)
-db = mongo_client[DB_NAME]
-
-# Collections
-users_col = db["telegram_users"]
-plans_col = db["plans"]
-orders_col = db["orders"]
-payments_col = db["payments"]
-tickets_col = db["tickets"]
-departments_col = db["departments"]
-settings_col = db["bot_settings"]
-subscriptions_col = db["subscriptions"]
-servers_col = db["servers"]
-discounts_col = db["discount_codes"]
+register_mongo_listeners()
+monitoring.register(QueryRecorderListener())
+slow_query_log.register()
+configure(app_name="v2ray-telegram-bot")
 
 # Conversation States
 SELECTING_PLAN, SELECTING_SERVER, ENTERING_DISCOUNT, CONFIRMING_ORDER = range(4)
@@ -174,16 +176,22 @@ async def select_plan(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     context.user_data["selected_plan"] = plan
     
-    # Get available servers for this plan
+    # Get available servers for this plan, healthy and least loaded first
     servers = list(servers_col.find({"is_active": True, "id": {"$in": plan.get("server_ids", [])}}, {"_id": 0}))
     
     if not servers:
         servers = list(servers_col.find({"is_active": True}, {"_id": 0}))
     
+    servers = select_servers(servers)
+    
     if not servers:
         await query.edit_message_text("❌ سرور فعالی موجود نیست.")
         return ConversationHandler.END
     
+    if len(servers) == 1:
+        context.user_data["selected_server"] = servers[0]
+        return await ask_discount(query, back_data="back_to_plans")
+    
     keyboard = []
     for server in servers:
         keyboard.append([InlineKeyboardButton(f"🌐 {server['name']}", callback_data=f"server_{server['id']}")])
@@ -217,11 +225,15 @@ async def select_server(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
     
     context.user_data["selected_server"] = server
-    
+    return await ask_discount(query)
+
+
+async def ask_discount(query, back_data: str = "back_to_servers"):
+    """Ask whether the user has a discount code"""
     keyboard = [
         [InlineKeyboardButton("🎁 وارد کردن کد تخفیف", callback_data="enter_discount")],
         [InlineKeyboardButton("✅ ادامه بدون کد تخفیف", callback_data="no_discount")],
-        [InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_servers")]
+        [InlineKeyboardButton("🔙 بازگشت", callback_data=back_data)]
     ]
     
     await query.edit_message_text(
@@ -236,6 +248,9 @@ async def handle_discount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
+    if query.data == "back_to_plans":
+        return await buy_subscription_callback(update, context)
+    
     if query.data == "back_to_servers":
         return await select_plan(update, context)
     
@@ -456,6 +471,7 @@ async def confirm_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
             subscriptions_col.insert_one(subscription)
             
             plans_col.update_one({"id": plan["id"]}, {"$inc": {"sales_count": 1}})
+            bump_version(versions_col, "plans")
             
             await query.edit_message_text(
                 "✅ **پرداخت موفق!**\n\n"
@@ -504,9 +520,17 @@ async def receive_receipt(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ لطفاً تصویر رسید پرداخت را ارسال کنید.")
         return UPLOADING_RECEIPT
     
-    file = await photo.get_file()
     file_id = photo.file_id
     
+    # The order may have been expired by the payment timeout reaper
+    result = orders_col.update_one({"id": order_id, "status": "pending"}, {"$set": {"status": "paid"}})
+    if result.matched_count == 0:
+        await update.message.reply_text(
+            "⏰ مهلت پرداخت این سفارش به پایان رسیده است.\n"
+            "لطفاً دوباره از منوی «🛒 خرید اشتراک» سفارش ثبت کنید."
+        )
+        return ConversationHandler.END
+    
     import uuid
     payment = {
         "id": str(uuid.uuid4()),
@@ -518,7 +542,7 @@ async def receive_receipt(update: Update, context: ContextTypes.DEFAULT_TYPE):
     }
     payments_col.insert_one(payment)
     
-    orders_col.update_one({"id": order_id}, {"$set": {"status": "paid"}})
+    context.application.create_task(cache_receipt(context.bot, payment["id"], file_id))
     
     await update.message.reply_text(
         "✅ **رسید دریافت شد!**\n\n"
@@ -530,6 +554,16 @@ async def receive_receipt(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
+async def cache_receipt(bot, payment_id: str, file_id: str):
+    """Download a receipt in the background for the admin panel"""
+    try:
+        file = await bot.get_file(file_id)
+        data = await file.download_as_bytearray()
+        await asyncio.to_thread(store_receipt, payments_col, payment_id, bytes(data))
+    except Exception as e:
+        print(f"Receipt download failed for {payment_id}: {e}")
+
+
 # ==================== USER ACCOUNT ====================
 
 async def user_account(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -732,6 +766,7 @@ async def enter_ticket_message(update: Update, context: ContextTypes.DEFAULT_TYP
     
     import uuid
     ticket_id = str(uuid.uuid4())
+    first_message = new_message(ticket_id, message, False)
     
     ticket = {
         "id": ticket_id,
@@ -740,16 +775,14 @@ async def enter_ticket_message(update: Update, context: ContextTypes.DEFAULT_TYP
         "subject": subject,
         "status": "open",
         "priority": "medium",
-        "messages": [{
-            "id": str(uuid.uuid4()),
-            "message": message,
-            "is_admin": False,
-            "created_at": datetime.utcnow()
-        }],
+        "message_count": 1,
+        "last_message": preview(first_message),
         "last_reply_by": "user",
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow()
     }
+    # Message first, so the ticket never shows up without it
+    db[TICKET_MESSAGES_COLLECTION].insert_one(first_message)
     tickets_col.insert_one(ticket)
     
     await update.message.reply_text(
@@ -770,7 +803,7 @@ async def show_my_tickets(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     tickets = list(tickets_col.find(
         {"telegram_user_id": user["telegram_id"]},
-        {"_id": 0}
+        {"_id": 0, "id": 1, "subject": 1, "status": 1}
     ).sort("updated_at", -1).limit(10))
     
     if not tickets:
@@ -821,8 +854,6 @@ async def reseller_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ شما نماینده نیستید.")
         return
     
-    from pymongo import MongoClient
-    resellers_col = db["resellers"]
     reseller = resellers_col.find_one({"telegram_user_id": user["telegram_id"]})
     
     if not reseller:
@@ -920,16 +951,15 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await reseller_panel(update, context)
 
 
-def main():
-    """Run the bot"""
-    settings = get_settings()
-    token = settings.get("bot_token")
-    
-    if not token:
-        print("❌ Bot token not set! Please set it in the admin panel.")
-        return
-    
-    application = Application.builder().token(token).build()
+def build_application(token: str, request=None, get_updates_request=None) -> Application:
+    """Build the Application with all handlers (request overrides are used by the benchmarks)"""
+    application = (
+        Application.builder()
+        .token(token)
+        .request(request or InstrumentedRequest())
+        .get_updates_request(get_updates_request or InstrumentedRequest())
+        .build()
+    )
     
     # Buy conversation handler
     buy_handler = ConversationHandler(
@@ -970,6 +1000,26 @@ def main():
     application.add_handler(CallbackQueryHandler(show_subscription_detail, pattern="^sub_"))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     
+    for handlers in application.handlers.values():
+        instrument_handlers(handlers)
+    
+    return application
+
+
+def main():
+    """Run the bot"""
+    settings = get_settings()
+    token = settings.get("bot_token")
+    
+    if not token:
+        print("❌ Bot token not set! Please set it in the admin panel.")
+        return
+    
+    application = build_application(token)
+    warmup()
+    slow_query_log.start(get_client())
+    start_metrics_server()
+    
     print("🤖 Bot started!")
     application.run_polling(allowed_updates=Update.ALL_TYPES)
 
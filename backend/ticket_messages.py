@@ -0,0 +1,197 @@
+"""
+Ticket messages live in their own collection, indexed by (ticket_id, created_at)
+and read a page at a time; the ticket keeps message_count and a last_message
+preview for the list views
+
+Tickets from before the split embed a messages array. They are moved over by
+migrate_ticket_messages (a one-off job at API startup, or run this file by
+hand), and any ticket still embedding them when it is opened or answered is
+moved on the spot.
+
+    python ticket_messages.py [--batch-size 200]
+"""
+
+import os
+import uuid
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+TICKET_MESSAGES_COLLECTION = "ticket_messages"
+PREVIEW_LENGTH = 100
+MESSAGES_PAGE_SIZE = int(os.environ.get("TICKET_MESSAGES_PAGE_SIZE", "50"))
+MIGRATION_BATCH_SIZE = 200
+# The startup migration job is retried this often until no ticket embeds messages
+MIGRATION_RETRY_SECONDS = 60
+
+DUPLICATE_KEY = 11000
+
+
+def new_message(ticket_id: str, text: str, is_admin: bool, admin_id: str = None, admin_username: str = None,
+                now: datetime = None) -> dict:
+    message = {
+        "id": str(uuid.uuid4()),
+        "ticket_id": ticket_id,
+        "message": text,
+        "is_admin": is_admin,
+        "created_at": now or datetime.utcnow()
+    }
+    if is_admin:
+        message.update(admin_id=admin_id, admin_username=admin_username)
+    return message
+
+
+def preview(message: dict) -> dict:
+    """last_message stored on the ticket"""
+    return {
+        "id": message["id"],
+        "message": (message.get("message") or "")[:PREVIEW_LENGTH],
+        "is_admin": message.get("is_admin", False),
+        "created_at": message["created_at"]
+    }
+
+
+def init_ticket_message_indexes(db):
+    col = db[TICKET_MESSAGES_COLLECTION]
+    # id breaks created_at ties, so pages can use (created_at, id) as the cursor
+    if "ticket_id_1_created_at_1" in col.index_information():
+        col.drop_index("ticket_id_1_created_at_1")
+    col.create_index([("ticket_id", 1), ("created_at", 1), ("id", 1)])
+    # Makes re-running the migration a no-op for messages already moved
+    col.create_index("id", unique=True)
+
+
+def add_message(db, message: dict, ticket_update: dict, session=None, projection: dict = None) -> Optional[dict]:
+    """Insert a message and update its ticket; returns the ticket as it was before, or None if it does not exist"""
+    ticket = db["tickets"].find_one_and_update(
+        {"id": message["ticket_id"]},
+        {
+            "$set": {**ticket_update, "last_message": preview(message)},
+            "$inc": {"message_count": 1}
+        },
+        projection={"_id": 0, "message_count": 1, **(projection or {})},
+        session=session
+    )
+    if ticket is not None:
+        db[TICKET_MESSAGES_COLLECTION].insert_one(message, session=session)
+    return ticket
+
+
+def get_messages(db, ticket_id: str, before: datetime = None, before_id: str = None,
+                 limit: int = MESSAGES_PAGE_SIZE) -> Tuple[List[dict], bool]:
+    """The newest limit messages before the (before, before_id) cursor, oldest first, and whether there are older ones"""
+    query = {"ticket_id": ticket_id}
+    if before and before_id:
+        # Messages often share a timestamp (migrated and seeded ones especially)
+        query["$or"] = [{"created_at": {"$lt": before}}, {"created_at": before, "id": {"$lt": before_id}}]
+    elif before:
+        query["created_at"] = {"$lt": before}
+    messages = list(db[TICKET_MESSAGES_COLLECTION].find(
+        query, {"_id": 0, "ticket_id": 0}
+    ).sort([("created_at", -1), ("id", -1)]).limit(limit + 1))
+    has_more = len(messages) > limit
+    return messages[:limit][::-1], has_more
+
+
+def insert_ignoring_duplicates(col, docs: List[dict]):
+    try:
+        col.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        if any(error.get("code") != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+            raise
+
+
+def embedded_messages(ticket: dict) -> List[dict]:
+    """A ticket's embedded messages as ticket_messages documents
+
+    Messages saved without an id get one derived from their position, so a
+    re-run produces the same id and the unique index still deduplicates them.
+    """
+    messages = []
+    missing = 0
+    for index, message in enumerate(ticket.get("messages") or []):
+        if not message.get("id"):
+            missing += 1
+            message = {**message, "id": str(uuid.uuid5(uuid.NAMESPACE_URL, f"{ticket['id']}:{index}"))}
+        messages.append({**message, "ticket_id": ticket["id"]})
+    if missing:
+        print(f"Ticket {ticket['id']}: {missing} embedded messages had no id, gave them one")
+    return messages
+
+
+def message_stats(db, ticket_ids: List[str]) -> dict:
+    """ticket id -> (message count, newest message), counted in ticket_messages"""
+    rows = db[TICKET_MESSAGES_COLLECTION].aggregate([
+        {"$match": {"ticket_id": {"$in": ticket_ids}}},
+        {"$sort": {"ticket_id": 1, "created_at": -1, "id": -1}},
+        {"$group": {"_id": "$ticket_id", "count": {"$sum": 1}, "latest": {"$first": "$$ROOT"}}},
+    ])
+    return {row["_id"]: (row["count"], row["latest"]) for row in rows}
+
+
+def migrated_update(ticket: dict, stats: dict) -> Tuple[dict, dict]:
+    """Filter and update for a ticket whose messages were moved
+
+    Counted from the collection, so replies saved there since the split are
+    included. The update only applies if message_count is still what was read
+    with the ticket: a reply that landed meanwhile leaves the ticket for the
+    next pass instead of being counted out.
+    """
+    count, latest = stats.get(ticket["id"], (0, None))
+    return {"id": ticket["id"], "messages": {"$exists": True}, "message_count": ticket.get("message_count")}, {
+        "$set": {"message_count": count, "last_message": preview(latest) if latest else None},
+        "$unset": {"messages": ""}
+    }
+
+
+def migrate_ticket(db, ticket_id: str):
+    """Move one ticket's embedded messages and recount it (replies may already be in the collection)"""
+    ticket = db["tickets"].find_one({"id": ticket_id}, {"_id": 0, "id": 1, "messages": 1, "message_count": 1})
+    if ticket is None or "messages" not in ticket:
+        return
+    embedded = embedded_messages(ticket)
+    if embedded:
+        insert_ignoring_duplicates(db[TICKET_MESSAGES_COLLECTION], embedded)
+    # A miss (answered meanwhile) is left to the migration job
+    db["tickets"].update_one(*migrated_update(ticket, message_stats(db, [ticket_id])))
+
+
+def migrate_ticket_messages(db, batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    """Move embedded messages of every ticket, batch by batch; safe to interrupt and re-run"""
+    tickets_col = db["tickets"]
+    migrated = 0
+    while True:
+        tickets = list(tickets_col.find(
+            {"messages": {"$exists": True}}, {"_id": 0, "id": 1, "messages": 1, "message_count": 1}
+        ).limit(batch_size))
+        if not tickets:
+            break
+        messages = [m for t in tickets for m in embedded_messages(t)]
+        if messages:
+            insert_ignoring_duplicates(db[TICKET_MESSAGES_COLLECTION], messages)
+        stats = message_stats(db, [t["id"] for t in tickets])
+        # Tickets that missed (answered meanwhile) are picked up by the next find
+        migrated += tickets_col.bulk_write([UpdateOne(*migrated_update(t, stats)) for t in tickets], ordered=False).matched_count
+    if migrated:
+        print(f"Moved the messages of {migrated} tickets to {TICKET_MESSAGES_COLLECTION}")
+    return migrated
+
+
+if __name__ == "__main__":
+    import argparse
+    from pathlib import Path
+
+    from dotenv import load_dotenv
+
+    load_dotenv(Path(__file__).parent / ".env")
+    from database import get_database
+
+    parser = argparse.ArgumentParser(description="Move embedded ticket messages to the ticket_messages collection")
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    args = parser.parse_args()
+
+    database = get_database()
+    init_ticket_message_indexes(database)
+    print(f"{migrate_ticket_messages(database, args.batch_size)} tickets migrated")
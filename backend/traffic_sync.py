@@ -0,0 +1,64 @@
+"""
+Periodic traffic-usage sync: one inbound list call per panel, applied to
+subscriptions with unordered bulk writes that only touch changed documents
+"""
+
+import asyncio
+import os
+
+from pymongo import UpdateOne
+
+from panel_api import PanelClient, client_email, client_traffic
+
+TRAFFIC_SYNC_INTERVAL_SECONDS = int(os.environ.get("TRAFFIC_SYNC_INTERVAL_SECONDS", "300"))
+TRAFFIC_SYNC_CONCURRENCY = int(os.environ.get("TRAFFIC_SYNC_CONCURRENCY", "20"))
+TRAFFIC_SYNC_BATCH_SIZE = int(os.environ.get("TRAFFIC_SYNC_BATCH_SIZE", "1000"))
+
+BYTES_PER_GB = 1024 ** 3
+
+
+async def fetch_usage(server: dict):
+    """Per-client traffic in GB for one panel, or None if the panel is unreachable"""
+    try:
+        async with PanelClient(server) as panel:
+            inbounds = await panel.list_inbounds()
+    except Exception as e:
+        print(f"Traffic sync: {server['name']} failed: {e}")
+        return None
+    return {email: round(used / BYTES_PER_GB, 3) for email, used in client_traffic(inbounds).items()}
+
+
+async def sync_traffic(db):
+    """Pull usage from every active panel and write back the changed values"""
+    servers = list(db["servers"].find({"is_active": True}, {"_id": 0}))
+    semaphore = asyncio.Semaphore(TRAFFIC_SYNC_CONCURRENCY)
+
+    async def bounded(server):
+        async with semaphore:
+            return await fetch_usage(server)
+
+    results = await asyncio.gather(*(bounded(server) for server in servers))
+    usage = {server["id"]: result for server, result in zip(servers, results) if result is not None}
+    if not usage:
+        return 0
+
+    subscriptions_col = db["subscriptions"]
+    cursor = subscriptions_col.find(
+        {"is_active": True, "server_id": {"$in": list(usage)}},
+        {"_id": 1, "id": 1, "server_id": 1, "panel_email": 1, "traffic_used": 1},
+        batch_size=TRAFFIC_SYNC_BATCH_SIZE
+    )
+
+    updated = 0
+    batch = []
+    for sub in cursor:
+        used = usage[sub["server_id"]].get(client_email(sub))
+        if used is None or used == sub.get("traffic_used"):
+            continue
+        batch.append(UpdateOne({"_id": sub["_id"]}, {"$set": {"traffic_used": used}}))
+        if len(batch) >= TRAFFIC_SYNC_BATCH_SIZE:
+            updated += subscriptions_col.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        updated += subscriptions_col.bulk_write(batch, ordered=False).modified_count
+    return updated
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Load benchmark for the admin API against a local MongoDB
+
+Starts mongod (if --mongo-url is not given and mongod is on PATH), seeds data,
+starts the FastAPI app with uvicorn, drives concurrent load against the hot
+endpoints, and writes p50/p95/p99 latency and throughput to a JSON file:
+
+    python benchmarks/api_benchmark.py --users 10000 --concurrency 20 --output bench.json
+    python benchmarks/compare.py before.json after.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import httpx
+from pymongo import MongoClient
+
+from seed import seed
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+
+ENDPOINTS = {
+    "orders": ("GET", "/api/orders", None),
+    "orders_pending": ("GET", "/api/orders?status=pending", None),
+    "payments": ("GET", "/api/payments", None),
+    "payments_pending": ("GET", "/api/payments?status=pending", None),
+    "dashboard_stats": ("GET", "/api/dashboard/stats", None),
+    "dashboard_chart": ("GET", "/api/dashboard/chart?days=30", None),
+    "users": ("GET", "/api/users", None),
+    "users_search": ("GET", "/api/users?search=ali", None),
+    "subscriptions": ("GET", "/api/subscriptions", None),
+    "tickets": ("GET", "/api/tickets", None),
+    "discount_codes": ("GET", "/api/discount-codes", None),
+    "login": ("POST", "/api/auth/login", {"username": "admin", "password": "admin"}),
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+@contextmanager
+def local_mongod(mongod: str):
+    """Run a throwaway mongod and yield its URL"""
+    port = free_port()
+    dbpath = tempfile.mkdtemp(prefix="bench-mongo-")
+    process = subprocess.Popen(
+        [mongod, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+        stdout=subprocess.DEVNULL
+    )
+    url = f"mongodb://127.0.0.1:{port}"
+    try:
+        MongoClient(url, serverSelectionTimeoutMS=30000).admin.command("ping")
+        yield url
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(dbpath, ignore_errors=True)
+
+
+@contextmanager
+def existing_mongo(url: str):
+    yield url
+
+
+@contextmanager
+def api_server(mongo_url: str, db_name: str, extra_env: dict = None):
+    """Run the API with uvicorn and yield its base URL"""
+    port = free_port()
+    # No background jobs: health probes, the order reaper and the outbox would change the data mid-run
+    env = {**os.environ, "MONGO_URL": mongo_url, "DB_NAME": db_name, "SCHEDULER_ENABLED": "0", **(extra_env or {})}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_for(f"{base_url}/api/health")
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+async def run_endpoint(client: httpx.AsyncClient, method: str, path: str, body, requests: int, concurrency: int):
+    latencies = []
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append((time.perf_counter() - started) * 1000)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "mean_ms": round(statistics.mean(latencies), 2),
+    }
+
+
+async def run_benchmark(base_url: str, endpoints: dict, requests: int, concurrency: int, warmup: int):
+    """endpoints maps a name to (method, path, json body)"""
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        response = await client.post("/api/auth/login", json={"username": "admin", "password": "admin"})
+        response.raise_for_status()
+        client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+        results = {}
+        for name, (method, path, body) in endpoints.items():
+            if warmup:
+                await run_endpoint(client, method, path, body, warmup, min(concurrency, warmup))
+            results[name] = await run_endpoint(client, method, path, body, requests, concurrency)
+            print(f"{name:18} p50={results[name]['p50_ms']:8.2f}ms p95={results[name]['p95_ms']:8.2f}ms "
+                  f"p99={results[name]['p99_ms']:8.2f}ms {results[name]['throughput_rps']:8.1f} req/s")
+        return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", help="use an existing MongoDB instead of starting mongod")
+    parser.add_argument("--mongod", default=shutil.which("mongod"), help="mongod binary to start")
+    parser.add_argument("--db-name", default="v2ray_bench")
+    parser.add_argument("--users", type=int, default=10000, help="seed scale (telegram users)")
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma separated subset")
+    parser.add_argument("--no-seed", action="store_true", help="reuse data already in --db-name")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    if not args.mongo_url and not args.mongod:
+        parser.error("mongod not found on PATH; pass --mongod or --mongo-url")
+
+    with (existing_mongo(args.mongo_url) if args.mongo_url else local_mongod(args.mongod)) as mongo_url:
+        client = MongoClient(mongo_url)
+        counts = None
+        if not args.no_seed:
+            client.drop_database(args.db_name)
+            started = time.perf_counter()
+            counts = seed(client[args.db_name], users=args.users)
+            print(f"Seeded {counts} in {time.perf_counter() - started:.1f}s")
+
+        with api_server(mongo_url, args.db_name) as base_url:
+            results = asyncio.run(run_benchmark(
+                base_url, {name: ENDPOINTS[name] for name in args.endpoints.split(",")},
+                args.requests, args.concurrency, args.warmup
+            ))
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "users": args.users,
+        "documents": counts,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
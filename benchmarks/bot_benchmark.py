@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for the Telegram bot handlers without a live token
+
+Builds the Application from telegram_bot.build_application() with a stubbed
+Bot API request layer, then feeds synthetic Update streams for many concurrent
+users walking the buy flow (buy_subscription -> select_plan -> select_server
+-> handle_discount -> confirm_order), the support flow and the account menus
+of seeded users. Reports updates/sec, per-handler latency and DB calls per
+update:
+
+    python benchmarks/bot_benchmark.py --users 2000 --concurrency 200 --output bot_bench.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from pymongo import MongoClient
+
+from api_benchmark import BACKEND_DIR, existing_mongo, git_commit, local_mongod, percentile
+from seed import seed
+
+BOT_TOKEN = "123456:BENCHMARK"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+FIRST_USER_ID = 900000000
+SEEDED_FIRST_USER_ID = 100000000
+
+
+def make_fake_request_class():
+    from telegram.request import BaseRequest
+
+    class FakeBotRequest(BaseRequest):
+        """Answers Bot API calls locally with minimal valid payloads"""
+
+        def __init__(self, latency: float = 0.0):
+            self.latency = latency
+            self.calls = Counter()
+            self._message_ids = itertools.count(1)
+
+        @property
+        def read_timeout(self):
+            return None
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, *args, **kwargs):
+            api_method = url.rsplit("/", 1)[-1]
+            self.calls[api_method] += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            params = request_data.parameters if request_data else {}
+            return 200, json.dumps({"ok": True, "result": self.result(api_method, params)}).encode()
+
+        def result(self, api_method: str, params: dict):
+            if api_method == "getMe":
+                return {**BOT_USER, "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+            if api_method in ("sendMessage", "editMessageText", "sendPhoto"):
+                return {
+                    "message_id": params.get("message_id") or next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                    "from": BOT_USER,
+                    "text": params.get("text", ""),
+                }
+            return True
+
+    return FakeBotRequest
+
+
+class UpdateFactory:
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": "User", "username": f"user{user_id}"}
+
+    def message(self, user_id: int, text: str) -> dict:
+        message = {
+            "message_id": next(self._message_ids), "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"}, "from": self._user(user_id), "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def callback(self, user_id: int, data: str) -> dict:
+        return {"update_id": next(self._update_ids), "callback_query": {
+            "id": str(next(self._update_ids)), "from": self._user(user_id), "chat_instance": str(user_id), "data": data,
+            "message": {
+                "message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"}, "from": BOT_USER, "text": "-",
+            },
+        }}
+
+
+class Stats:
+    def __init__(self):
+        self.handler_ms = defaultdict(list)
+        self.update_ms = []
+        self.db_calls = []
+
+    def observe_handler(self, name: str, seconds: float, outcome: str):
+        """bot_metrics handler observer; build_application already wraps every handler"""
+        self.handler_ms[name].append(seconds * 1000)
+
+
+async def run(args, mongo_url: str):
+    os.environ["MONGO_URL"] = mongo_url
+    os.environ["DB_NAME"] = args.db_name
+    sys.path.insert(0, BACKEND_DIR)
+    import telegram_bot
+    from bot_metrics import handler_observers
+    from query_recorder import record_queries
+    from telegram import Update
+
+    db = MongoClient(mongo_url)[args.db_name]
+    plan_ids = [p["id"] for p in db["plans"].find({"is_active": True, "is_test": False}, {"id": 1})]
+    dept_ids = [d["id"] for d in db["departments"].find({"is_active": True}, {"id": 1})]
+
+    request = make_fake_request_class()(latency=args.api_latency_ms / 1000)
+    application = telegram_bot.build_application(BOT_TOKEN, request=request, get_updates_request=request)
+    stats = Stats()
+    handler_observers.append(stats.observe_handler)
+    await application.initialize()
+
+    factory = UpdateFactory()
+
+    async def feed(data: dict):
+        update = Update.de_json(data, application.bot)
+        started = time.perf_counter()
+        with record_queries() as recorder:
+            await application.process_update(update)
+        stats.update_ms.append((time.perf_counter() - started) * 1000)
+        stats.db_calls.append(recorder.count)
+
+    async def buy_flow(user_id: int):
+        await feed(factory.message(user_id, "🛒 خرید اشتراک"))
+        await feed(factory.callback(user_id, f"plan_{plan_ids[user_id % len(plan_ids)]}"))
+        user_data = application.user_data[user_id]
+        if "selected_server" not in user_data:
+            server = db["servers"].find_one({"is_active": True}, {"id": 1})
+            await feed(factory.callback(user_id, f"server_{server['id']}"))
+        await feed(factory.callback(user_id, "no_discount"))
+        await feed(factory.callback(user_id, "pay_card"))
+
+    async def support_flow(user_id: int):
+        await feed(factory.message(user_id, "🎫 پشتیبانی"))
+        await feed(factory.callback(user_id, f"dept_{dept_ids[user_id % len(dept_ids)]}"))
+        await feed(factory.message(user_id, "مشکل اتصال"))
+        await feed(factory.message(user_id, "سلام، اتصال من قطع شده است."))
+
+    async def account_flow(user_id: int):
+        # Seeded users, so the menus have orders and subscriptions to show
+        user_id = SEEDED_FIRST_USER_ID + user_id - FIRST_USER_ID
+        await feed(factory.message(user_id, "/start"))
+        await feed(factory.message(user_id, "👤 حساب کاربری"))
+        await feed(factory.message(user_id, "💰 کیف پول"))
+        await feed(factory.message(user_id, "📋 اشتراک‌های من"))
+        subscription = db["subscriptions"].find_one({"telegram_user_id": user_id}, {"id": 1})
+        if subscription:
+            await feed(factory.callback(user_id, f"sub_{subscription['id']}"))
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def user_session(user_id: int):
+        async with semaphore:
+            bucket = user_id % 100
+            if bucket < args.support_percent:
+                await support_flow(user_id)
+            elif bucket < args.support_percent + args.account_percent:
+                await account_flow(user_id)
+            else:
+                await buy_flow(user_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user_session(FIRST_USER_ID + i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+    await application.shutdown()
+
+    return {
+        "updates": len(stats.update_ms),
+        "elapsed_s": round(elapsed, 2),
+        "updates_per_second": round(len(stats.update_ms) / elapsed, 1),
+        "update_p50_ms": round(percentile(stats.update_ms, 50), 2),
+        "update_p95_ms": round(percentile(stats.update_ms, 95), 2),
+        "update_p99_ms": round(percentile(stats.update_ms, 99), 2),
+        "db_calls_per_update": round(sum(stats.db_calls) / len(stats.db_calls), 2),
+        "db_calls_max": max(stats.db_calls),
+        "handlers": {
+            name: {
+                "calls": len(values),
+                "p50_ms": round(percentile(values, 50), 2),
+                "p95_ms": round(percentile(values, 95), 2),
+                "p99_ms": round(percentile(values, 99), 2),
+            } for name, values in sorted(stats.handler_ms.items())
+        },
+        "telegram_api_calls": dict(request.calls),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", help="use an existing MongoDB instead of starting mongod")
+    parser.add_argument("--mongod", default=shutil.which("mongod"), help="mongod binary to start")
+    parser.add_argument("--db-name", default="v2ray_bot_bench")
+    parser.add_argument("--seed-users", type=int, default=10000, help="existing users/orders to seed")
+    parser.add_argument("--users", type=int, default=1000, help="synthetic users walking the flows")
+    parser.add_argument("--concurrency", type=int, default=100, help="users in flight at once")
+    parser.add_argument("--support-percent", type=int, default=20, help="share of users in the support flow")
+    parser.add_argument("--account-percent", type=int, default=20, help="share of users browsing account menus")
+    parser.add_argument("--api-latency-ms", type=float, default=0, help="simulated Bot API latency")
+    parser.add_argument("--output", default="bench_results_bot.json")
+    args = parser.parse_args()
+
+    if not args.mongo_url and not args.mongod:
+        parser.error("mongod not found on PATH; pass --mongod or --mongo-url")
+
+    with (existing_mongo(args.mongo_url) if args.mongo_url else local_mongod(args.mongod)) as mongo_url:
+        client = MongoClient(mongo_url)
+        client.drop_database(args.db_name)
+        seed(client[args.db_name], users=args.seed_users)
+        results = asyncio.run(run(args, mongo_url))
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "api_latency_ms": args.api_latency_ms,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps({k: v for k, v in results.items() if k != "handlers"}, indent=2))
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
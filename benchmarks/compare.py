@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Compare two benchmark JSON reports
+
+    python benchmarks/compare.py before.json after.json
+"""
+
+import json
+import sys
+
+METRICS = ["p50_ms", "p95_ms", "p99_ms", "throughput_rps"]
+
+
+def main(before_path: str, after_path: str):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    print(f"{before.get('commit')} -> {after.get('commit')}")
+    print(f"{'endpoint':18} " + " ".join(f"{m:>22}" for m in METRICS))
+    for name, new in after["results"].items():
+        old = before["results"].get(name)
+        if old is None:
+            continue
+        cells = []
+        for metric in METRICS:
+            change = (new[metric] - old[metric]) / old[metric] * 100 if old[metric] else 0
+            cells.append(f"{old[metric]:>8} -> {new[metric]:>8} {change:+5.0f}%")
+        print(f"{name:18} " + " ".join(cells))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+    main(sys.argv[1], sys.argv[2])
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Query plan regression check for the API routes and bot handlers
+
+Seeds a database, drives every admin API route (in-process, through the
+real middleware stack) and the bot flows from bot_benchmark, captures each
+distinct query shape per route/handler with a command listener, and runs
+explain(executionStats) on it. Exits non-zero when a query does a COLLSCAN
+or an in-memory SORT over more than --threshold documents, so small catalog
+collections (plans, servers, ...) are not reported.
+
+    python benchmarks/query_plans.py --users 20000
+    python benchmarks/query_plans.py --mongo-url mongodb://localhost:27017 --output plans.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import types
+from datetime import datetime
+
+from pymongo import MongoClient, monitoring
+
+from api_benchmark import BACKEND_DIR, existing_mongo, git_commit, local_mongod
+from seed import seed
+
+sys.path.insert(0, BACKEND_DIR)
+from query_recorder import current_operation, query_shape  # noqa: E402
+from slow_queries import EXPLAINABLE_COMMANDS, SLOW_QUERIES_COLLECTION, explain_command, explain_summary  # noqa: E402
+
+# (operation, substring of the shape, reason): known scans that are accepted
+ALLOWED = [
+    ("GET /api/users", "$regex", "unanchored case-insensitive search cannot use an index"),
+    ("POST /api/broadcast", "find telegram_users", "broadcast reads every user by design"),
+]
+
+# {placeholders} are filled from the seeded data
+ROUTES = [
+    ("GET", "/api/auth/me", None),
+    ("GET", "/api/admins", None),
+    ("GET", "/api/servers", None),
+    ("GET", "/api/servers/health", None),
+    ("GET", "/api/categories", None),
+    ("GET", "/api/plans", None),
+    ("GET", "/api/orders", None),
+    ("GET", "/api/orders?status=pending", None),
+    ("GET", "/api/orders?skip=1000", None),
+    ("GET", "/api/payments", None),
+    ("GET", "/api/payments?status=pending", None),
+    ("GET", "/api/discount-codes", None),
+    ("GET", "/api/departments", None),
+    ("GET", "/api/tickets", None),
+    ("GET", "/api/tickets?status=open", None),
+    ("GET", "/api/tickets?department_id={department_id}", None),
+    ("GET", "/api/tickets/{ticket_id}", None),
+    ("GET", "/api/tickets/{ticket_id}?limit=20", None),
+    ("POST", "/api/tickets/{ticket_id}/reply", {"message": "بررسی شد"}),
+    ("PUT", "/api/tickets/{ticket_id}", {"status": "answered"}),
+    ("GET", "/api/resellers", None),
+    ("GET", "/api/users", None),
+    ("GET", "/api/users?search=ali", None),
+    ("GET", "/api/users?is_banned=true", None),
+    ("PUT", "/api/users/{telegram_id}/ban", None),
+    ("PUT", "/api/users/{telegram_id}/wallet?amount=1000", None),
+    ("GET", "/api/settings", None),
+    ("GET", "/api/subscriptions", None),
+    ("GET", "/api/subscriptions?is_active=true", None),
+    ("GET", "/api/dashboard/stats", None),
+    ("GET", "/api/dashboard/chart?days=30", None),
+    ("PUT", "/api/payments/{payment_id}/review", {"status": "rejected", "admin_note": "plan check"}),
+    ("GET", "/api/export/orders?status=confirmed&date_from=2020-01-01T00:00:00", None),
+    ("GET", "/api/export/payments?format=ndjson", None),
+    ("GET", "/api/export/subscriptions?is_active=true&gzip=true", None),
+]
+
+
+class PlanCaptureListener(monitoring.CommandListener):
+    """Keeps the first command seen for every (operation, query shape)"""
+
+    def __init__(self):
+        self.commands = {}
+
+    def started(self, event):
+        if event.command_name not in EXPLAINABLE_COMMANDS:
+            return
+        if event.command.get(event.command_name) == SLOW_QUERIES_COLLECTION:
+            return
+        operation = current_operation()
+        if operation == "-":
+            return
+        key = (operation, query_shape(event.command_name, event.command))
+        self.commands.setdefault(key, (event.database_name, event.command_name, dict(event.command)))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def sample_ids(db) -> dict:
+    return {
+        "department_id": db["departments"].find_one({})["id"],
+        "ticket_id": db["tickets"].find_one({}, sort=[("updated_at", -1)])["id"],
+        "telegram_id": db["telegram_users"].find_one({})["telegram_id"],
+        "payment_id": db["payments"].find_one({"status": "pending"})["id"],
+    }
+
+
+def drive_routes(server, ids: dict):
+    from fastapi.testclient import TestClient
+
+    # Not a context manager: the lifespan would start the scheduler jobs
+    client = TestClient(server.app)
+    response = client.post("/api/auth/login", json={"username": "admin", "password": "admin"})
+    response.raise_for_status()
+    client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+    for method, path, body in ROUTES:
+        response = client.request(method, path.format(**ids), json=body)
+        if response.status_code >= 400:
+            print(f"warning: {method} {path} returned {response.status_code}")
+
+
+def execution_stats(explain: dict) -> dict:
+    stats = explain.get("executionStats")
+    if stats is None:
+        for stage in explain.get("stages", []):
+            if "$cursor" in stage:
+                stats = stage["$cursor"].get("executionStats")
+                break
+    return stats or {}
+
+
+def allowed_reason(operation: str, shape: str):
+    for allowed_operation, fragment, reason in ALLOWED:
+        if operation == allowed_operation and fragment in shape:
+            return reason
+    return None
+
+
+def check_plans(client, commands: dict, threshold: int):
+    rows = []
+    for (operation, shape), (database_name, command_name, command) in sorted(commands.items()):
+        row = {"operation": operation, "shape": shape}
+        try:
+            explain = explain_command(client[database_name], command_name, command, verbosity="executionStats")
+        except Exception as e:
+            row["error"] = str(e)
+            rows.append(row)
+            continue
+        summary = explain_summary(explain)
+        stats = execution_stats(explain)
+        examined = max(stats.get("totalDocsExamined", 0), stats.get("totalKeysExamined", 0))
+        problems = []
+        if summary["collscan"] and examined > threshold:
+            problems.append("COLLSCAN")
+        if summary["in_memory_sort"] and examined > threshold:
+            problems.append("SORT")
+        row.update(summary, examined=examined, problems=problems)
+        if problems:
+            row["allowed"] = allowed_reason(operation, shape)
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", help="use an existing MongoDB instead of starting mongod")
+    parser.add_argument("--mongod", default=shutil.which("mongod"), help="mongod binary to start")
+    parser.add_argument("--db-name", default="v2ray_query_plans")
+    parser.add_argument("--users", type=int, default=20000, help="seed scale (telegram users)")
+    parser.add_argument("--threshold", type=int, default=1000, help="documents a scan or sort may touch")
+    parser.add_argument("--output", help="write every captured plan to a JSON file")
+    args = parser.parse_args()
+
+    if not args.mongo_url and not args.mongod:
+        parser.error("mongod not found on PATH; pass --mongod or --mongo-url")
+
+    with (existing_mongo(args.mongo_url) if args.mongo_url else local_mongod(args.mongod)) as mongo_url:
+        client = MongoClient(mongo_url)
+        client.drop_database(args.db_name)
+        seed(client[args.db_name], users=args.users)
+
+        os.environ["MONGO_URL"] = mongo_url
+        os.environ["DB_NAME"] = args.db_name
+        listener = PlanCaptureListener()
+        monitoring.register(listener)
+
+        import server
+        server.init_indexes()
+        server.init_super_admin()
+        server.init_bot_settings()
+        drive_routes(server, sample_ids(client[args.db_name]))
+
+        import bot_benchmark
+        bot_args = types.SimpleNamespace(
+            db_name=args.db_name, api_latency_ms=0, users=60, concurrency=5, support_percent=34, account_percent=33
+        )
+        asyncio.run(bot_benchmark.run(bot_args, mongo_url))
+
+        rows = check_plans(MongoClient(mongo_url), listener.commands, args.threshold)
+        client.drop_database(args.db_name)
+
+    failures = [row for row in rows if row.get("problems") and not row.get("allowed")]
+    errors = [row for row in rows if "error" in row]
+    for row in rows:
+        if row.get("problems"):
+            status = "ALLOWED" if row.get("allowed") else "FAIL"
+            print(f"{status:8} {'+'.join(row['problems']):14} {row['examined']:>8} docs  "
+                  f"{row['operation']}: {row['shape']}")
+    for row in errors:
+        print(f"ERROR    {row['operation']}: {row['shape']}: {row['error']}")
+    print(f"{len(rows)} query shapes checked, {len(failures)} failing, {len(errors)} not explainable")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"commit": git_commit(), "timestamp": datetime.utcnow().isoformat(),
+                       "threshold": args.threshold, "plans": rows}, f, indent=2, default=str)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Scaling report: run the list/dashboard endpoints at several data sizes
+
+For each scale the database is dropped and re-seeded, the API is started and
+every endpoint is measured. The report lists latency per scale and the
+log-log slope of p50 against the number of users: ~0 means the endpoint is
+flat, ~1 means it grows linearly with history.
+
+    python benchmarks/scaling_report.py --scales 10k,100k,1m --output scaling.json --plot scaling.png
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import shutil
+import time
+from datetime import datetime
+
+from pymongo import MongoClient
+
+from api_benchmark import ENDPOINTS, api_server, existing_mongo, git_commit, local_mongod, run_benchmark
+from seed import SCALES, seed
+
+try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
+
+READ_ENDPOINTS = [name for name, (method, _, _) in ENDPOINTS.items() if method == "GET"]
+LINEAR_SLOPE = 0.5
+
+
+def longest_ticket_endpoint(db):
+    """Ticket detail for the ticket with the most messages"""
+    ticket = db["tickets"].find_one({}, {"_id": 0, "id": 1}, sort=[("message_count", -1)])
+    if not ticket:
+        return {}
+    return {"ticket_detail": ("GET", f"/api/tickets/{ticket['id']}", None)}
+
+
+def slope(points):
+    """Least-squares slope of log(p50) over log(users)"""
+    points = [(math.log(x), math.log(y)) for x, y in points if x > 0 and y and y > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    denominator = sum((x - mean_x) ** 2 for x, _ in points)
+    if not denominator:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / denominator
+
+
+def summarize(runs):
+    summary = {}
+    names = sorted({name for run in runs for name in run["results"]})
+    for name in names:
+        points = [(run["users"], run["results"][name]["p50_ms"]) for run in runs if name in run["results"]]
+        value = slope(points)
+        summary[name] = {
+            "p50_ms": {run["scale"]: run["results"][name]["p50_ms"] for run in runs if name in run["results"]},
+            "p95_ms": {run["scale"]: run["results"][name]["p95_ms"] for run in runs if name in run["results"]},
+            "slope": round(value, 2) if value is not None else None,
+            "grows_with_history": value is not None and value >= LINEAR_SLOPE,
+        }
+    return summary
+
+
+def plot(runs, path):
+    figure, axis = plt.subplots(figsize=(9, 6))
+    names = sorted({name for run in runs for name in run["results"]})
+    for name in names:
+        points = [(run["users"], run["results"][name]["p50_ms"]) for run in runs if name in run["results"]]
+        axis.plot([x for x, _ in points], [y for _, y in points], marker="o", label=name)
+    axis.set_xscale("log")
+    axis.set_yscale("log")
+    axis.set_xlabel("telegram users")
+    axis.set_ylabel("p50 latency (ms)")
+    axis.legend(fontsize="small")
+    axis.grid(True, which="both", alpha=0.3)
+    figure.tight_layout()
+    figure.savefig(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", help="use an existing MongoDB instead of starting mongod")
+    parser.add_argument("--mongod", default=shutil.which("mongod"), help="mongod binary to start")
+    parser.add_argument("--db-name", default="v2ray_scaling")
+    parser.add_argument("--scales", default="10k,100k", help=f"comma separated, from {', '.join(SCALES)}")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--endpoints", default=",".join(READ_ENDPOINTS), help="comma separated subset")
+    parser.add_argument("--output", default="bench_results_scaling.json")
+    parser.add_argument("--plot", help="write a latency-vs-size PNG (needs matplotlib)")
+    args = parser.parse_args()
+
+    if not args.mongo_url and not args.mongod:
+        parser.error("mongod not found on PATH; pass --mongod or --mongo-url")
+    if args.plot and plt is None:
+        parser.error("--plot needs matplotlib")
+    scales = args.scales.split(",")
+    for scale in scales:
+        if scale not in SCALES:
+            parser.error(f"unknown scale {scale}")
+
+    runs = []
+    with (existing_mongo(args.mongo_url) if args.mongo_url else local_mongod(args.mongod)) as mongo_url:
+        client = MongoClient(mongo_url)
+        for scale in scales:
+            client.drop_database(args.db_name)
+            started = time.perf_counter()
+            counts = seed(client[args.db_name], users=SCALES[scale])
+            seed_seconds = time.perf_counter() - started
+            print(f"[{scale}] seeded {counts} in {seed_seconds:.1f}s")
+
+            endpoints = {name: ENDPOINTS[name] for name in args.endpoints.split(",")}
+            endpoints.update(longest_ticket_endpoint(client[args.db_name]))
+            with api_server(mongo_url, args.db_name) as base_url:
+                results = asyncio.run(run_benchmark(base_url, endpoints, args.requests, args.concurrency, args.warmup))
+            runs.append({
+                "scale": scale, "users": SCALES[scale], "documents": counts,
+                "seed_seconds": round(seed_seconds, 1), "results": results,
+            })
+        client.drop_database(args.db_name)
+
+    summary = summarize(runs)
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "runs": runs,
+        "summary": summary,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{'endpoint':18} " + " ".join(f"{scale:>10}" for scale in scales) + "      slope")
+    for name, row in summary.items():
+        cells = " ".join(f"{row['p50_ms'].get(scale, '-'):>10}" for scale in scales)
+        flag = "  grows with history" if row["grows_with_history"] else ""
+        print(f"{name:18} {cells} {row['slope'] if row['slope'] is not None else '-':>10}{flag}")
+    if args.plot:
+        plot(runs, args.plot)
+        print(f"Wrote {args.plot}")
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Seed a database with data shaped like production for benchmarks
+
+    python benchmarks/seed.py --mongo-url mongodb://localhost:27017 --db-name v2ray_bench --users 10000
+    python benchmarks/seed.py --scale 1m --drop
+"""
+
+import argparse
+import random
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient
+
+FIRST_NAMES = ["Ali", "Reza", "Mohammad", "Sara", "Zahra", "Hossein", "Maryam", "Amir", "Fatemeh", "Mahdi", "Neda", "Omid"]
+ORDER_STATUS_WEIGHTS = {"confirmed": 70, "pending": 5, "paid": 5, "cancelled": 10, "expired": 10}
+TICKET_STATUSES = ["open", "answered", "waiting", "closed"]
+SCALES = {"10k": 10000, "100k": 100000, "1m": 1000000}
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insert(col, docs, batch_size):
+    count = 0
+    for batch in batched(docs, batch_size):
+        col.insert_many(batch, ordered=False)
+        count += len(batch)
+    return count
+
+
+def make_catalog(db, rng):
+    servers = [{
+        "id": str(uuid.uuid4()), "name": f"Server {i + 1}", "panel_url": f"http://127.0.0.1:{9 + i}",
+        "panel_username": "admin", "panel_password": "admin", "is_active": True,
+        "max_users": 5000, "current_users": 0, "created_at": datetime.utcnow()
+    } for i in range(5)]
+    categories = [{
+        "id": str(uuid.uuid4()), "name": name, "is_active": True, "sort_order": i, "created_at": datetime.utcnow()
+    } for i, name in enumerate(["Economy", "Standard", "Premium"])]
+    plans = [{
+        "id": str(uuid.uuid4()), "name": f"{days} days / {gb} GB", "category_id": rng.choice(categories)["id"],
+        "price": days * gb * 10, "duration_days": days, "traffic_gb": gb, "user_limit": 1,
+        "server_ids": [s["id"] for s in servers], "is_active": True, "is_test": False,
+        "sort_order": i, "sales_count": 0, "created_at": datetime.utcnow()
+    } for i, (days, gb) in enumerate([(30, 20), (30, 50), (60, 100), (90, 200), (30, 0)])]
+    db["servers"].insert_many(servers)
+    db["categories"].insert_many(categories)
+    db["plans"].insert_many(plans)
+    return servers, plans
+
+
+def make_users(count, now, rng):
+    for i in range(count):
+        name = rng.choice(FIRST_NAMES)
+        yield {
+            "telegram_id": 100000000 + i,
+            "username": f"{name.lower()}{i}",
+            "first_name": name,
+            "last_name": None,
+            "phone": None,
+            "wallet_balance": rng.choice([0, 0, 0, 50000, 120000]),
+            "is_banned": rng.random() < 0.01,
+            "is_reseller": rng.random() < 0.02,
+            "reseller_discount": 0,
+            "referred_by": None,
+            "referral_earnings": 0,
+            "created_at": now - timedelta(days=rng.random() * 365)
+        }
+
+
+def make_discount_codes(count, plans, now, rng):
+    for i in range(count):
+        percent = rng.random() < 0.7
+        yield {
+            "id": str(uuid.uuid4()), "code": f"OFF{i:07d}",
+            "discount_percent": rng.choice([5, 10, 15, 20, 30]) if percent else None,
+            "discount_amount": None if percent else rng.choice([10000, 20000, 50000]),
+            "max_uses": rng.choice([None, 10, 100, 1000]),
+            "valid_until": now + timedelta(days=rng.randint(-180, 180)),
+            "min_order_amount": None,
+            "plan_ids": [] if rng.random() < 0.8 else [rng.choice(plans)["id"]],
+            "is_active": rng.random() < 0.9, "used_count": 0,
+            "created_at": now - timedelta(days=rng.random() * 365)
+        }
+
+
+def make_orders(users, plans, servers, codes, orders_per_user, now, rng):
+    """Yields (order, payment or None, subscription or None)"""
+    statuses = list(ORDER_STATUS_WEIGHTS)
+    weights = list(ORDER_STATUS_WEIGHTS.values())
+    for telegram_id in range(100000000, 100000000 + users):
+        for _ in range(rng.randint(0, orders_per_user * 2)):
+            plan = rng.choice(plans)
+            created_at = now - timedelta(days=rng.random() * 365)
+            status = rng.choices(statuses, weights)[0]
+            code = rng.choice(codes) if codes and rng.random() < 0.1 else None
+            if code and code["max_uses"] and code["used_count"] >= code["max_uses"]:
+                code = None
+            discount = 0
+            if code:
+                code["used_count"] += 1
+                discount = plan["price"] * code["discount_percent"] / 100 if code["discount_percent"] else min(code["discount_amount"], plan["price"])
+            order = {
+                "id": str(uuid.uuid4()), "telegram_user_id": telegram_id, "plan_id": plan["id"],
+                "server_id": rng.choice(servers)["id"], "discount_code": code["code"] if code else None,
+                "original_price": plan["price"], "discount_amount": discount, "final_price": plan["price"] - discount,
+                "status": status, "created_at": created_at
+            }
+            payment = subscription = None
+            if status == "confirmed":
+                order["confirmed_at"] = created_at + timedelta(minutes=rng.randint(1, 120))
+            if status in ("confirmed", "paid", "cancelled") and rng.random() < 0.8:
+                payment = {
+                    "id": str(uuid.uuid4()), "order_id": order["id"], "amount": order["final_price"],
+                    "receipt_file_id": f"AgAC{uuid.uuid4().hex}",
+                    "status": {"confirmed": "approved", "paid": "pending", "cancelled": "rejected"}[status],
+                    "created_at": created_at + timedelta(minutes=5)
+                }
+            if status == "confirmed":
+                expires_at = order["confirmed_at"] + timedelta(days=plan["duration_days"])
+                subscription = {
+                    "id": str(uuid.uuid4()), "telegram_user_id": telegram_id, "order_id": order["id"],
+                    "plan_id": plan["id"], "server_id": order["server_id"], "config_data": None,
+                    "expires_at": expires_at, "traffic_limit": plan["traffic_gb"] or None,
+                    "traffic_used": round(rng.random() * (plan["traffic_gb"] or 100), 3),
+                    "is_active": expires_at > now, "created_at": order["confirmed_at"]
+                }
+            yield order, payment, subscription
+
+
+def make_tickets(users, departments, tickets_per_user, messages_per_ticket, long_ticket_rate, long_ticket_messages, now, rng):
+    """(ticket, messages) pairs; most tickets get up to messages_per_ticket messages, a long tail up to long_ticket_messages"""
+    for telegram_id in range(100000000, 100000000 + users):
+        if rng.random() >= tickets_per_user:
+            continue
+        created_at = now - timedelta(days=rng.random() * 365)
+        ticket_id = str(uuid.uuid4())
+        messages = []
+        limit = long_ticket_messages if rng.random() < long_ticket_rate else messages_per_ticket
+        for j in range(rng.randint(1, limit)):
+            messages.append({
+                "id": str(uuid.uuid4()), "ticket_id": ticket_id,
+                "message": "سلام، اتصال من قطع شده است. " * rng.randint(1, 5),
+                "is_admin": j % 2 == 1, "created_at": created_at + timedelta(hours=j)
+            })
+        last = messages[-1]
+        ticket = {
+            "id": ticket_id, "telegram_user_id": telegram_id, "department_id": rng.choice(departments)["id"],
+            "subject": "مشکل اتصال", "status": rng.choice(TICKET_STATUSES), "priority": "medium",
+            "message_count": len(messages),
+            "last_message": {"id": last["id"], "message": last["message"][:100], "is_admin": last["is_admin"],
+                             "created_at": last["created_at"]},
+            "last_reply_by": "admin" if len(messages) % 2 == 0 else "user",
+            "created_at": created_at, "updated_at": last["created_at"]
+        }
+        yield ticket, messages
+
+
+def seed(db, users=10000, orders_per_user=2, tickets_per_user=0.2, messages_per_ticket=10,
+         long_ticket_rate=0.02, long_ticket_messages=300, discount_codes=None, batch_size=5000, random_seed=42):
+    """Populate db and return the number of documents per collection"""
+    rng = random.Random(random_seed)
+    now = datetime.utcnow()
+    servers, plans = make_catalog(db, rng)
+
+    departments = list(db["departments"].find({}, {"_id": 0, "id": 1}))
+    if not departments:
+        departments = [{"id": str(uuid.uuid4()), "name": name, "is_active": True, "sort_order": i, "created_at": now}
+                       for i, name in enumerate(["پشتیبانی فنی", "مالی", "فروش"])]
+        db["departments"].insert_many([dict(d) for d in departments])
+
+    counts = {"telegram_users": insert(db["telegram_users"], make_users(users, now, rng), batch_size)}
+
+    # used_count is filled in while generating orders, so codes are inserted afterwards
+    codes = list(make_discount_codes(max(10, users // 100) if discount_codes is None else discount_codes, plans, now, rng))
+
+    orders, payments, subscriptions = [], [], []
+    counts.update({"orders": 0, "payments": 0, "subscriptions": 0})
+    for order, payment, subscription in make_orders(users, plans, servers, codes, orders_per_user, now, rng):
+        orders.append(order)
+        if payment:
+            payments.append(payment)
+        if subscription:
+            subscriptions.append(subscription)
+        if len(orders) >= batch_size:
+            for name, docs in (("orders", orders), ("payments", payments), ("subscriptions", subscriptions)):
+                if docs:
+                    db[name].insert_many(docs, ordered=False)
+                    counts[name] += len(docs)
+            orders, payments, subscriptions = [], [], []
+    for name, docs in (("orders", orders), ("payments", payments), ("subscriptions", subscriptions)):
+        if docs:
+            db[name].insert_many(docs, ordered=False)
+            counts[name] += len(docs)
+
+    counts["discount_codes"] = insert(db["discount_codes"], codes, batch_size)
+
+    tickets, messages = [], []
+    counts.update({"tickets": 0, "ticket_messages": 0})
+    for ticket, ticket_messages in make_tickets(
+        users, departments, tickets_per_user, messages_per_ticket, long_ticket_rate, long_ticket_messages, now, rng
+    ):
+        tickets.append(ticket)
+        messages.extend(ticket_messages)
+        if len(messages) >= batch_size:
+            for name, docs in (("tickets", tickets), ("ticket_messages", messages)):
+                db[name].insert_many(docs, ordered=False)
+                counts[name] += len(docs)
+            tickets, messages = [], []
+    for name, docs in (("tickets", tickets), ("ticket_messages", messages)):
+        if docs:
+            db[name].insert_many(docs, ordered=False)
+            counts[name] += len(docs)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="v2ray_bench")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--scale", choices=SCALES, help="preset user count (overrides --users)")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--drop", action="store_true", help="drop the database first")
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo_url)
+    if args.drop:
+        client.drop_database(args.db_name)
+    print(seed(client[args.db_name], users=SCALES[args.scale] if args.scale else args.users, batch_size=args.batch_size))
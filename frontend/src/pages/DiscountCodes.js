@@ -12,6 +12,8 @@ const formatPrice = (price) => {
 const DiscountCodes = () => {
   const [codes, setCodes] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [total, setTotal] = useState(0);
+  const [page, setPage] = useState(0);
   const [showModal, setShowModal] = useState(false);
   const [editingCode, setEditingCode] = useState(null);
   const [formData, setFormData] = useState({
@@ -26,12 +28,15 @@ const DiscountCodes = () => {
 
   useEffect(() => {
     fetchCodes();
-  }, []);
+  }, [page]);
 
   const fetchCodes = async () => {
     try {
-      const response = await axios.get(`${API_URL}/api/discount-codes`);
-      setCodes(response.data);
+      const response = await axios.get(`${API_URL}/api/discount-codes`, {
+        params: { skip: page * 50, limit: 50 }
+      });
+      setCodes(response.data.discount_codes);
+      setTotal(response.data.total);
     } catch (error) {
       toast.error('خطا در دریافت کدها');
     } finally {
@@ -124,7 +129,7 @@ const DiscountCodes = () => {
       <div className="flex flex-col sm:flex-row sm:items-center sm:justify-between gap-4">
         <div>
           <h1 className="text-2xl font-bold text-white">کدهای تخفیف</h1>
-          <p className="text-slate-400 text-sm mt-1">{codes.length} کد</p>
+          <p className="text-slate-400 text-sm mt-1">{total} کد</p>
         </div>
         <div className="flex gap-2">
           <button onClick={fetchCodes} className="btn-secondary">
@@ -224,6 +229,19 @@ const DiscountCodes = () => {
         </div>
       </div>
 
+      {/* Pagination */}
+      {total > 50 && (
+        <div className="flex justify-center gap-2">
+          <button onClick={() => setPage(Math.max(0, page - 1))} disabled={page === 0} className="btn-secondary">
+            قبلی
+          </button>
+          <span className="px-4 py-2 text-slate-400">صفحه {page + 1} از {Math.ceil(total / 50)}</span>
+          <button onClick={() => setPage(page + 1)} disabled={(page + 1) * 50 >= total} className="btn-secondary">
+            بعدی
+          </button>
+        </div>
+      )}
+
       {/* Modal */}
       {showModal && (
         <div className="modal-overlay" onClick={() => setShowModal(false)}>
@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import axios from 'axios';
 import { RefreshCw, CheckCircle, XCircle, Clock, Image } from 'lucide-react';
 import toast from 'react-hot-toast';
+import useAdminEvents from '../utils/useAdminEvents';
 
 const API_URL = process.env.REACT_APP_BACKEND_URL;
 
@@ -18,11 +19,34 @@ const Payments = () => {
   const [selectedPayment, setSelectedPayment] = useState(null);
   const [reviewNote, setReviewNote] = useState('');
   const [processing, setProcessing] = useState(false);
+  const [receiptUrl, setReceiptUrl] = useState(null);
 
   useEffect(() => {
     fetchPayments();
   }, [page, statusFilter]);
 
+  useAdminEvents(['payment.created', 'order.status'], (events) => {
+    if (events.some((event) => event.type === 'payment.created')) {
+      toast('پرداخت جدید ثبت شد');
+    }
+    fetchPayments();
+  });
+
+  useEffect(() => {
+    if (!selectedPayment?.receipt_file_id) return;
+    let url = null;
+    axios.get(`${API_URL}/api/payments/${selectedPayment.id}/receipt`, { responseType: 'blob' })
+      .then((response) => {
+        url = URL.createObjectURL(response.data);
+        setReceiptUrl(url);
+      })
+      .catch(() => setReceiptUrl(null));
+    return () => {
+      if (url) URL.revokeObjectURL(url);
+      setReceiptUrl(null);
+    };
+  }, [selectedPayment]);
+
   const fetchPayments = async () => {
     try {
       const params = new URLSearchParams();
@@ -199,14 +223,17 @@ const Payments = () => {
               </div>
             </div>
 
-            {/* Receipt Image Placeholder */}
-            <div className="glass-card p-8 text-center mb-6">
-              <Image className="mx-auto text-slate-500 mb-2" size={48} />
-              <p className="text-slate-400 text-sm">تصویر رسید</p>
-              {selectedPayment.receipt_file_id && (
-                <p className="text-xs text-slate-500 mt-2 font-mono">{selectedPayment.receipt_file_id}</p>
-              )}
-            </div>
+            {/* Receipt Image */}
+            {receiptUrl ? (
+              <a href={receiptUrl} target="_blank" rel="noreferrer" className="block mb-6">
+                <img src={receiptUrl} alt="تصویر رسید" className="mx-auto max-h-80 rounded-lg" data-testid="receipt-image" />
+              </a>
+            ) : (
+              <div className="glass-card p-8 text-center mb-6">
+                <Image className="mx-auto text-slate-500 mb-2" size={48} />
+                <p className="text-slate-400 text-sm">تصویر رسید</p>
+              </div>
+            )}
 
             {selectedPayment.status === 'pending' && (
               <>
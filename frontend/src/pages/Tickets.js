@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import axios from 'axios';
 import { RefreshCw, MessageSquare, Send, Clock, CheckCircle, AlertCircle } from 'lucide-react';
 import toast from 'react-hot-toast';
+import useAdminEvents from '../utils/useAdminEvents';
 
 const API_URL = process.env.REACT_APP_BACKEND_URL;
 
@@ -28,6 +29,13 @@ const Tickets = () => {
     fetchData();
   }, [page, statusFilter, deptFilter]);
 
+  useAdminEvents(['ticket.created', 'ticket.reply'], (events) => {
+    if (selectedTicket && events.some((event) => event.data.ticket_id === selectedTicket.id)) {
+      handleViewTicket(selectedTicket.id);
+    }
+    fetchData();
+  });
+
   const fetchData = async () => {
     try {
       const [ticketsRes, deptsRes] = await Promise.all([
@@ -36,7 +44,8 @@ const Tickets = () => {
             status: statusFilter || undefined,
             department_id: deptFilter || undefined,
             skip: page * 50,
-            limit: 50
+            limit: 50,
+            fields: 'id,subject,status,priority,updated_at,department.name,user.first_name,user.username'
           }
         }),
         axios.get(`${API_URL}/api/departments`)
@@ -60,6 +69,24 @@ const Tickets = () => {
     }
   };
 
+  const handleLoadOlder = async () => {
+    if (!selectedTicket?.has_more_messages) return;
+    try {
+      const response = await axios.get(`${API_URL}/api/tickets/${selectedTicket.id}`, {
+        params: { before: selectedTicket.messages_before, before_id: selectedTicket.messages_before_id }
+      });
+      setSelectedTicket((current) => current?.id === response.data.id ? {
+        ...current,
+        messages: [...response.data.messages, ...current.messages],
+        has_more_messages: response.data.has_more_messages,
+        messages_before: response.data.messages_before,
+        messages_before_id: response.data.messages_before_id
+      } : current);
+    } catch (error) {
+      toast.error('خطا در دریافت پیام‌ها');
+    }
+  };
+
   const handleReply = async () => {
     if (!replyMessage.trim() || !selectedTicket) return;
     setSending(true);
@@ -208,6 +235,13 @@ const Tickets = () => {
 
               {/* Messages */}
               <div className="flex-1 overflow-y-auto p-4 space-y-4">
+                {selectedTicket.has_more_messages && (
+                  <div className="flex justify-center">
+                    <button onClick={handleLoadOlder} className="btn-secondary text-xs">
+                      پیام‌های قدیمی‌تر
+                    </button>
+                  </div>
+                )}
                 {selectedTicket.messages?.map((msg) => (
                   <div
                     key={msg.id}
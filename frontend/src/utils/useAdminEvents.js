@@ -0,0 +1,68 @@
+import { useEffect, useRef } from 'react';
+import axios from 'axios';
+
+const API_URL = process.env.REACT_APP_BACKEND_URL;
+const RECONNECT_DELAY = 5000;
+
+// Subscribe to /api/events (Server-Sent Events) and call onEvent for the given types.
+// Bursts are coalesced, so a page refetching on each call does it once per burst.
+// The stream is opened with a short-lived stream token (EventSource cannot send headers);
+// once it has expired the browser's own reconnect is refused, so a fresh one is fetched.
+const useAdminEvents = (types, onEvent, delay = 500) => {
+  const handler = useRef(onEvent);
+  handler.current = onEvent;
+  const typesKey = types.join(',');
+
+  useEffect(() => {
+    if (!localStorage.getItem('token')) return undefined;
+
+    let source = null;
+    let timer = null;
+    let reconnectTimer = null;
+    let closed = false;
+    let pending = [];
+
+    const listener = (message) => {
+      pending.push(JSON.parse(message.data));
+      if (timer) return;
+      timer = setTimeout(() => {
+        const batch = pending;
+        pending = [];
+        timer = null;
+        handler.current(batch);
+      }, delay);
+    };
+
+    const reconnect = () => {
+      if (!closed) reconnectTimer = setTimeout(connect, RECONNECT_DELAY);
+    };
+
+    const connect = async () => {
+      let token;
+      try {
+        const response = await axios.post(`${API_URL}/api/events/token`);
+        token = response.data.token;
+      } catch (error) {
+        reconnect();
+        return;
+      }
+      if (closed) return;
+      const params = new URLSearchParams({ token, types: typesKey });
+      source = new EventSource(`${API_URL}/api/events?${params}`);
+      typesKey.split(',').forEach((type) => source.addEventListener(type, listener));
+      source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) reconnect();
+      };
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(timer);
+      clearTimeout(reconnectTimer);
+      if (source) source.close();
+    };
+  }, [typesKey, delay]);
+};
+
+export default useAdminEvents;
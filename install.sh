@@ -128,7 +128,10 @@ Type=simple
 User=root
 WorkingDirectory=$INSTALL_DIR/backend
 Environment=PATH=$INSTALL_DIR/backend/venv/bin
-ExecStart=$INSTALL_DIR/backend/venv/bin/uvicorn server:app --host 0.0.0.0 --port $API_PORT
+Environment=PORT=$API_PORT
+ExecStart=$INSTALL_DIR/backend/venv/bin/python run.py
+KillSignal=SIGTERM
+TimeoutStopSec=40
 Restart=always
 RestartSec=5
 